@@ -1,11 +1,108 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
-#include <pigpio.h>
 #include <stdio.h>
 #include <time.h>
 #include <math.h>
 #include <stdbool.h>
 #include <pthread.h>
+#include <sched.h>
+#include <sys/mman.h>
+#include <errno.h>
+#include <string.h>
+#include <stddef.h>
+#include <stdatomic.h>
+#ifdef SIMULATE_GPIO
+// Simulated GPIO for running without a Pi (build with -DSIMULATE_GPIO and without -lpigpio):
+// pin levels are kept in memory and every change is recorded with its CLOCK_MONOTONIC time.
+#include <stdatomic.h>
+#include <stdlib.h>
+#define SIMULATED 1
+#define PI_OUTPUT 1
+#define SIM_GPIOS 54
+#define SIM_EDGES_SIZE (1 << 20)
+
+struct SimEdge {
+    long long time_ns;
+    unsigned char gpio;
+    unsigned char level;
+};
+static struct SimEdge* g_sim_edges = NULL;
+static atomic_size_t g_sim_edges_length = 0;
+static atomic_llong g_sim_edges_lost = 0;
+static atomic_int g_sim_levels[SIM_GPIOS];
+
+static int gpioInitialise(void)
+{
+    if (g_sim_edges == NULL) {
+        g_sim_edges = malloc(SIM_EDGES_SIZE * sizeof(struct SimEdge));
+    }
+    return g_sim_edges == NULL ? -1 : 0;
+}
+
+static void gpioTerminate(void) {}
+
+static int gpioSetMode(unsigned gpio, unsigned mode)
+{
+    return gpio < SIM_GPIOS ? 0 : -1;
+}
+
+static int gpioWrite(unsigned gpio, unsigned level)
+{
+    if (gpio >= SIM_GPIOS || level > 1) {
+        return -1;
+    }
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    if (atomic_exchange(&g_sim_levels[gpio], level) == (int)level) {
+        return 0; // not an edge
+    }
+    size_t i = atomic_fetch_add(&g_sim_edges_length, 1);
+    if (i >= SIM_EDGES_SIZE) {
+        atomic_store(&g_sim_edges_length, SIM_EDGES_SIZE);
+        atomic_fetch_add(&g_sim_edges_lost, 1);
+        return 0;
+    }
+    g_sim_edges[i] = (struct SimEdge){now.tv_sec * 1000000000LL + now.tv_nsec, gpio, level};
+    return 0;
+}
+
+static PyObject* sim_edges(PyObject* self, PyObject* args)
+{
+    int clear = 0;
+    if (!PyArg_ParseTuple(args, "|p", &clear)) {
+        return NULL;
+    }
+    size_t length = atomic_load(&g_sim_edges_length);
+    if (length > SIM_EDGES_SIZE) {
+        length = SIM_EDGES_SIZE;
+    }
+    PyObject* edges = PyList_New(length);
+    if (edges == NULL) {
+        return NULL;
+    }
+    for (size_t i = 0; i < length; i++) {
+        struct SimEdge edge = g_sim_edges[i];
+        PyObject* item = Py_BuildValue("(Lii)", edge.time_ns, edge.gpio, edge.level);
+        if (item == NULL) {
+            Py_DECREF(edges);
+            return NULL;
+        }
+        PyList_SET_ITEM(edges, i, item);
+    }
+    if (clear) {
+        atomic_store(&g_sim_edges_length, 0);
+    }
+    return edges;
+}
+
+static PyObject* sim_edges_lost(PyObject* self, PyObject* noarg)
+{
+    return PyLong_FromLongLong(atomic_load(&g_sim_edges_lost));
+}
+#else
+#include <pigpio.h>
+#define SIMULATED 0
+#endif
 #define ASSERT_SUCCESS(status, msg) \
     if (status < 0) { \
         PyErr_SetString(PyExc_Exception, msg); \
@@ -33,11 +130,7 @@
 #define DIR_PIN 23
 #define ENABLE_PIN 4
 #define ROTATION_PER_STEP (M_PI/800)
-#define INERTIA_PLATFORM2WHEEL_RATIO 6.23 
-#define CALCULATION_TIME_NS 260
-#define WRITING_TIME_NS 1100
-#define INIT_TIME_NS 6000 // 3000-80000 ns
-#define CALCULATION_TIME_ALL_NS 350000
+#define NANO 1000000000
 #define TIME_CALC_START \
     struct timespec start, end; \
     int elapsed; \
@@ -63,63 +156,346 @@ static void write_dir(int value)
     }
 }
 
-static PyObject* generate_signal_prep(PyObject* self, PyObject* args)
+// Telemetry: every STEP edge and every command is recorded in a preallocated ring that Python
+// reads without copying (telemetry_buffer, telemetry_read). Record layout, 40 bytes in native byte order:
+// sequence q, planned_ns q, actual_ns q, segment i, value i, kind B, direction B, level B, 5 padding bytes.
+// `sequence` is the event index + 1, stored last, so a reader can tell records that are still being written.
+#define TELEMETRY_SIZE 16384 // events, power of two
+#define TELEMETRY_PULSE 1 // edge of STEP: planned deadline and actual write time, value unused
+#define TELEMETRY_COMMAND 2 // command taken by the server: received and taken time, value in steps
+#define TELEMETRY_STOP 3 // end of a maneuver, value is the remaining angle in steps
+
+struct TelemetryEvent {
+    _Atomic long long sequence;
+    long long planned_ns;
+    long long actual_ns;
+    int segment;
+    int value;
+    unsigned char kind;
+    unsigned char direction;
+    unsigned char level;
+    unsigned char padding[5];
+};
+_Static_assert(sizeof(struct TelemetryEvent) == 40, "Telemetry record layout changed");
+
+static struct TelemetryEvent g_telemetry[TELEMETRY_SIZE];
+static atomic_llong g_telemetry_head = 0; // number of recorded events
+static atomic_int g_segment = 0; // id of the last started pulse sequence
+
+static void telemetry_record(int kind, long long planned_ns, long long actual_ns, int segment, long value, int level)
 {
-    float acceleration, duration;
-    int freq;
-    if (!PyArg_ParseTuple(args, "fif", &acceleration, &freq, &duration))
-    {
+    long long index = atomic_fetch_add_explicit(&g_telemetry_head, 1, memory_order_relaxed);
+    struct TelemetryEvent* event = &g_telemetry[index % TELEMETRY_SIZE];
+    atomic_store_explicit(&event->sequence, 0, memory_order_relaxed);
+    atomic_thread_fence(memory_order_release);
+    event->planned_ns = planned_ns;
+    event->actual_ns = actual_ns;
+    event->segment = segment;
+    event->value = (int)value;
+    event->kind = kind;
+    event->direction = dir_value;
+    event->level = level;
+    atomic_store_explicit(&event->sequence, index + 1, memory_order_release);
+}
+
+static PyObject* telemetry_buffer(PyObject* self, PyObject* noarg)
+{
+    return PyMemoryView_FromMemory((char*)g_telemetry, sizeof(g_telemetry), PyBUF_READ);
+}
+
+static PyObject* telemetry_cursor(PyObject* self, PyObject* noarg)
+{
+    return PyLong_FromLongLong(atomic_load(&g_telemetry_head));
+}
+
+static PyObject* telemetry_read(PyObject* self, PyObject* args)
+{
+    long long cursor;
+    if (!PyArg_ParseTuple(args, "L", &cursor)) {
         return NULL;
     }
+    long long head = atomic_load(&g_telemetry_head);
+    if (cursor < 0 || cursor > head) {
+        PyErr_SetString(PyExc_Exception, "Telemetry cursor out of range");
+        return NULL;
+    }
+    long long lost = 0;
+    if (head - cursor > TELEMETRY_SIZE) {
+        lost = head - TELEMETRY_SIZE - cursor;
+        cursor = head - TELEMETRY_SIZE;
+    }
 
-    Py_BEGIN_ALLOW_THREADS
+    // Events cursor..head are at most two slices of the ring
+    PyObject* views = PyList_New(0);
+    if (views == NULL) {
+        return NULL;
+    }
+    long long start = cursor % TELEMETRY_SIZE;
+    long long count = head - cursor;
+    long long first = count < TELEMETRY_SIZE - start ? count : TELEMETRY_SIZE - start;
+    long long slices[2][2] = {{start, first}, {0, count - first}};
+    for (int i = 0; i < 2; i++) {
+        if (slices[i][1] == 0) {
+            continue;
+        }
+        PyObject* view = PyMemoryView_FromMemory((char*)&g_telemetry[slices[i][0]],
+            slices[i][1] * sizeof(struct TelemetryEvent), PyBUF_READ);
+        if (view == NULL || PyList_Append(views, view) < 0) {
+            Py_XDECREF(view);
+            Py_DECREF(views);
+            return NULL;
+        }
+        Py_DECREF(view);
+    }
+    return Py_BuildValue("(LLN)", head, lost, views);
+}
 
-    SLEEP_PREP
-    float time_passed = 0.0;
-    float impulse_duration = fabs(1.0 / freq);
+// Pulse engine: every edge is written at an absolute CLOCK_MONOTONIC deadline (planned cumulative time).
+// The thread wakes up earlier by the measured gpioWrite and wakeup overheads,
+// which are calibrated at module init and adapted after every edge.
+#define OVERHEAD_WEIGHT 0.05 // weight of the newest measurement in the overhead averages
+#define OUTLIER_NS 1000000 // wakeups later than this don't update the overhead average
+#define RESYNC_FRACTION 0.1 // lateness above this fraction of the half-period shifts the schedule (a resync)
+#define CALIBRATION_SAMPLES 200
+#define CALIBRATION_SLEEP_NS 100000
+
+static double g_write_overhead_ns = 0.0;
+static double g_wakeup_overhead_ns = 0.0;
+
+// Timing of one maneuver
+struct PulseTiming {
+    long long edges;
+    long long resyncs;
+    long long drift_ns; // last edge: achieved - planned cumulative time
+    long long error_sum_ns; // sum of |achieved - deadline| of all edges
+    long long max_lateness_ns;
+};
+static struct PulseTiming g_last_timing = {0};
+
+struct Pulser {
+    long long start;
+    long long planned; // planned time of the next edge since start
+    long long deadline;
+    long long interval; // last planned time between edges (the current half-period)
+    int segment; // telemetry id of the pulse sequence
+    struct PulseTiming timing;
+};
 
-    int wait_times[20000];
-    int wait_times_length = 0;
+static long long now_ns(void)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec * (long long)NANO + now.tv_nsec;
+}
 
-    while (time_passed < duration)
-    {
-        int sleep_time = (int)(impulse_duration * 500000000);
-        time_passed += impulse_duration;
-        freq = freq + acceleration * impulse_duration;
-        impulse_duration = fabs(1.0 / freq);
+static void sleep_until_ns(long long deadline)
+{
+    struct timespec ts = {.tv_sec = deadline / NANO, .tv_nsec = deadline % NANO};
+    while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &ts, NULL) == EINTR);
+}
 
-        wait_times[wait_times_length++] = sleep_time;
+static void calibrate_overheads(void)
+{
+    long long total = 0;
+    for (int i = 0; i < CALIBRATION_SAMPLES; i++) {
+        long long before = now_ns();
+        gpioWrite(STEP_PIN, 0); // already low, no step is made
+        total += now_ns() - before;
     }
+    g_write_overhead_ns = (double)total / CALIBRATION_SAMPLES;
 
-    int wait_times_reversed[20000];
-    int wait_times_reversed_length = 0;
-    time_passed = 0.0;
+    total = 0;
+    for (int i = 0; i < CALIBRATION_SAMPLES / 10; i++) {
+        long long deadline = now_ns() + CALIBRATION_SLEEP_NS;
+        sleep_until_ns(deadline);
+        total += now_ns() - deadline;
+    }
+    g_wakeup_overhead_ns = (double)total / (CALIBRATION_SAMPLES / 10);
+}
 
-    while (time_passed < duration)
-    {
-        int sleep_time = (int)(impulse_duration * 500000000);
-        time_passed += impulse_duration;
-        freq = freq - acceleration * impulse_duration;
-        impulse_duration = fabs(1.0 / freq);
+// `start` is the time of the first edge
+static void pulser_start(struct Pulser* pulser, long long start)
+{
+    pulser->start = start;
+    pulser->deadline = start;
+    pulser->planned = 0;
+    pulser->interval = 0;
+    pulser->timing = (struct PulseTiming){0};
+    pulser->segment = atomic_fetch_add(&g_segment, 1) + 1;
+}
+
+static void pulser_wait(struct Pulser* pulser, long long nanoseconds)
+{
+    pulser->deadline += nanoseconds;
+    pulser->planned += nanoseconds;
+    pulser->interval = nanoseconds;
+}
 
-        wait_times_reversed[wait_times_reversed_length++] = sleep_time;
+// Returns the time the edge was written
+static long long pulse_edge(struct Pulser* pulser, int level)
+{
+    long long wake_at = pulser->deadline - (long long)(g_write_overhead_ns + g_wakeup_overhead_ns);
+    sleep_until_ns(wake_at);
+    long long woken = now_ns();
+    if (woken - wake_at < OUTLIER_NS) { // otherwise the deadline had already passed
+        g_wakeup_overhead_ns += OVERHEAD_WEIGHT * ((woken - wake_at) - g_wakeup_overhead_ns);
     }
-    
-    for (int i = 0; i < wait_times_length; i++)
+    // A too large wakeup overhead estimate wakes the thread early, the edge must still not come early
+    long long write_at = pulser->deadline - (long long)g_write_overhead_ns;
+    long long before_write = woken;
+    while (before_write < write_at) {
+        before_write = now_ns();
+    }
+    gpioWrite(STEP_PIN, level);
+    long long written = now_ns();
+    g_write_overhead_ns += OVERHEAD_WEIGHT * ((written - before_write) - g_write_overhead_ns);
+
+    telemetry_record(TELEMETRY_PULSE, pulser->deadline, written, pulser->segment, 0, level);
+
+    long long error = written - pulser->deadline;
+    struct PulseTiming* timing = &pulser->timing;
+    timing->edges++;
+    timing->error_sum_ns += llabs(error);
+    if (error > timing->max_lateness_ns) {
+        timing->max_lateness_ns = error;
+    }
+    timing->drift_ns = written - (pulser->start + pulser->planned);
+    // A late edge keeps the absolute schedule, the next half-period is shortened by at most
+    // RESYNC_FRACTION, so wakeup lateness doesn't add up. After a longer stall the schedule is shifted:
+    // catching up would be a burst of steps the motor cannot follow
+    if (error > RESYNC_FRACTION * pulser->interval) {
+        pulser->deadline += error;
+        timing->resyncs++;
+    }
+    return written;
+}
+
+static void pulser_end(struct Pulser* pulser)
+{
+    g_last_timing = pulser->timing;
+}
+
+static PyObject* get_timing(PyObject* self, PyObject* noarg)
+{
+    struct PulseTiming timing = g_last_timing;
+    return Py_BuildValue("{s:d,s:d,s:L,s:L,s:L,s:L,s:L}",
+        "write_overhead_ns", g_write_overhead_ns,
+        "wakeup_overhead_ns", g_wakeup_overhead_ns,
+        "edges", timing.edges,
+        "resyncs", timing.resyncs,
+        "drift_ns", timing.drift_ns,
+        "error_sum_ns", timing.error_sum_ns,
+        "max_lateness_ns", timing.max_lateness_ns);
+}
+
+// Streaming schedule of generate_signal_prep: half-periods are computed just ahead of the pulse loop
+// into a small ring, so the memory does not depend on the maneuver length.
+// The deceleration makes as many pulses as the acceleration did, mirroring the rotation.
+#define SCHEDULE_RING_SIZE 64 // power of two
+#define SCHEDULE_LOOKAHEAD 4 // half-periods computed before the first edge
+
+struct Schedule {
+    double acceleration;
+    double duration;
+    int start_freq;
+    int freq;
+    float time_passed;
+    float impulse_duration;
+    bool decelerating;
+    bool finished;
+    long long accelerating_pulses;
+    long long pulses; // pulses of the current phase
+    int ring[SCHEDULE_RING_SIZE];
+    unsigned head;
+    unsigned tail;
+};
+
+static void schedule_start(struct Schedule* schedule, double acceleration, int freq, double duration)
+{
+    *schedule = (struct Schedule){
+        .acceleration = acceleration,
+        .duration = duration,
+        .start_freq = freq,
+        .freq = freq,
+        .impulse_duration = fabs(1.0 / freq),
+    };
+}
+
+// Next half-period in nanoseconds, -1 after the last pulse
+static int schedule_next(struct Schedule* schedule)
+{
+    if (!schedule->decelerating && schedule->time_passed >= schedule->duration) {
+        schedule->decelerating = true;
+        schedule->accelerating_pulses = schedule->pulses;
+        schedule->pulses = 0;
+    }
+    if (schedule->decelerating && schedule->pulses >= schedule->accelerating_pulses) {
+        return -1;
+    }
+
+    int sleep_time = (int)(schedule->impulse_duration * 500000000);
+    double change = schedule->acceleration * schedule->impulse_duration;
+    schedule->time_passed += schedule->impulse_duration;
+    schedule->freq = schedule->freq + (schedule->decelerating ? -change : change);
+    if (schedule->decelerating && (schedule->freq - schedule->start_freq) * schedule->acceleration < 0) {
+        schedule->freq = schedule->start_freq; // rounding must not take it past the start frequency
+    }
+    schedule->impulse_duration = fabs(1.0 / schedule->freq);
+    schedule->pulses++;
+    return sleep_time;
+}
+
+// Compute half-periods until `count` of them are waiting in the ring
+static void schedule_fill(struct Schedule* schedule, unsigned count)
+{
+    while (!schedule->finished && schedule->head - schedule->tail < count) {
+        int sleep_time = schedule_next(schedule);
+        if (sleep_time < 0) {
+            schedule->finished = true;
+            break;
+        }
+        schedule->ring[schedule->head++ % SCHEDULE_RING_SIZE] = sleep_time;
+    }
+}
+
+static int schedule_pop(struct Schedule* schedule)
+{
+    schedule_fill(schedule, 1);
+    if (schedule->head == schedule->tail) {
+        return -1;
+    }
+    return schedule->ring[schedule->tail++ % SCHEDULE_RING_SIZE];
+}
+
+static PyObject* generate_signal_prep(PyObject* self, PyObject* args)
+{
+    float acceleration, duration;
+    int freq;
+    if (!PyArg_ParseTuple(args, "fif", &acceleration, &freq, &duration))
     {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(wait_times[i] - WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(wait_times[i] - WRITING_TIME_NS)
+        return NULL;
     }
 
-    for (int i = 0; i < wait_times_reversed_length; i++)
+    Py_BEGIN_ALLOW_THREADS
+
+    struct Schedule schedule;
+    schedule_start(&schedule, acceleration, freq, duration);
+    schedule_fill(&schedule, SCHEDULE_LOOKAHEAD);
+
+    struct Pulser pulser;
+    pulser_start(&pulser, now_ns());
+
+    int sleep_time;
+    while ((sleep_time = schedule_pop(&schedule)) >= 0)
     {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(wait_times_reversed[i] - WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(wait_times_reversed[i] - WRITING_TIME_NS)
+        pulse_edge(&pulser, 1);
+        pulser_wait(&pulser, sleep_time);
+        schedule_fill(&schedule, SCHEDULE_RING_SIZE); // while STEP is high
+        pulse_edge(&pulser, 0);
+        pulser_wait(&pulser, sleep_time);
     }
+    sleep_until_ns(pulser.deadline);
+    pulser_end(&pulser);
 
     Py_END_ALLOW_THREADS
 
@@ -133,11 +509,8 @@ static PyObject* generate_signal(PyObject* self, PyObject* args) // makes 2x mor
 
     // Start signal ASAP
     gpioWrite(STEP_PIN, 1);
-
-    // Start "init time" measurement
-    struct timespec start, end;
-    int init_time;
-    clock_gettime(CLOCK_MONOTONIC, &start);
+    struct Pulser pulser;
+    pulser_start(&pulser, now_ns());
 
     // Get parameters
     double duration, acceleration;
@@ -159,39 +532,34 @@ static PyObject* generate_signal(PyObject* self, PyObject* args) // makes 2x mor
     }
     
     // Prepare variable for signal generation
-    SLEEP_PREP
     double time_passed = 0.0;
     double impulse_duration = 1.0 / freq;
     double sleep_time;
 
-    // Get "init time"
-    clock_gettime(CLOCK_MONOTONIC, &end);
-    init_time = (end.tv_sec - start.tv_sec) * 1000000000 + (end.tv_nsec - start.tv_nsec);
-
-    // Finish first impulse (started before getting parameters)
+    // Finish first impulse (started before getting parameters, deadlines absorb the parsing time)
     sleep_time = (int)(impulse_duration * 500000000);
     time_passed += impulse_duration;
     impulse_duration = 1.0 / (freq + acceleration * time_passed);
-    SLEEP(sleep_time-WRITING_TIME_NS-CALCULATION_TIME_NS-init_time)
-    gpioWrite(STEP_PIN, 0);
+    pulser_wait(&pulser, sleep_time);
+    pulse_edge(&pulser, 0);
 
     // Generate the rest of the impulses
     while (time_passed < duration)
     {
-        SLEEP(sleep_time-WRITING_TIME_NS-CALCULATION_TIME_NS)
+        pulser_wait(&pulser, sleep_time);
         sleep_time = (int)(impulse_duration * 500000000);
         time_passed += impulse_duration;
         impulse_duration = 1.0 / (freq + acceleration * time_passed);
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(sleep_time-WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
+        pulse_edge(&pulser, 1);
+        pulser_wait(&pulser, sleep_time);
+        pulse_edge(&pulser, 0);
     }
+    pulser_end(&pulser);
 
-    // Set minimum time for next signal
-    clock_gettime(CLOCK_MONOTONIC, &signal_min_start);
-    const long long nsec = signal_min_start.tv_nsec + sleep_time - WRITING_TIME_NS;
-    signal_min_start.tv_sec += nsec / 1000000000;
-    signal_min_start.tv_nsec = nsec % 1000000000;
+    // Set minimum time for next signal (end of the last impulse)
+    pulser_wait(&pulser, sleep_time);
+    signal_min_start.tv_sec = pulser.deadline / NANO;
+    signal_min_start.tv_nsec = pulser.deadline % NANO;
 
     Py_END_ALLOW_THREADS
 
@@ -226,17 +594,20 @@ static double get_angle(struct Quaternion q1, struct Quaternion q2)
 
 static void generate_signal_internal(double freq, double duration) {
     double impulse_duration = fabs(1.0 / freq);
-    int sleep_time = (int)(impulse_duration * 500000000) - WRITING_TIME_NS;
+    int sleep_time = (int)(impulse_duration * 500000000);
     int impulses_count = (int)floor(duration / impulse_duration);
-    SLEEP_PREP
+    struct Pulser pulser;
+    pulser_start(&pulser, now_ns());
 
     for (int i = 0; i < impulses_count; i++)
     {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(sleep_time)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(sleep_time)
+        pulse_edge(&pulser, 1);
+        pulser_wait(&pulser, sleep_time);
+        pulse_edge(&pulser, 0);
+        pulser_wait(&pulser, sleep_time);
     }
+    sleep_until_ns(pulser.deadline);
+    pulser_end(&pulser);
 }
 
 static pthread_mutex_t lock = PTHREAD_MUTEX_INITIALIZER;
@@ -248,16 +619,307 @@ static double g_frequency = 0.0;
 static double g_acceleration = 0.0;
 static long g_angle = 0;
 #define INTERVAL 0.05
-#define REACH_TIME (INTERVAL*4)
-#define MAX_FREQUENCY 7500
-#define MAX_ACCELERATION 24000
-#define MIN_FREQUENCY 200
+
+// Controller parameters, tunable from Python while the server runs (get_params, set_params).
+// set_params writes the inactive copy and the server thread swaps it in between maneuvers,
+// so a maneuver never sees a partly updated set.
+struct Params {
+    double inertia_ratio; // platform to wheel inertia ratio
+    double min_frequency; // steps/s the motor can start and stop at
+    double max_frequency;
+    double max_acceleration; // steps/s^2
+    double reach_time; // seconds to reach a new target
+};
+#define DEFAULT_PARAMS { \
+    .inertia_ratio = 6.23, \
+    .min_frequency = 200, \
+    .max_frequency = 7500, \
+    .max_acceleration = 24000, \
+    .reach_time = (INTERVAL*4), \
+}
+static struct Params g_params_copies[2] = {DEFAULT_PARAMS, DEFAULT_PARAMS};
+
+#define MAX_FREQUENCY_LIMIT 1000000 // steps/s, shorter half-periods than 500 ns can't be timed
+struct ParamField {
+    const char* name;
+    size_t offset;
+    bool zero_allowed;
+    double limit; // values must be below it
+};
+static const struct ParamField PARAM_FIELDS[] = {
+    {"inertia_ratio", offsetof(struct Params, inertia_ratio), false, INFINITY},
+    {"min_frequency", offsetof(struct Params, min_frequency), false, MAX_FREQUENCY_LIMIT},
+    {"max_frequency", offsetof(struct Params, max_frequency), false, MAX_FREQUENCY_LIMIT},
+    {"max_acceleration", offsetof(struct Params, max_acceleration), false, INFINITY},
+    {"reach_time", offsetof(struct Params, reach_time), false, INFINITY},
+};
+
+static pthread_mutex_t params_lock = PTHREAD_MUTEX_INITIALIZER; // held by set_params while writing the inactive copy
+static struct Params* _Atomic g_params = &g_params_copies[0]; // active copy
+static atomic_bool g_params_pending = false; // inactive copy holds new parameters
+
+// Makes new parameters active. Called by the server thread between maneuvers, never blocks.
+static void swap_params(void)
+{
+    if (!atomic_load(&g_params_pending) || pthread_mutex_trylock(&params_lock) != 0) {
+        return;
+    }
+    g_params = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    atomic_store(&g_params_pending, false);
+    pthread_mutex_unlock(&params_lock);
+}
+
+static PyObject* params_dict(const struct Params* params)
+{
+    PyObject* dict = PyDict_New();
+    if (dict == NULL) {
+        return NULL;
+    }
+    for (size_t i = 0; i < sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0]); i++) {
+        PyObject* value = PyFloat_FromDouble(*(const double*)((const char*)params + PARAM_FIELDS[i].offset));
+        if (value == NULL || PyDict_SetItemString(dict, PARAM_FIELDS[i].name, value) < 0) {
+            Py_XDECREF(value);
+            Py_DECREF(dict);
+            return NULL;
+        }
+        Py_DECREF(value);
+    }
+    return dict;
+}
+
+static PyObject* get_params(PyObject* self, PyObject* noarg)
+{
+    pthread_mutex_lock(&params_lock);
+    struct Params params = *g_params;
+    bool pending = atomic_load(&g_params_pending);
+    struct Params next = *(g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0]);
+    pthread_mutex_unlock(&params_lock);
+
+    PyObject* result = params_dict(&params);
+    if (result == NULL) {
+        return NULL;
+    }
+    PyObject* pending_params = pending ? params_dict(&next) : Py_NewRef(Py_None);
+    if (pending_params == NULL || PyDict_SetItemString(result, "pending", pending_params) < 0) {
+        Py_XDECREF(pending_params);
+        Py_DECREF(result);
+        return NULL;
+    }
+    Py_DECREF(pending_params);
+    return result;
+}
+
+static PyObject* set_params(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    if (PyTuple_GET_SIZE(args) != 0) {
+        PyErr_SetString(PyExc_Exception, "Parameters are given as keywords");
+        return NULL;
+    }
+
+    pthread_mutex_lock(&params_lock);
+    struct Params* next = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    struct Params params = atomic_load(&g_params_pending) ? *next : *g_params;
+    pthread_mutex_unlock(&params_lock);
+
+    PyObject* key;
+    PyObject* value;
+    Py_ssize_t position = 0;
+    while (kwargs != NULL && PyDict_Next(kwargs, &position, &key, &value)) {
+        const char* name = PyUnicode_AsUTF8(key);
+        if (name == NULL) {
+            return NULL;
+        }
+        size_t i = 0;
+        while (i < sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0]) && strcmp(PARAM_FIELDS[i].name, name) != 0) {
+            i++;
+        }
+        if (i == sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0])) {
+            PyErr_Format(PyExc_Exception, "Unknown parameter: %s", name);
+            return NULL;
+        }
+        double number = PyFloat_AsDouble(value);
+        if (number == -1.0 && PyErr_Occurred()) {
+            return NULL;
+        }
+        if (!isfinite(number) || number < 0 || (number == 0 && !PARAM_FIELDS[i].zero_allowed) || number >= PARAM_FIELDS[i].limit) {
+            PyErr_Format(PyExc_Exception, "Invalid value of %s: %R", name, value);
+            return NULL;
+        }
+        *(double*)((char*)&params + PARAM_FIELDS[i].offset) = number;
+    }
+    if (params.min_frequency >= params.max_frequency) {
+        PyErr_SetString(PyExc_Exception, "min_frequency must be lower than max_frequency");
+        return NULL;
+    }
+
+    // Parameters are checked before anything is written, so they are applied all or none
+    pthread_mutex_lock(&params_lock);
+    next = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    *next = params;
+    atomic_store(&g_params_pending, true);
+    pthread_mutex_unlock(&params_lock);
+    if (!g_server_is_running) {
+        swap_params();
+    }
+
+    Py_RETURN_NONE;
+}
+
+// Real-time options of the rotation server thread, given to the server start functions
+#define RT_MAX_PREFAULT_STACK (4*1024*1024) // default thread stack is 8 MiB
+struct RtOptions {
+    int priority; // SCHED_FIFO priority, 0 keeps SCHED_OTHER
+    int cpu; // CPU the thread is pinned to, -1 for any
+    int lock_memory; // mlockall(MCL_CURRENT | MCL_FUTURE)
+    Py_ssize_t prefault_stack; // bytes of stack touched before the first pulse
+};
+// What was actually applied, filled by the server thread (errno of every failed option)
+struct RtStatus {
+    bool applied;
+    struct RtOptions requested;
+    int policy;
+    int priority;
+    unsigned long cpus;
+    bool memory_locked;
+    Py_ssize_t stack_prefaulted;
+    int priority_error;
+    int cpu_error;
+    int lock_memory_error;
+};
+static struct RtOptions g_rt_options = {0, -1, 0, 0};
+static struct RtStatus g_rt_status = {.applied = false};
+static pthread_cond_t rt_applied = PTHREAD_COND_INITIALIZER;
+
+static void prefault_stack(Py_ssize_t size)
+{
+    unsigned char stack[size];
+    for (Py_ssize_t i = 0; i < size; i += 4096) {
+        stack[i] = 0;
+    }
+    __asm__ volatile("" : : "r"(stack) : "memory"); // keep the writes
+}
+
+// Called by the server thread before its loop, start function waits for it
+static void apply_rt_options(void)
+{
+    struct RtStatus status = {.requested = g_rt_options};
+
+    if (g_rt_options.lock_memory) {
+        status.lock_memory_error = mlockall(MCL_CURRENT | MCL_FUTURE) < 0 ? errno : 0;
+        status.memory_locked = status.lock_memory_error == 0;
+    }
+    if (g_rt_options.prefault_stack > 0) {
+        prefault_stack(g_rt_options.prefault_stack);
+        status.stack_prefaulted = g_rt_options.prefault_stack;
+    }
+    if (g_rt_options.cpu >= 0) {
+        cpu_set_t cpus;
+        CPU_ZERO(&cpus);
+        CPU_SET(g_rt_options.cpu, &cpus);
+        status.cpu_error = pthread_setaffinity_np(pthread_self(), sizeof(cpus), &cpus);
+    }
+    if (g_rt_options.priority > 0) {
+        struct sched_param param = {.sched_priority = g_rt_options.priority};
+        status.priority_error = pthread_setschedparam(pthread_self(), SCHED_FIFO, &param);
+    }
+
+    // Read back what the kernel applied
+    struct sched_param param;
+    pthread_getschedparam(pthread_self(), &status.policy, &param);
+    status.priority = param.sched_priority;
+    cpu_set_t cpus;
+    if (pthread_getaffinity_np(pthread_self(), sizeof(cpus), &cpus) == 0) {
+        for (int cpu = 0; cpu < (int)(8 * sizeof(status.cpus)); cpu++) {
+            if (CPU_ISSET(cpu, &cpus)) {
+                status.cpus |= 1UL << cpu;
+            }
+        }
+    }
+
+    pthread_mutex_lock(&lock);
+    status.applied = true;
+    g_rt_status = status;
+    pthread_cond_signal(&rt_applied);
+    pthread_mutex_unlock(&lock);
+}
+
+static int parse_rt_options(PyObject* args, PyObject* kwargs, struct RtOptions* options)
+{
+    static char* keywords[] = {"priority", "cpu", "lock_memory", "prefault_stack", NULL};
+    *options = (struct RtOptions){0, -1, 0, 0};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|iipn", keywords,
+            &options->priority, &options->cpu, &options->lock_memory, &options->prefault_stack))
+    {
+        return -1;
+    }
+    if (options->priority < 0 || options->priority > sched_get_priority_max(SCHED_FIFO)) {
+        PyErr_Format(PyExc_ValueError, "priority must be between 0 and %d", sched_get_priority_max(SCHED_FIFO));
+        return -1;
+    }
+    if (options->cpu >= CPU_SETSIZE) {
+        PyErr_SetString(PyExc_ValueError, "cpu out of range");
+        return -1;
+    }
+    if (options->prefault_stack < 0 || options->prefault_stack > RT_MAX_PREFAULT_STACK) {
+        PyErr_Format(PyExc_ValueError, "prefault_stack must be between 0 and %d bytes", RT_MAX_PREFAULT_STACK);
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject* get_rt_status(PyObject* self, PyObject* noarg)
+{
+    struct RtStatus status;
+    Py_BEGIN_ALLOW_THREADS
+    pthread_mutex_lock(&lock);
+    status = g_rt_status;
+    pthread_mutex_unlock(&lock);
+    Py_END_ALLOW_THREADS
+
+    if (!status.applied) {
+        Py_RETURN_NONE;
+    }
+    PyObject* cpus = PyList_New(0);
+    if (cpus == NULL) {
+        return NULL;
+    }
+    for (int cpu = 0; cpu < (int)(8 * sizeof(status.cpus)); cpu++) {
+        if (status.cpus & (1UL << cpu)) {
+            PyObject* value = PyLong_FromLong(cpu);
+            if (value == NULL || PyList_Append(cpus, value) < 0) {
+                Py_XDECREF(value);
+                Py_DECREF(cpus);
+                return NULL;
+            }
+            Py_DECREF(value);
+        }
+    }
+    const char* policy = status.policy == SCHED_FIFO ? "SCHED_FIFO" : status.policy == SCHED_RR ? "SCHED_RR" : "SCHED_OTHER";
+    return Py_BuildValue("{s:s,s:i,s:N,s:N,s:n,s:{s:i,s:i,s:N,s:n},s:{s:z,s:z,s:z}}",
+        "policy", policy,
+        "priority", status.priority,
+        "cpus", cpus,
+        "memory_locked", PyBool_FromLong(status.memory_locked),
+        "stack_prefaulted", status.stack_prefaulted,
+        "requested",
+            "priority", status.requested.priority,
+            "cpu", status.requested.cpu,
+            "lock_memory", PyBool_FromLong(status.requested.lock_memory),
+            "prefault_stack", status.requested.prefault_stack,
+        "errors",
+            "priority", status.priority_error ? strerror(status.priority_error) : NULL,
+            "cpu", status.cpu_error ? strerror(status.cpu_error) : NULL,
+            "lock_memory", status.lock_memory_error ? strerror(status.lock_memory_error) : NULL);
+}
 
 static void* rotation_server_thread(void* arg)
 {
+    apply_rt_options();
     pthread_mutex_lock(&lock);
     SLEEP_PREP
-    g_server_is_running = true;
+    swap_params();
+    struct Pulser pulser;
+    bool pulsing = false; // pulser deadlines continue between steps
 
     while (g_server_is_running) {
         
@@ -265,10 +927,10 @@ static void* rotation_server_thread(void* arg)
         if (g_frequency != 0.0) {
             g_frequency += g_acceleration/fabs(g_frequency);
 
-            g_frequency = fmax(fmin(g_frequency, MAX_FREQUENCY), -MAX_FREQUENCY);
-            g_frequency = fabs(g_frequency) < MIN_FREQUENCY ? 0.0 : g_frequency;
+            g_frequency = fmax(fmin(g_frequency, g_params->max_frequency), -g_params->max_frequency);
+            g_frequency = fabs(g_frequency) < g_params->min_frequency ? 0.0 : g_frequency;
         } else {
-            g_frequency = copysign(MIN_FREQUENCY, g_acceleration);
+            g_frequency = copysign(g_params->min_frequency, g_acceleration);
         }
 
         // Generate step signal or wait
@@ -278,6 +940,13 @@ static void* rotation_server_thread(void* arg)
             //    write_dir(g_acceleration < 0.0 ? 1 : 0);
             //    generate_signal_internal(MIN_FREQUENCY, INTERVAL);
             //}
+            if (pulsing) {
+                pulser_end(&pulser);
+                pulsing = false;
+                long long now = now_ns();
+                telemetry_record(TELEMETRY_STOP, now, now, pulser.segment, 0, 0);
+            }
+            swap_params();
             gpioWrite(ENABLE_PIN, 1);
             pthread_cond_wait(&cond, &lock);
             gpioWrite(ENABLE_PIN, 0);
@@ -287,16 +956,24 @@ static void* rotation_server_thread(void* arg)
             long sleep_time = labs((long)(500000000/g_frequency));
 
             pthread_mutex_unlock(&lock);
-            SLEEP(sleep_time - WRITING_TIME_NS)
-            gpioWrite(STEP_PIN, 1);
-            SLEEP(sleep_time - WRITING_TIME_NS)
-            gpioWrite(STEP_PIN, 0);
+            if (!pulsing) {
+                pulser_start(&pulser, now_ns());
+                pulsing = true;
+            }
+            pulser_wait(&pulser, sleep_time);
+            pulse_edge(&pulser, 1);
+            pulser_wait(&pulser, sleep_time);
+            pulse_edge(&pulser, 0);
             pthread_mutex_lock(&lock);
 
             g_angle += g_frequency < 0.0 ? 1 : -1;
         } else {
+            if (pulsing) {
+                pulser_end(&pulser);
+                pulsing = false;
+            }
             pthread_mutex_unlock(&lock);
-            long sleep_time = 1000000000/MIN_FREQUENCY;
+            long sleep_time = 1000000000/g_params->min_frequency;
             SLEEP(sleep_time)
             pthread_mutex_lock(&lock);
 
@@ -309,11 +986,15 @@ static void* rotation_server_thread(void* arg)
     return NULL;
 }
 
-static PyObject* rotation_server(PyObject* self, PyObject* noarg)
+static PyObject* rotation_server(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     bool server_was_running;
     int thread_created = 0;
     int thread_detached = 0;
+    struct RtOptions options;
+    if (parse_rt_options(args, kwargs, &options) < 0) {
+        return NULL;
+    }
 
     Py_BEGIN_ALLOW_THREADS
     pthread_mutex_lock(&lock);
@@ -321,9 +1002,17 @@ static PyObject* rotation_server(PyObject* self, PyObject* noarg)
 
     if (!server_was_running) {
         pthread_t thread_id;
+        g_rt_options = options;
+        g_rt_status.applied = false;
+        g_server_is_running = true; // before the start returns, so clients can send right away
         thread_created = pthread_create(&thread_id, NULL, rotation_server_thread, NULL);
         if (thread_created != 0) {
+            g_server_is_running = false;
+        } else {
             thread_detached = pthread_detach(thread_id);
+            while (!g_rt_status.applied) {
+                pthread_cond_wait(&rt_applied, &lock);
+            }
         }
     }
     pthread_mutex_unlock(&lock);
@@ -346,6 +1035,34 @@ static PyObject* rotation_server(PyObject* self, PyObject* noarg)
 }
 
 
+// Adds the rotation to `target_position` to g_angle, `lock` must be held.
+// Returns false when the change is too small to be made (it is then measured from the next position).
+static bool add_target_position(struct Quaternion target_position)
+{
+    // Calculate the angle difference
+    double angle = get_angle(g_position, target_position);
+    long angle_steps = -(long)floor(angle / ROTATION_PER_STEP * g_params->inertia_ratio);
+
+    if (labs(angle_steps) <= floor(16 * g_params->inertia_ratio)) {
+        return false;
+    }
+    g_position = target_position;
+    g_angle += angle_steps;
+    long long now = now_ns();
+    telemetry_record(TELEMETRY_COMMAND, now, now, atomic_load(&g_segment), angle_steps, 0);
+
+    if (g_angle != 0) {
+        // Update acceleration to reach the target angle in the given time
+        g_acceleration = 2*(g_angle-g_frequency*g_params->reach_time)/(g_params->reach_time*g_params->reach_time);
+        g_acceleration = fmax(fmin(g_acceleration, g_params->max_acceleration), -g_params->max_acceleration);
+
+        if (g_angle == angle_steps) {
+            pthread_cond_signal(&cond);
+        }
+    }
+    return true;
+}
+
 static PyObject* rotation_client(PyObject* self, PyObject* args)
 {
     double x, y, z, w;
@@ -366,29 +1083,120 @@ static PyObject* rotation_client(PyObject* self, PyObject* args)
 
     Py_BEGIN_ALLOW_THREADS
     pthread_mutex_lock(&lock);
+    add_target_position(target_position);
+    pthread_mutex_unlock(&lock);
+    Py_END_ALLOW_THREADS
 
-    // Calculate the angle difference
-    double angle = get_angle(g_position, target_position);
-    long angle_steps = -(long)floor(angle / ROTATION_PER_STEP * INERTIA_PLATFORM2WHEEL_RATIO);
+    Py_RETURN_NONE;
+}
 
-    if (labs(angle_steps) > floor(16 * INERTIA_PLATFORM2WHEEL_RATIO)) {
-        g_position = target_position;
-        g_angle += angle_steps;
+// Rows of rotation_client_batch: contiguous float64 (t, x, y, z, w)
+#define POSITION_ROW_LENGTH 5
+// Rows of relative_yaw: contiguous float64 (x, y, z, w)
+#define QUATERNION_ROW_LENGTH 4
 
-        if (g_angle != 0) {
-            // Update acceleration to reach the target angle in the given time
-            g_acceleration = 2*(g_angle-g_frequency*REACH_TIME)/(REACH_TIME*REACH_TIME);
-            g_acceleration = fmax(fmin(g_acceleration, MAX_ACCELERATION), -MAX_ACCELERATION);
+// Gets the buffer of `object` as float64 rows of `row_length` values (`row_name` is used in the error message).
+// On error the exception is set and the buffer is not held.
+static int get_double_rows(PyObject* object, Py_buffer* buffer, Py_ssize_t row_length, const char* row_name, Py_ssize_t* rows)
+{
+    if (PyObject_GetBuffer(object, buffer, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+        return -1;
+    }
+    const char* format = buffer->format;
+    if (format[0] == '<' || format[0] == '=' || format[0] == '@') {
+        format++;
+    }
+    if (strcmp(format, "d") != 0 || buffer->itemsize != sizeof(double)
+        || buffer->len % (row_length * sizeof(double)) != 0) {
+        PyBuffer_Release(buffer);
+        PyErr_Format(PyExc_Exception, "Expected a contiguous float64 buffer of %s rows", row_name);
+        return -1;
+    }
+    *rows = buffer->len / (row_length * sizeof(double));
+    return 0;
+}
 
-            if (g_angle == angle_steps) {
-                pthread_cond_signal(&cond);
-            }
+static PyObject* relative_yaw(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    static char* keywords[] = {"quaternions", "steps", NULL};
+    PyObject* object;
+    int steps = 0;
+    Py_buffer buffer;
+    Py_ssize_t rows;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|p", keywords, &object, &steps)
+        || get_double_rows(object, &buffer, QUATERNION_ROW_LENGTH, "(x, y, z, w)", &rows) < 0)
+    {
+        return NULL;
+    }
+
+    // float64 angles or int64 steps, both 8 bytes
+    Py_ssize_t count = rows > 1 ? rows - 1 : 0;
+    PyObject* result = PyByteArray_FromStringAndSize(NULL, count * 8);
+    if (result == NULL) {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    const double* q = buffer.buf;
+    char* out = PyByteArray_AS_STRING(result);
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < count; i++, q += QUATERNION_ROW_LENGTH) {
+        struct Quaternion q_from = {q[0], q[1], q[2], q[3]};
+        struct Quaternion q_to = {q[4], q[5], q[6], q[7]};
+        double angle = get_angle(q_from, q_to);
+        if (steps) {
+            ((long long*)out)[i] = (long long)floor(angle / ROTATION_PER_STEP);
+        } else {
+            ((double*)out)[i] = angle;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    return result;
+}
+
+static PyObject* rotation_client_batch(PyObject* self, PyObject* args)
+{
+    PyObject* object;
+    Py_buffer buffer;
+    Py_ssize_t rows;
+    if (!PyArg_ParseTuple(args, "O", &object) || get_double_rows(object, &buffer, POSITION_ROW_LENGTH, "(t, x, y, z, w)", &rows) < 0)
+    {
+        return NULL;
+    }
+    if (rows > 0 && g_position.x != NO_VALUE && g_server_is_running == false) {
+        PyBuffer_Release(&buffer);
+        PyErr_SetString(PyExc_Exception, "Rotation server is not running");
+        return NULL;
+    }
+
+    Py_ssize_t accepted = 0;
+    Py_ssize_t coalesced = 0;
+    const double* row = buffer.buf;
+    Py_BEGIN_ALLOW_THREADS
+    pthread_mutex_lock(&lock);
+    double last_time = -INFINITY;
+    for (Py_ssize_t i = 0; i < rows; i++, row += POSITION_ROW_LENGTH) {
+        struct Quaternion target_position = {row[1], row[2], row[3], row[4]};
+        if (row[0] < last_time) {
+            coalesced++; // out of order, a newer position was already given
+            continue;
+        }
+        last_time = row[0];
+        if (g_position.x == NO_VALUE) {
+            g_position = target_position;
+            accepted++;
+        } else if (add_target_position(target_position)) {
+            accepted++;
+        } else {
+            coalesced++;
         }
     }
     pthread_mutex_unlock(&lock);
     Py_END_ALLOW_THREADS
 
-    Py_RETURN_NONE;
+    PyBuffer_Release(&buffer);
+    return Py_BuildValue("(nn)", accepted, coalesced);
 }
 
 static PyObject* print_globals(PyObject* self, PyObject* noarg)
@@ -427,6 +1235,12 @@ static void fast_motor_atexit(void) {
 static int
 fast_motor_module_exec(PyObject *m)
 {
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "SIMULATED", SIMULATED), "Failed to add SIMULATED");
+    ASSERT_SUCCESS(PyModule_AddObject(m, "ROTATION_PER_STEP", PyFloat_FromDouble(ROTATION_PER_STEP)), "Failed to add ROTATION_PER_STEP");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_SIZE", TELEMETRY_SIZE), "Failed to add TELEMETRY_SIZE");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_PULSE", TELEMETRY_PULSE), "Failed to add TELEMETRY_PULSE");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_COMMAND", TELEMETRY_COMMAND), "Failed to add TELEMETRY_COMMAND");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_STOP", TELEMETRY_STOP), "Failed to add TELEMETRY_STOP");
     ASSERT_SUCCESS(gpioInitialise(), "Failed to initialize PIGPIO");
     ASSERT_SUCCESS(Py_AtExit(fast_motor_atexit), "Failed to register PIGPIO exit handler");
     ASSERT_SUCCESS(gpioSetMode(STEP_PIN, PI_OUTPUT), "Failed to set GPIO mode");
@@ -440,6 +1254,7 @@ fast_motor_module_exec(PyObject *m)
     ASSERT_SUCCESS(gpioWrite(M1_PIN, 1), "Failed to write to GPIO");
     ASSERT_SUCCESS(gpioWrite(M2_PIN, 1), "Failed to write to GPIO");
     ASSERT_SUCCESS(gpioWrite(M3_PIN, 0), "Failed to write to GPIO");
+    calibrate_overheads();
     clock_gettime(CLOCK_MONOTONIC, &signal_min_start);
     return 0;
 }
@@ -478,9 +1293,10 @@ static PyMethodDef fast_motor_funcs[] = {
     },
     {    
         "rotation_server",
-        rotation_server,
-        METH_NOARGS,
-        "Starts the rotation server in a separate thread."
+        (PyCFunction)(void(*)(void))rotation_server,
+        METH_VARARGS | METH_KEYWORDS,
+        "Starts the rotation server in a separate thread. "
+        "Options: priority (SCHED_FIFO), cpu (affinity), lock_memory (mlockall), prefault_stack (bytes)."
     },
     {    
         "rotation_client",
@@ -488,12 +1304,85 @@ static PyMethodDef fast_motor_funcs[] = {
         METH_VARARGS,
         "Sends target rotation to the server."
     },
+    {
+        "relative_yaw",
+        (PyCFunction)(void(*)(void))relative_yaw,
+        METH_VARARGS | METH_KEYWORDS,
+        "Returns the Y axis rotation between consecutive quaternions of a contiguous float64 buffer of (x, y, z, w) rows "
+        "as a bytearray of N-1 float64 radians, or int64 steps of ROTATION_PER_STEP with steps=True."
+    },
+    {
+        "rotation_client_batch",
+        rotation_client_batch,
+        METH_VARARGS,
+        "Sends target rotations given as a contiguous float64 buffer of (t, x, y, z, w) rows in time order. "
+        "Returns (accepted, coalesced) row counts, rows below the step threshold or out of order are coalesced."
+    },
     {    
         "stop_rotation",
         stop_rotation,
         METH_NOARGS,
         "Stops the rotation server."
     },
+    {
+        "get_params",
+        get_params,
+        METH_NOARGS,
+        "Returns the active controller parameters, with the ones waiting for the end of a maneuver under 'pending'."
+    },
+    {
+        "set_params",
+        (PyCFunction)(void(*)(void))set_params,
+        METH_VARARGS | METH_KEYWORDS,
+        "Sets controller parameters given as keywords (inertia_ratio, min_frequency, max_frequency, max_acceleration, reach_time). "
+        "min_frequency must be lower than max_frequency. "
+        "They are applied together between maneuvers, immediately when the server is not running."
+    },
+    {
+        "get_rt_status",
+        get_rt_status,
+        METH_NOARGS,
+        "Returns real-time settings applied to the rotation server thread (None before the first start)."
+    },
+    {
+        "telemetry_buffer",
+        telemetry_buffer,
+        METH_NOARGS,
+        "Returns the telemetry ring as a read-only memoryview (no copy) of TELEMETRY_SIZE 40 byte records."
+    },
+    {
+        "telemetry_cursor",
+        telemetry_cursor,
+        METH_NOARGS,
+        "Returns the number of recorded telemetry events, the cursor of the next event."
+    },
+    {
+        "telemetry_read",
+        telemetry_read,
+        METH_VARARGS,
+        "Returns (cursor, lost, views) with memoryviews of the events recorded since the given cursor. "
+        "The views are live, records being overwritten are told apart by their sequence field."
+    },
+    {
+        "get_timing",
+        get_timing,
+        METH_NOARGS,
+        "Returns measured gpioWrite and wakeup overheads (ns) and timing of the last maneuver."
+    },
+#ifdef SIMULATE_GPIO
+    {
+        "sim_edges",
+        sim_edges,
+        METH_VARARGS,
+        "Returns recorded GPIO edges as (CLOCK_MONOTONIC ns, gpio, level), clear=True empties the record."
+    },
+    {
+        "sim_edges_lost",
+        sim_edges_lost,
+        METH_NOARGS,
+        "Returns the number of edges not recorded because the record was full."
+    },
+#endif
     {    
         "print_globals",
         print_globals,
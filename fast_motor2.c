@@ -1,11 +1,110 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
-#include <pigpio.h>
 #include <stdio.h>
 #include <time.h>
 #include <math.h>
 #include <stdbool.h>
 #include <pthread.h>
+#include <sched.h>
+#include <sys/mman.h>
+#include <errno.h>
+#include <string.h>
+#include <stddef.h>
+#include <stdatomic.h>
+#include <sys/eventfd.h>
+#include <unistd.h>
+#ifdef SIMULATE_GPIO
+// Simulated GPIO for running without a Pi (build with -DSIMULATE_GPIO and without -lpigpio):
+// pin levels are kept in memory and every change is recorded with its CLOCK_MONOTONIC time.
+#include <stdatomic.h>
+#include <stdlib.h>
+#define SIMULATED 1
+#define PI_OUTPUT 1
+#define SIM_GPIOS 54
+#define SIM_EDGES_SIZE (1 << 20)
+
+struct SimEdge {
+    long long time_ns;
+    unsigned char gpio;
+    unsigned char level;
+};
+static struct SimEdge* g_sim_edges = NULL;
+static atomic_size_t g_sim_edges_length = 0;
+static atomic_llong g_sim_edges_lost = 0;
+static atomic_int g_sim_levels[SIM_GPIOS];
+
+static int gpioInitialise(void)
+{
+    if (g_sim_edges == NULL) {
+        g_sim_edges = malloc(SIM_EDGES_SIZE * sizeof(struct SimEdge));
+    }
+    return g_sim_edges == NULL ? -1 : 0;
+}
+
+static void gpioTerminate(void) {}
+
+static int gpioSetMode(unsigned gpio, unsigned mode)
+{
+    return gpio < SIM_GPIOS ? 0 : -1;
+}
+
+static int gpioWrite(unsigned gpio, unsigned level)
+{
+    if (gpio >= SIM_GPIOS || level > 1) {
+        return -1;
+    }
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    if (atomic_exchange(&g_sim_levels[gpio], level) == (int)level) {
+        return 0; // not an edge
+    }
+    size_t i = atomic_fetch_add(&g_sim_edges_length, 1);
+    if (i >= SIM_EDGES_SIZE) {
+        atomic_store(&g_sim_edges_length, SIM_EDGES_SIZE);
+        atomic_fetch_add(&g_sim_edges_lost, 1);
+        return 0;
+    }
+    g_sim_edges[i] = (struct SimEdge){now.tv_sec * 1000000000LL + now.tv_nsec, gpio, level};
+    return 0;
+}
+
+static PyObject* sim_edges(PyObject* self, PyObject* args)
+{
+    int clear = 0;
+    if (!PyArg_ParseTuple(args, "|p", &clear)) {
+        return NULL;
+    }
+    size_t length = atomic_load(&g_sim_edges_length);
+    if (length > SIM_EDGES_SIZE) {
+        length = SIM_EDGES_SIZE;
+    }
+    PyObject* edges = PyList_New(length);
+    if (edges == NULL) {
+        return NULL;
+    }
+    for (size_t i = 0; i < length; i++) {
+        struct SimEdge edge = g_sim_edges[i];
+        PyObject* item = Py_BuildValue("(Lii)", edge.time_ns, edge.gpio, edge.level);
+        if (item == NULL) {
+            Py_DECREF(edges);
+            return NULL;
+        }
+        PyList_SET_ITEM(edges, i, item);
+    }
+    if (clear) {
+        atomic_store(&g_sim_edges_length, 0);
+    }
+    return edges;
+}
+
+static PyObject* sim_edges_lost(PyObject* self, PyObject* noarg)
+{
+    return PyLong_FromLongLong(atomic_load(&g_sim_edges_lost));
+}
+#else
+#include <pigpio.h>
+#define SIMULATED 0
+#endif
 #define ASSERT_SUCCESS(status, msg) \
     if (status < 0) { \
         PyErr_SetString(PyExc_Exception, msg); \
@@ -33,12 +132,7 @@
 #define DIR_PIN 23
 #define ENABLE_PIN 4
 #define ROTATION_PER_STEP (M_PI/800)
-//#define INERTIA_PLATFORM2WHEEL_RATIO 5.65 
-#define INERTIA_PLATFORM2WHEEL_RATIO 6.9
-#define CALCULATION_TIME_NS 260
-#define WRITING_TIME_NS 1100
-#define INIT_TIME_NS 6000 // 3000-80000 ns
-#define CALCULATION_TIME_ALL_NS 350000
+#define NANO 1000000000
 #define TIME_CALC_START \
     struct timespec start, end; \
     int elapsed; \
@@ -64,62 +158,236 @@ static void write_dir(int value)
     }
 }
 
-static void generate_signal_prep(double acceleration, int freq, double duration)
+// Telemetry: every STEP edge and every command is recorded in a preallocated ring that Python
+// reads without copying (telemetry_buffer, telemetry_read). Record layout, 40 bytes in native byte order:
+// sequence q, planned_ns q, actual_ns q, segment i, value i, kind B, direction B, level B, 5 padding bytes.
+// `sequence` is the event index + 1, stored last, so a reader can tell records that are still being written.
+#define TELEMETRY_SIZE 16384 // events, power of two
+#define TELEMETRY_PULSE 1 // edge of STEP: planned deadline and actual write time, value unused
+#define TELEMETRY_COMMAND 2 // command taken by the server: received and taken time, value in steps
+#define TELEMETRY_STOP 3 // end of a maneuver, value is the remaining angle in steps
+
+struct TelemetryEvent {
+    _Atomic long long sequence;
+    long long planned_ns;
+    long long actual_ns;
+    int segment;
+    int value;
+    unsigned char kind;
+    unsigned char direction;
+    unsigned char level;
+    unsigned char padding[5];
+};
+_Static_assert(sizeof(struct TelemetryEvent) == 40, "Telemetry record layout changed");
+
+static struct TelemetryEvent g_telemetry[TELEMETRY_SIZE];
+static atomic_llong g_telemetry_head = 0; // number of recorded events
+static atomic_int g_segment = 0; // id of the last started pulse sequence
+
+static void telemetry_record(int kind, long long planned_ns, long long actual_ns, int segment, long value, int level)
 {
-    write_dir(freq < 0 ? 0 : 1);
-    if (freq < 0) {
-        freq = -freq;
-        acceleration = -acceleration;
-    }
+    long long index = atomic_fetch_add_explicit(&g_telemetry_head, 1, memory_order_relaxed);
+    struct TelemetryEvent* event = &g_telemetry[index % TELEMETRY_SIZE];
+    atomic_store_explicit(&event->sequence, 0, memory_order_relaxed);
+    atomic_thread_fence(memory_order_release);
+    event->planned_ns = planned_ns;
+    event->actual_ns = actual_ns;
+    event->segment = segment;
+    event->value = (int)value;
+    event->kind = kind;
+    event->direction = dir_value;
+    event->level = level;
+    atomic_store_explicit(&event->sequence, index + 1, memory_order_release);
+}
 
-    SLEEP_PREP
-    float time_passed = 0.0;
-    float impulse_duration = fabs(1.0 / freq);
+static PyObject* telemetry_buffer(PyObject* self, PyObject* noarg)
+{
+    return PyMemoryView_FromMemory((char*)g_telemetry, sizeof(g_telemetry), PyBUF_READ);
+}
 
-    int wait_times[20000];
-    int wait_times_length = 0;
+static PyObject* telemetry_cursor(PyObject* self, PyObject* noarg)
+{
+    return PyLong_FromLongLong(atomic_load(&g_telemetry_head));
+}
 
-    while (time_passed < duration)
-    {
-        int sleep_time = (int)(impulse_duration * 500000000);
-        time_passed += impulse_duration;
-        freq = freq + acceleration * impulse_duration;
-        impulse_duration = fabs(1.0 / freq);
+static PyObject* telemetry_read(PyObject* self, PyObject* args)
+{
+    long long cursor;
+    if (!PyArg_ParseTuple(args, "L", &cursor)) {
+        return NULL;
+    }
+    long long head = atomic_load(&g_telemetry_head);
+    if (cursor < 0 || cursor > head) {
+        PyErr_SetString(PyExc_Exception, "Telemetry cursor out of range");
+        return NULL;
+    }
+    long long lost = 0;
+    if (head - cursor > TELEMETRY_SIZE) {
+        lost = head - TELEMETRY_SIZE - cursor;
+        cursor = head - TELEMETRY_SIZE;
+    }
 
-        wait_times[wait_times_length++] = sleep_time;
+    // Events cursor..head are at most two slices of the ring
+    PyObject* views = PyList_New(0);
+    if (views == NULL) {
+        return NULL;
     }
+    long long start = cursor % TELEMETRY_SIZE;
+    long long count = head - cursor;
+    long long first = count < TELEMETRY_SIZE - start ? count : TELEMETRY_SIZE - start;
+    long long slices[2][2] = {{start, first}, {0, count - first}};
+    for (int i = 0; i < 2; i++) {
+        if (slices[i][1] == 0) {
+            continue;
+        }
+        PyObject* view = PyMemoryView_FromMemory((char*)&g_telemetry[slices[i][0]],
+            slices[i][1] * sizeof(struct TelemetryEvent), PyBUF_READ);
+        if (view == NULL || PyList_Append(views, view) < 0) {
+            Py_XDECREF(view);
+            Py_DECREF(views);
+            return NULL;
+        }
+        Py_DECREF(view);
+    }
+    return Py_BuildValue("(LLN)", head, lost, views);
+}
 
-    int wait_times_reversed[20000];
-    int wait_times_reversed_length = 0;
-    time_passed = 0.0;
+// Pulse engine: every edge is written at an absolute CLOCK_MONOTONIC deadline (planned cumulative time).
+// The thread wakes up earlier by the measured gpioWrite and wakeup overheads,
+// which are calibrated at module init and adapted after every edge.
+#define OVERHEAD_WEIGHT 0.05 // weight of the newest measurement in the overhead averages
+#define OUTLIER_NS 1000000 // wakeups later than this don't update the overhead average
+#define RESYNC_FRACTION 0.1 // lateness above this fraction of the half-period shifts the schedule (a resync)
+#define CALIBRATION_SAMPLES 200
+#define CALIBRATION_SLEEP_NS 100000
+
+static double g_write_overhead_ns = 0.0;
+static double g_wakeup_overhead_ns = 0.0;
+
+// Timing of one maneuver
+struct PulseTiming {
+    long long edges;
+    long long resyncs;
+    long long drift_ns; // last edge: achieved - planned cumulative time
+    long long error_sum_ns; // sum of |achieved - deadline| of all edges
+    long long max_lateness_ns;
+};
+static struct PulseTiming g_last_timing = {0};
+
+struct Pulser {
+    long long start;
+    long long planned; // planned time of the next edge since start
+    long long deadline;
+    long long interval; // last planned time between edges (the current half-period)
+    int segment; // telemetry id of the pulse sequence
+    struct PulseTiming timing;
+};
 
-    while (time_passed < duration)
-    {
-        int sleep_time = (int)(impulse_duration * 500000000);
-        time_passed += impulse_duration;
-        freq = freq - acceleration * impulse_duration;
-        impulse_duration = fabs(1.0 / freq);
+static long long now_ns(void)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec * (long long)NANO + now.tv_nsec;
+}
+
+static void sleep_until_ns(long long deadline)
+{
+    struct timespec ts = {.tv_sec = deadline / NANO, .tv_nsec = deadline % NANO};
+    while (clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &ts, NULL) == EINTR);
+}
 
-        wait_times_reversed[wait_times_reversed_length++] = sleep_time;
+static void calibrate_overheads(void)
+{
+    long long total = 0;
+    for (int i = 0; i < CALIBRATION_SAMPLES; i++) {
+        long long before = now_ns();
+        gpioWrite(STEP_PIN, 0); // already low, no step is made
+        total += now_ns() - before;
     }
-    
-    for (int i = 0; i < wait_times_length; i++)
-    {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(wait_times[i] - WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(wait_times[i] - WRITING_TIME_NS)
+    g_write_overhead_ns = (double)total / CALIBRATION_SAMPLES;
+
+    total = 0;
+    for (int i = 0; i < CALIBRATION_SAMPLES / 10; i++) {
+        long long deadline = now_ns() + CALIBRATION_SLEEP_NS;
+        sleep_until_ns(deadline);
+        total += now_ns() - deadline;
     }
+    g_wakeup_overhead_ns = (double)total / (CALIBRATION_SAMPLES / 10);
+}
 
-    for (int i = 0; i < wait_times_reversed_length; i++)
-    {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(wait_times_reversed[i] - WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(wait_times_reversed[i] - WRITING_TIME_NS)
+// `start` is the time of the first edge
+static void pulser_start(struct Pulser* pulser, long long start)
+{
+    pulser->start = start;
+    pulser->deadline = start;
+    pulser->planned = 0;
+    pulser->interval = 0;
+    pulser->timing = (struct PulseTiming){0};
+    pulser->segment = atomic_fetch_add(&g_segment, 1) + 1;
+}
+
+static void pulser_wait(struct Pulser* pulser, long long nanoseconds)
+{
+    pulser->deadline += nanoseconds;
+    pulser->planned += nanoseconds;
+    pulser->interval = nanoseconds;
+}
+
+// Returns the time the edge was written
+static long long pulse_edge(struct Pulser* pulser, int level)
+{
+    long long wake_at = pulser->deadline - (long long)(g_write_overhead_ns + g_wakeup_overhead_ns);
+    sleep_until_ns(wake_at);
+    long long woken = now_ns();
+    if (woken - wake_at < OUTLIER_NS) { // otherwise the deadline had already passed
+        g_wakeup_overhead_ns += OVERHEAD_WEIGHT * ((woken - wake_at) - g_wakeup_overhead_ns);
+    }
+    // A too large wakeup overhead estimate wakes the thread early, the edge must still not come early
+    long long write_at = pulser->deadline - (long long)g_write_overhead_ns;
+    long long before_write = woken;
+    while (before_write < write_at) {
+        before_write = now_ns();
+    }
+    gpioWrite(STEP_PIN, level);
+    long long written = now_ns();
+    g_write_overhead_ns += OVERHEAD_WEIGHT * ((written - before_write) - g_write_overhead_ns);
+
+    telemetry_record(TELEMETRY_PULSE, pulser->deadline, written, pulser->segment, 0, level);
+
+    long long error = written - pulser->deadline;
+    struct PulseTiming* timing = &pulser->timing;
+    timing->edges++;
+    timing->error_sum_ns += llabs(error);
+    if (error > timing->max_lateness_ns) {
+        timing->max_lateness_ns = error;
+    }
+    timing->drift_ns = written - (pulser->start + pulser->planned);
+    // A late edge keeps the absolute schedule, the next half-period is shortened by at most
+    // RESYNC_FRACTION, so wakeup lateness doesn't add up. After a longer stall the schedule is shifted:
+    // catching up would be a burst of steps the motor cannot follow
+    if (error > RESYNC_FRACTION * pulser->interval) {
+        pulser->deadline += error;
+        timing->resyncs++;
     }
+    return written;
+}
 
-    return;
+static void pulser_end(struct Pulser* pulser)
+{
+    g_last_timing = pulser->timing;
+}
+
+static PyObject* get_timing(PyObject* self, PyObject* noarg)
+{
+    struct PulseTiming timing = g_last_timing;
+    return Py_BuildValue("{s:d,s:d,s:L,s:L,s:L,s:L,s:L}",
+        "write_overhead_ns", g_write_overhead_ns,
+        "wakeup_overhead_ns", g_wakeup_overhead_ns,
+        "edges", timing.edges,
+        "resyncs", timing.resyncs,
+        "drift_ns", timing.drift_ns,
+        "error_sum_ns", timing.error_sum_ns,
+        "max_lateness_ns", timing.max_lateness_ns);
 }
 
 static void generate_signal(double acceleration, double freq, double duration)
@@ -129,6 +397,8 @@ static void generate_signal(double acceleration, double freq, double duration)
 
     // Start signal ASAP
     gpioWrite(STEP_PIN, 1);
+    struct Pulser pulser;
+    pulser_start(&pulser, now_ns());
 
     write_dir(freq < 0 ? 0 : 1);
     if (freq < 0) {
@@ -137,7 +407,6 @@ static void generate_signal(double acceleration, double freq, double duration)
     }
 
     // Prepare variable for signal generation
-    SLEEP_PREP
     double time_passed = 0.0;
     double impulse_duration = 1.0 / freq;
     double sleep_time;
@@ -146,26 +415,26 @@ static void generate_signal(double acceleration, double freq, double duration)
     sleep_time = (int)(impulse_duration * 500000000);
     time_passed += impulse_duration;
     impulse_duration = 1.0 / (freq + acceleration * time_passed);
-    SLEEP(sleep_time-WRITING_TIME_NS-CALCULATION_TIME_NS)
-    gpioWrite(STEP_PIN, 0);
+    pulser_wait(&pulser, sleep_time);
+    pulse_edge(&pulser, 0);
 
     // Generate the rest of the impulses
     while (time_passed < duration)
     {
-        SLEEP(sleep_time-WRITING_TIME_NS-CALCULATION_TIME_NS)
+        pulser_wait(&pulser, sleep_time);
         sleep_time = (int)(impulse_duration * 500000000);
         time_passed += impulse_duration;
         impulse_duration = 1.0 / (freq + acceleration * time_passed);
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(sleep_time-WRITING_TIME_NS)
-        gpioWrite(STEP_PIN, 0);
+        pulse_edge(&pulser, 1);
+        pulser_wait(&pulser, sleep_time);
+        pulse_edge(&pulser, 0);
     }
+    pulser_end(&pulser);
 
-    // Set minimum time for next signal
-    clock_gettime(CLOCK_MONOTONIC, &signal_min_start);
-    const long long nsec = signal_min_start.tv_nsec + sleep_time - WRITING_TIME_NS;
-    signal_min_start.tv_sec += nsec / 1000000000;
-    signal_min_start.tv_nsec = nsec % 1000000000;
+    // Set minimum time for next signal (end of the last impulse)
+    pulser_wait(&pulser, sleep_time);
+    signal_min_start.tv_sec = pulser.deadline / NANO;
+    signal_min_start.tv_nsec = pulser.deadline % NANO;
 
     return;
 }
@@ -196,164 +465,624 @@ static double get_angle(struct Quaternion q1, struct Quaternion q2)
     return atan2(2*(dp.w*dp.y + dp.x*dp.z), 1 - 2*(dp.y*dp.y + dp.z*dp.z));
 }
 
-static void generate_signal_internal(double freq, double duration) {
-    double impulse_duration = fabs(1.0 / freq);
-    int sleep_time = (int)(impulse_duration * 500000000) - WRITING_TIME_NS;
-    int impulses_count = (int)floor(duration / impulse_duration);
-    SLEEP_PREP
-
-    for (int i = 0; i < impulses_count; i++)
-    {
-        gpioWrite(STEP_PIN, 1);
-        SLEEP(sleep_time)
-        gpioWrite(STEP_PIN, 0);
-        SLEEP(sleep_time)
-    }
-}
-
 static pthread_mutex_t lock = PTHREAD_MUTEX_INITIALIZER;
-static pthread_cond_t cond = PTHREAD_COND_INITIALIZER;
-static bool g_server_is_running = false;
+static atomic_bool g_server_is_running = false;
 #define NO_VALUE -10
 static struct Quaternion g_position = {NO_VALUE, NO_VALUE, NO_VALUE, 1};
 static double g_frequency = 0.0;
 static double g_acceleration = 0.0;
-static long g_angle = 0;
+
+// Single producer, single consumer ring of setpoints from clients to the server thread.
+// Clients push while holding the GIL (which makes them a single producer) and never block,
+// the server thread drains everything pending at once and sleeps on g_setpoints_event.
+#define SETPOINTS_SIZE 256 // power of two
+struct Setpoint {
+    long angle; // steps, when position.x is NO_VALUE
+    struct Quaternion position;
+    struct timespec received; // CLOCK_MONOTONIC
+};
+static struct Setpoint g_setpoints[SETPOINTS_SIZE];
+static atomic_uint g_setpoints_head = 0; // next slot written by clients
+static atomic_uint g_setpoints_tail = 0; // next slot read by the server thread
+static atomic_ulong g_setpoints_dropped = 0;
+static atomic_long g_setpoints_max_age_ns = 0; // longest time a setpoint waited in the ring
+static int g_setpoints_event = -1; // eventfd
+
+static void wake_server(void)
+{
+    uint64_t one = 1;
+    while (write(g_setpoints_event, &one, sizeof(one)) < 0 && errno == EINTR);
+}
+
+static bool push_setpoint(struct Setpoint setpoint)
+{
+    unsigned head = atomic_load_explicit(&g_setpoints_head, memory_order_relaxed);
+    unsigned tail = atomic_load_explicit(&g_setpoints_tail, memory_order_acquire);
+    if (head - tail == SETPOINTS_SIZE) {
+        atomic_fetch_add(&g_setpoints_dropped, 1);
+        return false;
+    }
+    clock_gettime(CLOCK_MONOTONIC, &setpoint.received);
+    g_setpoints[head % SETPOINTS_SIZE] = setpoint;
+    atomic_store_explicit(&g_setpoints_head, head + 1, memory_order_release);
+    wake_server();
+    return true;
+}
+
+static bool pop_setpoint(struct Setpoint* setpoint)
+{
+    unsigned tail = atomic_load_explicit(&g_setpoints_tail, memory_order_relaxed);
+    unsigned head = atomic_load_explicit(&g_setpoints_head, memory_order_acquire);
+    if (head == tail) {
+        return false;
+    }
+    *setpoint = g_setpoints[tail % SETPOINTS_SIZE];
+    atomic_store_explicit(&g_setpoints_tail, tail + 1, memory_order_release);
+    return true;
+}
+
+static bool setpoints_pending(void)
+{
+    return atomic_load_explicit(&g_setpoints_head, memory_order_acquire) != atomic_load_explicit(&g_setpoints_tail, memory_order_relaxed);
+}
+
+// Sum of the pending setpoints in steps. `oldest` (if not NULL) is set to the receive time
+// of the oldest setpoint that changed the angle, 0 if none did.
+static long drain_setpoints(long long* oldest)
+{
+    struct Setpoint setpoint;
+    struct timespec now;
+    long angle = 0;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    long long taken = now.tv_sec * (long long)NANO + now.tv_nsec;
+    if (oldest != NULL) {
+        *oldest = 0;
+    }
+    while (pop_setpoint(&setpoint)) {
+        long age = (now.tv_sec - setpoint.received.tv_sec) * NANO + (now.tv_nsec - setpoint.received.tv_nsec);
+        if (age > g_setpoints_max_age_ns) {
+            g_setpoints_max_age_ns = age;
+        }
+        long steps = 0;
+        if (setpoint.position.x == NO_VALUE) {
+            steps = setpoint.angle;
+        } else {
+            long position_steps = (long)floor(get_angle(g_position, setpoint.position) / ROTATION_PER_STEP);
+            if (labs(position_steps) > 24) {
+                g_position = setpoint.position;
+                steps = position_steps;
+            }
+        }
+        angle += steps;
+        telemetry_record(TELEMETRY_COMMAND, taken - age, taken, atomic_load(&g_segment), steps, 0);
+        if (oldest != NULL && steps != 0 && *oldest == 0) {
+            *oldest = taken - age;
+        }
+    }
+    return angle;
+}
+
+static void wait_setpoints(void)
+{
+    uint64_t count;
+    while (!setpoints_pending() && g_server_is_running) {
+        if (read(g_setpoints_event, &count, sizeof(count)) < 0 && errno != EINTR) {
+            break;
+        }
+    }
+}
 #define INTERVAL 0.05
-#define WAIT_TIME 0.1
-#define BREAK_TIME 0.5
-#define REACH_TIME (0.5 - WAIT_TIME)
-#define HALF_REACH_TIME (REACH_TIME/2)
-#define MAX_FREQUENCY 7500
-#define MAX_ACCELERATION 24000
-#define MIN_FREQUENCY 200
-#define NANO 1000000000
-#define BACKWARD_FACTOR 0.000002
 
-static void* rotation_server_thread_simple(void* arg)
+// Controller parameters, tunable from Python while the server runs (get_params, set_params).
+// set_params writes the inactive copy and the server thread swaps it in between maneuvers,
+// so a maneuver never sees a partly updated set.
+struct Params {
+    double inertia_ratio; // platform to wheel inertia ratio
+    double min_frequency; // steps/s the motor can start and stop at
+    double max_frequency; // steps/s the trajectory never exceeds
+    double max_acceleration; // steps/s^2
+    double reach_time; // seconds to reach a new target
+    double wait_time; // seconds of the stop phase of rotation_server
+    double backward_factor; // rotation back after a stop per squared step
+};
+#define DEFAULT_PARAMS { \
+    .inertia_ratio = 6.9, \
+    .min_frequency = 200, \
+    .max_frequency = 7500, \
+    .max_acceleration = 24000, \
+    .reach_time = 0.4, \
+    .wait_time = 0.1, \
+    .backward_factor = 0.000002, \
+}
+static struct Params g_params_copies[2] = {DEFAULT_PARAMS, DEFAULT_PARAMS};
+
+#define MAX_FREQUENCY_LIMIT 1000000 // steps/s, shorter half-periods than 500 ns can't be timed
+struct ParamField {
+    const char* name;
+    size_t offset;
+    bool zero_allowed;
+    double limit; // values must be below it
+};
+static const struct ParamField PARAM_FIELDS[] = {
+    {"inertia_ratio", offsetof(struct Params, inertia_ratio), false, INFINITY},
+    {"min_frequency", offsetof(struct Params, min_frequency), false, MAX_FREQUENCY_LIMIT},
+    {"max_frequency", offsetof(struct Params, max_frequency), false, MAX_FREQUENCY_LIMIT},
+    {"max_acceleration", offsetof(struct Params, max_acceleration), false, INFINITY},
+    {"reach_time", offsetof(struct Params, reach_time), false, INFINITY},
+    {"wait_time", offsetof(struct Params, wait_time), false, 1.0},
+    {"backward_factor", offsetof(struct Params, backward_factor), true, INFINITY},
+};
+
+static pthread_mutex_t params_lock = PTHREAD_MUTEX_INITIALIZER; // held by set_params while writing the inactive copy
+static struct Params* _Atomic g_params = &g_params_copies[0]; // active copy
+static atomic_bool g_params_pending = false; // inactive copy holds new parameters
+
+// Makes new parameters active. Called by the server thread between maneuvers, never blocks.
+static void swap_params(void)
+{
+    if (!atomic_load(&g_params_pending) || pthread_mutex_trylock(&params_lock) != 0) {
+        return;
+    }
+    g_params = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    atomic_store(&g_params_pending, false);
+    pthread_mutex_unlock(&params_lock);
+}
+
+static PyObject* params_dict(const struct Params* params)
+{
+    PyObject* dict = PyDict_New();
+    if (dict == NULL) {
+        return NULL;
+    }
+    for (size_t i = 0; i < sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0]); i++) {
+        PyObject* value = PyFloat_FromDouble(*(const double*)((const char*)params + PARAM_FIELDS[i].offset));
+        if (value == NULL || PyDict_SetItemString(dict, PARAM_FIELDS[i].name, value) < 0) {
+            Py_XDECREF(value);
+            Py_DECREF(dict);
+            return NULL;
+        }
+        Py_DECREF(value);
+    }
+    return dict;
+}
+
+static PyObject* get_params(PyObject* self, PyObject* noarg)
 {
+    pthread_mutex_lock(&params_lock);
+    struct Params params = *g_params;
+    bool pending = atomic_load(&g_params_pending);
+    struct Params next = *(g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0]);
+    pthread_mutex_unlock(&params_lock);
+
+    PyObject* result = params_dict(&params);
+    if (result == NULL) {
+        return NULL;
+    }
+    PyObject* pending_params = pending ? params_dict(&next) : Py_NewRef(Py_None);
+    if (pending_params == NULL || PyDict_SetItemString(result, "pending", pending_params) < 0) {
+        Py_XDECREF(pending_params);
+        Py_DECREF(result);
+        return NULL;
+    }
+    Py_DECREF(pending_params);
+    return result;
+}
+
+static PyObject* set_params(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    if (PyTuple_GET_SIZE(args) != 0) {
+        PyErr_SetString(PyExc_Exception, "Parameters are given as keywords");
+        return NULL;
+    }
+
+    pthread_mutex_lock(&params_lock);
+    struct Params* next = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    struct Params params = atomic_load(&g_params_pending) ? *next : *g_params;
+    pthread_mutex_unlock(&params_lock);
+
+    PyObject* key;
+    PyObject* value;
+    Py_ssize_t position = 0;
+    while (kwargs != NULL && PyDict_Next(kwargs, &position, &key, &value)) {
+        const char* name = PyUnicode_AsUTF8(key);
+        if (name == NULL) {
+            return NULL;
+        }
+        size_t i = 0;
+        while (i < sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0]) && strcmp(PARAM_FIELDS[i].name, name) != 0) {
+            i++;
+        }
+        if (i == sizeof(PARAM_FIELDS) / sizeof(PARAM_FIELDS[0])) {
+            PyErr_Format(PyExc_Exception, "Unknown parameter: %s", name);
+            return NULL;
+        }
+        double number = PyFloat_AsDouble(value);
+        if (number == -1.0 && PyErr_Occurred()) {
+            return NULL;
+        }
+        if (!isfinite(number) || number < 0 || (number == 0 && !PARAM_FIELDS[i].zero_allowed) || number >= PARAM_FIELDS[i].limit) {
+            PyErr_Format(PyExc_Exception, "Invalid value of %s: %R", name, value);
+            return NULL;
+        }
+        *(double*)((char*)&params + PARAM_FIELDS[i].offset) = number;
+    }
+    if (params.min_frequency >= params.max_frequency) {
+        PyErr_SetString(PyExc_Exception, "min_frequency must be lower than max_frequency");
+        return NULL;
+    }
+
+    // Parameters are checked before anything is written, so they are applied all or none
+    pthread_mutex_lock(&params_lock);
+    next = g_params == &g_params_copies[0] ? &g_params_copies[1] : &g_params_copies[0];
+    *next = params;
+    atomic_store(&g_params_pending, true);
+    pthread_mutex_unlock(&params_lock);
+    if (!g_server_is_running) {
+        swap_params();
+    }
+
+    Py_RETURN_NONE;
+}
+
+// Real-time options of the rotation server thread, given to the server start functions
+#define RT_MAX_PREFAULT_STACK (4*1024*1024) // default thread stack is 8 MiB
+struct RtOptions {
+    int priority; // SCHED_FIFO priority, 0 keeps SCHED_OTHER
+    int cpu; // CPU the thread is pinned to, -1 for any
+    int lock_memory; // mlockall(MCL_CURRENT | MCL_FUTURE)
+    Py_ssize_t prefault_stack; // bytes of stack touched before the first pulse
+};
+// What was actually applied, filled by the server thread (errno of every failed option)
+struct RtStatus {
+    bool applied;
+    struct RtOptions requested;
+    int policy;
+    int priority;
+    unsigned long cpus;
+    bool memory_locked;
+    Py_ssize_t stack_prefaulted;
+    int priority_error;
+    int cpu_error;
+    int lock_memory_error;
+};
+static struct RtOptions g_rt_options = {0, -1, 0, 0};
+static struct RtStatus g_rt_status = {.applied = false};
+static pthread_cond_t rt_applied = PTHREAD_COND_INITIALIZER;
+
+static void prefault_stack(Py_ssize_t size)
+{
+    unsigned char stack[size];
+    for (Py_ssize_t i = 0; i < size; i += 4096) {
+        stack[i] = 0;
+    }
+    __asm__ volatile("" : : "r"(stack) : "memory"); // keep the writes
+}
+
+// Called by the server thread before its loop, start function waits for it
+static void apply_rt_options(void)
+{
+    struct RtStatus status = {.requested = g_rt_options};
+
+    if (g_rt_options.lock_memory) {
+        status.lock_memory_error = mlockall(MCL_CURRENT | MCL_FUTURE) < 0 ? errno : 0;
+        status.memory_locked = status.lock_memory_error == 0;
+    }
+    if (g_rt_options.prefault_stack > 0) {
+        prefault_stack(g_rt_options.prefault_stack);
+        status.stack_prefaulted = g_rt_options.prefault_stack;
+    }
+    if (g_rt_options.cpu >= 0) {
+        cpu_set_t cpus;
+        CPU_ZERO(&cpus);
+        CPU_SET(g_rt_options.cpu, &cpus);
+        status.cpu_error = pthread_setaffinity_np(pthread_self(), sizeof(cpus), &cpus);
+    }
+    if (g_rt_options.priority > 0) {
+        struct sched_param param = {.sched_priority = g_rt_options.priority};
+        status.priority_error = pthread_setschedparam(pthread_self(), SCHED_FIFO, &param);
+    }
+
+    // Read back what the kernel applied
+    struct sched_param param;
+    pthread_getschedparam(pthread_self(), &status.policy, &param);
+    status.priority = param.sched_priority;
+    cpu_set_t cpus;
+    if (pthread_getaffinity_np(pthread_self(), sizeof(cpus), &cpus) == 0) {
+        for (int cpu = 0; cpu < (int)(8 * sizeof(status.cpus)); cpu++) {
+            if (CPU_ISSET(cpu, &cpus)) {
+                status.cpus |= 1UL << cpu;
+            }
+        }
+    }
+
     pthread_mutex_lock(&lock);
-    SLEEP_PREP
-    g_server_is_running = true;
-    int dir = 0;
-    int first = 1;
-    long last_angle = 0;
-    //long idle_delay = (int)floor(0.5/MIN_FREQUENCY * 500000000) - WRITING_TIME_NS;
-    long idle_delay = 0;
-    double acceleration = 0.0;
-    long total_angle = 0;
-    double start_frequency = MIN_FREQUENCY;
+    status.applied = true;
+    g_rt_status = status;
+    pthread_cond_signal(&rt_applied);
+    pthread_mutex_unlock(&lock);
+}
 
-    while (g_server_is_running) {
+static int parse_rt_options(PyObject* args, PyObject* kwargs, struct RtOptions* options)
+{
+    static char* keywords[] = {"priority", "cpu", "lock_memory", "prefault_stack", NULL};
+    *options = (struct RtOptions){0, -1, 0, 0};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|iipn", keywords,
+            &options->priority, &options->cpu, &options->lock_memory, &options->prefault_stack))
+    {
+        return -1;
+    }
+    if (options->priority < 0 || options->priority > sched_get_priority_max(SCHED_FIFO)) {
+        PyErr_Format(PyExc_ValueError, "priority must be between 0 and %d", sched_get_priority_max(SCHED_FIFO));
+        return -1;
+    }
+    if (options->cpu >= CPU_SETSIZE) {
+        PyErr_SetString(PyExc_ValueError, "cpu out of range");
+        return -1;
+    }
+    if (options->prefault_stack < 0 || options->prefault_stack > RT_MAX_PREFAULT_STACK) {
+        PyErr_Format(PyExc_ValueError, "prefault_stack must be between 0 and %d bytes", RT_MAX_PREFAULT_STACK);
+        return -1;
+    }
+    return 0;
+}
 
-        if (g_angle != 0) {
+static PyObject* get_rt_status(PyObject* self, PyObject* noarg)
+{
+    struct RtStatus status;
+    Py_BEGIN_ALLOW_THREADS
+    pthread_mutex_lock(&lock);
+    status = g_rt_status;
+    pthread_mutex_unlock(&lock);
+    Py_END_ALLOW_THREADS
 
-            total_angle += g_angle;
-            g_angle = 0;
+    if (!status.applied) {
+        Py_RETURN_NONE;
+    }
+    PyObject* cpus = PyList_New(0);
+    if (cpus == NULL) {
+        return NULL;
+    }
+    for (int cpu = 0; cpu < (int)(8 * sizeof(status.cpus)); cpu++) {
+        if (status.cpus & (1UL << cpu)) {
+            PyObject* value = PyLong_FromLong(cpu);
+            if (value == NULL || PyList_Append(cpus, value) < 0) {
+                Py_XDECREF(value);
+                Py_DECREF(cpus);
+                return NULL;
+            }
+            Py_DECREF(value);
+        }
+    }
+    const char* policy = status.policy == SCHED_FIFO ? "SCHED_FIFO" : status.policy == SCHED_RR ? "SCHED_RR" : "SCHED_OTHER";
+    return Py_BuildValue("{s:s,s:i,s:N,s:N,s:n,s:{s:i,s:i,s:N,s:n},s:{s:z,s:z,s:z}}",
+        "policy", policy,
+        "priority", status.priority,
+        "cpus", cpus,
+        "memory_locked", PyBool_FromLong(status.memory_locked),
+        "stack_prefaulted", status.stack_prefaulted,
+        "requested",
+            "priority", status.requested.priority,
+            "cpu", status.requested.cpu,
+            "lock_memory", PyBool_FromLong(status.requested.lock_memory),
+            "prefault_stack", status.requested.prefault_stack,
+        "errors",
+            "priority", status.priority_error ? strerror(status.priority_error) : NULL,
+            "cpu", status.cpu_error ? strerror(status.cpu_error) : NULL,
+            "lock_memory", status.lock_memory_error ? strerror(status.lock_memory_error) : NULL);
+}
 
-            pthread_mutex_unlock(&lock);
+// Trajectory of the simple server in wheel steps, re-planned before every pulse
+struct Trajectory {
+    double position; // steps made
+    double target;
+    double velocity; // steps/s of the next pulse, 0 when stopped
+    double acceleration; // magnitude used towards the target
+};
 
-            SLEEP(BREAK_TIME * NANO)
+// Latency from a setpoint arrival to the first pulse made after re-planning for it
+static atomic_llong g_replan_count = 0;
+static atomic_llong g_replan_last_ns = 0;
+static atomic_llong g_replan_sum_ns = 0;
+static atomic_llong g_replan_max_ns = 0;
 
-            pthread_mutex_lock(&lock);
-        } else {
-            pthread_mutex_unlock(&lock);
+static void record_replan_latency(long long latency)
+{
+    atomic_fetch_add(&g_replan_count, 1);
+    atomic_store(&g_replan_last_ns, latency);
+    atomic_fetch_add(&g_replan_sum_ns, latency);
+    if (latency > atomic_load(&g_replan_max_ns)) {
+        atomic_store(&g_replan_max_ns, latency); // single writer
+    }
+}
 
-            // Normalize to half rotation [-800, 800]
-            total_angle %= 1600;
-            if (total_angle > 800) {
-                total_angle -= 1600;
-            } else if (total_angle < -800) {
-                total_angle += 1600;
+// Adds `angle` (platform steps) to the remaining rotation and plans the acceleration
+static void trajectory_retarget(struct Trajectory* trajectory, long angle)
+{
+    // Wheel turns against the platform
+    double remaining = (trajectory->target - trajectory->position) / -g_params->inertia_ratio + angle;
+
+    // Normalize to half rotation [-800, 800]
+    remaining = fmod(remaining, 1600);
+    if (remaining > 800) {
+        remaining -= 1600;
+    } else if (remaining < -800) {
+        remaining += 1600;
+    }
+
+    double distance = -remaining * g_params->inertia_ratio;
+    trajectory->target = trajectory->position + distance;
+
+    // From rest the target is reached in REACH_TIME (accelerate half, decelerate half),
+    // when already moving it has to be at least enough to stop on the target
+    double velocity = trajectory->velocity;
+    double stopping = velocity * velocity / (2 * fmax(fabs(distance), 1));
+    trajectory->acceleration = fmax(4 * fabs(distance) / g_params->reach_time / g_params->reach_time, fmin(stopping, g_params->max_acceleration));
+}
+
+// Plans the next pulse: returns its half-period in ns, negative when going backwards, 0 when the target is reached
+static long trajectory_next(struct Trajectory* trajectory)
+{
+    double distance = trajectory->target - trajectory->position;
+    double velocity = trajectory->velocity;
+    if (fabs(distance) < 1 && fabs(velocity) <= 2 * g_params->min_frequency) {
+        trajectory->velocity = 0.0;
+        return 0;
+    }
+    if (velocity == 0.0) {
+        velocity = copysign(g_params->min_frequency, distance); // motor can start at g_params->min_frequency
+    }
+
+    // Accelerate while the target is ahead and further than the distance needed to slow down to MIN_FREQUENCY
+    double slowing = (velocity * velocity - g_params->min_frequency * g_params->min_frequency) / (2 * trajectory->acceleration);
+    bool accelerate = velocity * distance > 0 && fabs(distance) > slowing;
+    double acceleration = trajectory->acceleration;
+    if (!accelerate && velocity * distance > 0) {
+        // Brake exactly enough to reach MIN_FREQUENCY on the target
+        double braking = (velocity * velocity - g_params->min_frequency * g_params->min_frequency) / (2 * fmax(fabs(distance), 1));
+        acceleration = fmax(acceleration, fmin(braking, g_params->max_acceleration));
+    }
+    double change = (accelerate ? 1 : -1) * acceleration / fabs(velocity); // pulse lasts 1/|velocity|
+
+    trajectory->position += velocity > 0 ? 1 : -1;
+    double next = velocity + (velocity > 0 ? change : -change);
+    if (fabs(next) < g_params->min_frequency || next * velocity < 0) {
+        // Slowest pulses continue towards the target, reversing if it was passed
+        double left = trajectory->target - trajectory->position;
+        next = copysign(g_params->min_frequency, fabs(left) < 1 ? velocity : left);
+    }
+    next = fmax(fmin(next, g_params->max_frequency), -g_params->max_frequency);
+    trajectory->velocity = next;
+    return (long)copysign(500000000 / fabs(velocity), velocity);
+}
+
+static void* rotation_server_thread_simple(void* arg)
+{
+    apply_rt_options();
+    swap_params();
+    struct Trajectory trajectory = {0};
+    struct Pulser pulser;
+    bool moving = false;
+    long long arrival = 0; // oldest setpoint not yet reflected by a pulse
+
+    while (g_server_is_running) {
+        long long oldest;
+        long angle = drain_setpoints(&oldest);
+        if (angle != 0) {
+            trajectory_retarget(&trajectory, angle);
+            if (arrival == 0) {
+                arrival = oldest;
             }
+        }
 
-            acceleration = -total_angle * INERTIA_PLATFORM2WHEEL_RATIO / HALF_REACH_TIME / HALF_REACH_TIME;
-            //acceleration = -2 * total_angle * INERTIA_PLATFORM2WHEEL_RATIO / REACH_TIME / REACH_TIME;
-            start_frequency = copysignf(MIN_FREQUENCY, acceleration);
-            generate_signal_prep(acceleration, start_frequency, HALF_REACH_TIME);
-            //generate_signal(acceleration, start_frequency, REACH_TIME);
-            
-            total_angle = 0;
-            pthread_mutex_lock(&lock);
+        long half_period = trajectory_next(&trajectory);
+        if (half_period == 0) {
+            if (moving) {
+                sleep_until_ns(pulser.deadline);
+                pulser_end(&pulser);
+                long long now = now_ns();
+                telemetry_record(TELEMETRY_STOP, now, now, pulser.segment, 0, 0);
+                moving = false;
+            }
+            arrival = 0; // setpoints cancelled out
 
+            swap_params();
             gpioWrite(ENABLE_PIN, 1);
-            pthread_cond_wait(&cond, &lock);
-            gpioWrite(ENABLE_PIN, 0);
+            wait_setpoints();
+            if (g_server_is_running) {
+                gpioWrite(ENABLE_PIN, 0);
+            }
+            continue;
         }
 
+        if (!moving) {
+            pulser_start(&pulser, now_ns());
+            moving = true;
+        }
+        write_dir(half_period < 0 ? 0 : 1);
+        long long written = pulse_edge(&pulser, 1);
+        if (arrival != 0) {
+            record_replan_latency(written - arrival);
+            arrival = 0;
+        }
+        pulser_wait(&pulser, labs(half_period));
+        pulse_edge(&pulser, 0);
+        pulser_wait(&pulser, labs(half_period));
     }
 
-    pthread_mutex_unlock(&lock);
+    if (moving) {
+        pulser_end(&pulser);
+    }
     return NULL;
 }
 
+static PyObject* get_replan_latency(PyObject* self, PyObject* noarg)
+{
+    long long count = atomic_load(&g_replan_count);
+    return Py_BuildValue("{s:L,s:L,s:d,s:L}",
+        "count", count,
+        "last_ns", (long long)atomic_load(&g_replan_last_ns),
+        "mean_ns", count ? (double)atomic_load(&g_replan_sum_ns) / count : 0.0,
+        "max_ns", (long long)atomic_load(&g_replan_max_ns));
+}
+
 static void* rotation_server_thread(void* arg)
 {
-    pthread_mutex_lock(&lock);
+    apply_rt_options();
+    swap_params();
     SLEEP_PREP
-    g_server_is_running = true;
-    int dir = 0;
     int first = 1;
     long last_angle = 0;
-    //long idle_delay = (int)floor(0.5/MIN_FREQUENCY * 500000000) - WRITING_TIME_NS;
+    //long idle_delay = (int)floor(0.5/MIN_FREQUENCY * 500000000);
     long idle_delay = 0;
     double acceleration = 0.0;
     long total_angle = 0;
-    double start_frequency = MIN_FREQUENCY;
+    double start_frequency = g_params->min_frequency;
 
     while (g_server_is_running) {
+        long angle = drain_setpoints(NULL);
 
-        if (g_angle != 0) {
+        if (angle != 0) {
 
             // Normalize to half rotation [-800, 800]
-            g_angle %= 1600;
-            if (g_angle > 800) {
-                g_angle -= 1600;
-            } else if (g_angle < -800) {
-                g_angle += 1600;
+            angle %= 1600;
+            if (angle > 800) {
+                angle -= 1600;
+            } else if (angle < -800) {
+                angle += 1600;
             }
 
-            //printf("g_angle=%ld\n", g_angle);
-            //acceleration = -g_angle * INERTIA_PLATFORM2WHEEL_RATIO / HALF_REACH_TIME / HALF_REACH_TIME;
-            acceleration = -2 * g_angle * INERTIA_PLATFORM2WHEEL_RATIO / REACH_TIME / REACH_TIME;
-            last_angle = g_angle;
-            //total_angle += g_angle;
-            total_angle -= (long)floor(g_angle * INERTIA_PLATFORM2WHEEL_RATIO);
-            g_angle = 0;
-
-            pthread_mutex_unlock(&lock);
+            //printf("angle=%ld\n", angle);
+            //acceleration = -angle * INERTIA_PLATFORM2WHEEL_RATIO / HALF_REACH_TIME / HALF_REACH_TIME;
+            acceleration = -2 * angle * g_params->inertia_ratio / g_params->reach_time / g_params->reach_time;
+            last_angle = angle;
+            //total_angle += angle;
+            total_angle -= (long)floor(angle * g_params->inertia_ratio);
 
             //SLEEP(WAIT_TIME * NANO)
 
             if (idle_delay == 0){
-              start_frequency = copysignf(MIN_FREQUENCY, acceleration);
+              start_frequency = copysignf(g_params->min_frequency, acceleration);
             }
-            double end_frequency = start_frequency + acceleration*REACH_TIME;
-            if (end_frequency*start_frequency > 0 && fabs(end_frequency) > MIN_FREQUENCY) {
-              //generate_signal_prep(acceleration, MIN_FREQUENCY, HALF_REACH_TIME);
-              generate_signal(acceleration, start_frequency, REACH_TIME);
+            double end_frequency = start_frequency + acceleration*g_params->reach_time;
+            if (end_frequency*start_frequency > 0 && fabs(end_frequency) > g_params->min_frequency) {
+              generate_signal(acceleration, start_frequency, g_params->reach_time);
             } else if (idle_delay == 0) {
-              //generate_signal_prep(acceleration, MIN_FREQUENCY, HALF_REACH_TIME);
-              generate_signal(acceleration, start_frequency, REACH_TIME);
+              generate_signal(acceleration, start_frequency, g_params->reach_time);
             } else { // change of frequency sign during acceleration phase
               // just decelerate to 0
-                double time_to_stop = fabs((copysignf(MIN_FREQUENCY, start_frequency) - start_frequency) / acceleration);
+                double time_to_stop = fabs((copysignf(g_params->min_frequency, start_frequency) - start_frequency) / acceleration);
                 generate_signal(acceleration, start_frequency, time_to_stop);
             }
             first = 0;
-
-            pthread_mutex_lock(&lock);
         } else {
             //printf("STOP\n");
-            pthread_mutex_unlock(&lock);
-            
             if (first == 0) {
-                double end_frequency = acceleration * REACH_TIME + start_frequency;
-                if (fabs(end_frequency) < MIN_FREQUENCY) {
-                    end_frequency = copysignf(MIN_FREQUENCY, end_frequency);
+                double end_frequency = acceleration * g_params->reach_time + start_frequency;
+                if (fabs(end_frequency) < g_params->min_frequency) {
+                    end_frequency = copysignf(g_params->min_frequency, end_frequency);
                 }
-                double rotation_backwards = copysign(1.0, -last_angle) * total_angle * total_angle * BACKWARD_FACTOR;
-                double  waiting_time = WAIT_TIME;
+                double rotation_backwards = copysign(1.0, -last_angle) * total_angle * total_angle * g_params->backward_factor;
+                double  waiting_time = g_params->wait_time;
                 
                 //double deceleration = (MIN_FREQUENCY - end_frequency) / WAIT_TIME;
                 double deceleration = 2*(rotation_backwards - end_frequency * waiting_time)/(waiting_time*waiting_time);
@@ -361,13 +1090,13 @@ static void* rotation_server_thread(void* arg)
                 double decelerated_frequency = 1.0;
                 if (fabs(deceleration) < max_acc && deceleration*end_frequency < 0) {
                     decelerated_frequency = end_frequency + deceleration * waiting_time;
-                    if (fabs(decelerated_frequency) < MIN_FREQUENCY || decelerated_frequency*end_frequency < 0) {
-                        deceleration = (copysignf(MIN_FREQUENCY,end_frequency) - end_frequency) / waiting_time;
+                    if (fabs(decelerated_frequency) < g_params->min_frequency || decelerated_frequency*end_frequency < 0) {
+                        deceleration = (copysignf(g_params->min_frequency,end_frequency) - end_frequency) / waiting_time;
                         decelerated_frequency = 0.0;
                     }
                     generate_signal(deceleration, end_frequency, waiting_time);
-                } else if (fabs(deceleration) > MAX_ACCELERATION) {
-                    deceleration = copysignf(MAX_ACCELERATION,deceleration);
+                } else if (fabs(deceleration) > g_params->max_acceleration) {
+                    deceleration = copysignf(g_params->max_acceleration,deceleration);
                     double delta = sqrt(end_frequency*end_frequency + 2*rotation_backwards*deceleration);
                     waiting_time = (-end_frequency + delta)/deceleration;
                     if (waiting_time < 0) waiting_time = (-end_frequency - delta)/deceleration;
@@ -382,49 +1111,58 @@ static void* rotation_server_thread(void* arg)
                     decelerated_frequency = end_frequency + deceleration * waiting_time;
                 }
                     
-                if (fabs(decelerated_frequency) > MIN_FREQUENCY) {
-                  idle_delay = labs((long)floor(500000000/decelerated_frequency)) - WRITING_TIME_NS;
+                if (fabs(decelerated_frequency) > g_params->min_frequency) {
+                  idle_delay = labs((long)floor(500000000/decelerated_frequency));
                   start_frequency = decelerated_frequency;
                 } else {
                   idle_delay = 0;
                   total_angle = 0;
                 //   start_frequency = MIN_FREQUENCY; // moved above
                 }
-                printf("\ntotal_angle=%ld\nrotation_backwards=%f\ndeceleration=%f\nwaiting_time=%f\nend_frequency=%f\ndecelerated_frequency=%f\nidle_delay=%ld\n", total_angle, rotation_backwards, deceleration, waiting_time, end_frequency, decelerated_frequency, idle_delay);
+                long long now = now_ns();
+                telemetry_record(TELEMETRY_STOP, now, now, atomic_load(&g_segment), total_angle, 0);
                 first = 1;
             }
 
             if (idle_delay > 0){
               //write_dir(dir == 0 ? 1 : 0);
-              gpioWrite(STEP_PIN, 1);
-              SLEEP(idle_delay)
-              gpioWrite(STEP_PIN, 0);
-              SLEEP(idle_delay)
+              struct Pulser pulser; // timing of idle pulses is not kept
+              pulser_start(&pulser, now_ns());
+              pulse_edge(&pulser, 1);
+              pulser_wait(&pulser, idle_delay);
+              pulse_edge(&pulser, 0);
+              pulser_wait(&pulser, idle_delay);
+              sleep_until_ns(pulser.deadline);
               //double acceleration = -2 * 24 * INERTIA_PLATFORM2WHEEL_RATIO / 0.05 / 0.05;
               //generate_signal(acceleration, MIN_FREQUENCY, 0.05);
             } else {
-              SLEEP(WAIT_TIME * NANO)
+              SLEEP(g_params->wait_time * NANO)
             }
-            pthread_mutex_lock(&lock);
 
             if (idle_delay == 0){
+              swap_params();
               gpioWrite(ENABLE_PIN, 1);
-              pthread_cond_wait(&cond, &lock);
-              gpioWrite(ENABLE_PIN, 0);
+              wait_setpoints();
+              if (g_server_is_running) {
+                gpioWrite(ENABLE_PIN, 0);
+              }
             }
         }
 
     }
 
-    pthread_mutex_unlock(&lock);
     return NULL;
 }
 
-static PyObject* rotation_server(PyObject* self, PyObject* noarg)
+static PyObject* rotation_server(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     bool server_was_running;
     int thread_created = 0;
     int thread_detached = 0;
+    struct RtOptions options;
+    if (parse_rt_options(args, kwargs, &options) < 0) {
+        return NULL;
+    }
 
     Py_BEGIN_ALLOW_THREADS
     pthread_mutex_lock(&lock);
@@ -432,9 +1170,17 @@ static PyObject* rotation_server(PyObject* self, PyObject* noarg)
 
     if (!server_was_running) {
         pthread_t thread_id;
+        g_rt_options = options;
+        g_rt_status.applied = false;
+        g_server_is_running = true; // before the start returns, so clients can send right away
         thread_created = pthread_create(&thread_id, NULL, rotation_server_thread, NULL);
         if (thread_created != 0) {
+            g_server_is_running = false;
+        } else {
             thread_detached = pthread_detach(thread_id);
+            while (!g_rt_status.applied) {
+                pthread_cond_wait(&rt_applied, &lock);
+            }
         }
     }
     pthread_mutex_unlock(&lock);
@@ -456,11 +1202,15 @@ static PyObject* rotation_server(PyObject* self, PyObject* noarg)
     Py_RETURN_NONE;
 }
 
-static PyObject* rotation_server_simple(PyObject* self, PyObject* noarg)
+static PyObject* rotation_server_simple(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     bool server_was_running;
     int thread_created = 0;
     int thread_detached = 0;
+    struct RtOptions options;
+    if (parse_rt_options(args, kwargs, &options) < 0) {
+        return NULL;
+    }
 
     Py_BEGIN_ALLOW_THREADS
     pthread_mutex_lock(&lock);
@@ -468,9 +1218,17 @@ static PyObject* rotation_server_simple(PyObject* self, PyObject* noarg)
 
     if (!server_was_running) {
         pthread_t thread_id;
+        g_rt_options = options;
+        g_rt_status.applied = false;
+        g_server_is_running = true; // before the start returns, so clients can send right away
         thread_created = pthread_create(&thread_id, NULL, rotation_server_thread_simple, NULL);
         if (thread_created != 0) {
+            g_server_is_running = false;
+        } else {
             thread_detached = pthread_detach(thread_id);
+            while (!g_rt_status.applied) {
+                pthread_cond_wait(&rt_applied, &lock);
+            }
         }
     }
     pthread_mutex_unlock(&lock);
@@ -511,21 +1269,10 @@ static PyObject* rotation_client_position(PyObject* self, PyObject* args)
         PyErr_SetString(PyExc_Exception, "Rotation server is not running");
         return NULL;
     }
-    
-    Py_BEGIN_ALLOW_THREADS
-    
-    pthread_mutex_lock(&lock);
-    
-    double angle = get_angle(g_position, target_position);
-    long angle_steps = (long)floor(angle / ROTATION_PER_STEP);
-    if (labs(angle) > 24) {
-        g_position = target_position;
-        g_angle += angle_steps;
-        pthread_cond_signal(&cond);
-    }
 
-    pthread_mutex_unlock(&lock);
-    Py_END_ALLOW_THREADS
+    // The angle to the last accepted position is computed by the server thread
+    struct Setpoint setpoint = {.angle = 0, .position = target_position};
+    push_setpoint(setpoint);
 
     Py_RETURN_NONE;
 }
@@ -543,38 +1290,140 @@ static PyObject* rotation_client(PyObject* self, PyObject* args)
         return NULL;
     }
 
-    Py_BEGIN_ALLOW_THREADS
-
-    pthread_mutex_lock(&lock);
-
     if (labs(angle) > 24) {
-        g_angle += angle;
-        pthread_cond_signal(&cond);
+        struct Setpoint setpoint = {.angle = angle, .position = {NO_VALUE, NO_VALUE, NO_VALUE, 1}};
+        push_setpoint(setpoint);
     }
 
-    pthread_mutex_unlock(&lock);
-    Py_END_ALLOW_THREADS
-
     Py_RETURN_NONE;
 }
 
 static PyObject* print_globals(PyObject* self, PyObject* noarg)
 {
-    pthread_mutex_lock(&lock);
-    long angle = g_angle;
-    double frequency = g_frequency;
-    double acceleration = g_acceleration;
-    pthread_mutex_unlock(&lock);
-    printf("g_angle: %ld, g_frequency: %f, g_acceleration: %f\n", angle, frequency, acceleration);
+    unsigned pending = g_setpoints_head - g_setpoints_tail;
+    printf("pending setpoints: %u, dropped: %lu, max setpoint age: %ld ns, g_frequency: %f, g_acceleration: %f\n",
+        pending, (unsigned long)g_setpoints_dropped, (long)g_setpoints_max_age_ns, g_frequency, g_acceleration);
     Py_RETURN_NONE;
 }
 
+// Rows of rotation_client_batch: contiguous float64 (t, x, y, z, w)
+#define POSITION_ROW_LENGTH 5
+// Rows of relative_yaw: contiguous float64 (x, y, z, w)
+#define QUATERNION_ROW_LENGTH 4
+
+// Gets the buffer of `object` as float64 rows of `row_length` values (`row_name` is used in the error message).
+// On error the exception is set and the buffer is not held.
+static int get_double_rows(PyObject* object, Py_buffer* buffer, Py_ssize_t row_length, const char* row_name, Py_ssize_t* rows)
+{
+    if (PyObject_GetBuffer(object, buffer, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+        return -1;
+    }
+    const char* format = buffer->format;
+    if (format[0] == '<' || format[0] == '=' || format[0] == '@') {
+        format++;
+    }
+    if (strcmp(format, "d") != 0 || buffer->itemsize != sizeof(double)
+        || buffer->len % (row_length * sizeof(double)) != 0) {
+        PyBuffer_Release(buffer);
+        PyErr_Format(PyExc_Exception, "Expected a contiguous float64 buffer of %s rows", row_name);
+        return -1;
+    }
+    *rows = buffer->len / (row_length * sizeof(double));
+    return 0;
+}
+
+static PyObject* relative_yaw(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    static char* keywords[] = {"quaternions", "steps", NULL};
+    PyObject* object;
+    int steps = 0;
+    Py_buffer buffer;
+    Py_ssize_t rows;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|p", keywords, &object, &steps)
+        || get_double_rows(object, &buffer, QUATERNION_ROW_LENGTH, "(x, y, z, w)", &rows) < 0)
+    {
+        return NULL;
+    }
+
+    // float64 angles or int64 steps, both 8 bytes
+    Py_ssize_t count = rows > 1 ? rows - 1 : 0;
+    PyObject* result = PyByteArray_FromStringAndSize(NULL, count * 8);
+    if (result == NULL) {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    const double* q = buffer.buf;
+    char* out = PyByteArray_AS_STRING(result);
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < count; i++, q += QUATERNION_ROW_LENGTH) {
+        struct Quaternion q_from = {q[0], q[1], q[2], q[3]};
+        struct Quaternion q_to = {q[4], q[5], q[6], q[7]};
+        double angle = get_angle(q_from, q_to);
+        if (steps) {
+            ((long long*)out)[i] = (long long)floor(angle / ROTATION_PER_STEP);
+        } else {
+            ((double*)out)[i] = angle;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    return result;
+}
+
+static PyObject* rotation_client_batch(PyObject* self, PyObject* args)
+{
+    PyObject* object;
+    Py_buffer buffer;
+    Py_ssize_t rows;
+    if (!PyArg_ParseTuple(args, "O", &object) || get_double_rows(object, &buffer, POSITION_ROW_LENGTH, "(t, x, y, z, w)", &rows) < 0)
+    {
+        return NULL;
+    }
+    if (rows > 0 && g_position.x != NO_VALUE && g_server_is_running == false) {
+        PyBuffer_Release(&buffer);
+        PyErr_SetString(PyExc_Exception, "Rotation server is not running");
+        return NULL;
+    }
+
+    // Newest wins: the server measures the rotation from its last accepted position,
+    // so only the newest row has to be sent to it and the older rows are dropped
+    Py_ssize_t accepted = 0;
+    Py_ssize_t coalesced = 0;
+    const double* rows_data = buffer.buf;
+    const double* newest = NULL;
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < rows; i++) {
+        const double* row = rows_data + i * POSITION_ROW_LENGTH;
+        if (newest == NULL || row[0] >= newest[0]) {
+            newest = row;
+        }
+    }
+    Py_END_ALLOW_THREADS
+    // push_setpoint is the single producer of the ring only while the GIL is held
+    if (newest != NULL) {
+        struct Quaternion target_position = {newest[1], newest[2], newest[3], newest[4]};
+        if (g_position.x == NO_VALUE) {
+            g_position = target_position;
+            accepted = 1;
+        } else {
+            struct Setpoint setpoint = {.angle = 0, .position = target_position};
+            accepted = push_setpoint(setpoint) ? 1 : 0;
+        }
+        coalesced = rows - 1;
+    }
+
+    PyBuffer_Release(&buffer);
+    return Py_BuildValue("(nn)", accepted, coalesced);
+}
+
 static PyObject* stop_rotation(PyObject* self, PyObject* noarg)
 {
     Py_BEGIN_ALLOW_THREADS
     pthread_mutex_lock(&lock);
     g_server_is_running = false;
     pthread_mutex_unlock(&lock);
+    wake_server();
     Py_END_ALLOW_THREADS
     Py_RETURN_NONE;
 }
@@ -594,6 +1443,16 @@ static void fast_motor2_atexit(void) {
 static int
 fast_motor2_module_exec(PyObject *m)
 {
+    if (g_setpoints_event < 0) {
+        g_setpoints_event = eventfd(0, EFD_CLOEXEC);
+        ASSERT_SUCCESS(g_setpoints_event, "Failed to create setpoint eventfd");
+    }
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "SIMULATED", SIMULATED), "Failed to add SIMULATED");
+    ASSERT_SUCCESS(PyModule_AddObject(m, "ROTATION_PER_STEP", PyFloat_FromDouble(ROTATION_PER_STEP)), "Failed to add ROTATION_PER_STEP");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_SIZE", TELEMETRY_SIZE), "Failed to add TELEMETRY_SIZE");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_PULSE", TELEMETRY_PULSE), "Failed to add TELEMETRY_PULSE");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_COMMAND", TELEMETRY_COMMAND), "Failed to add TELEMETRY_COMMAND");
+    ASSERT_SUCCESS(PyModule_AddIntConstant(m, "TELEMETRY_STOP", TELEMETRY_STOP), "Failed to add TELEMETRY_STOP");
     ASSERT_SUCCESS(gpioInitialise(), "Failed to initialize PIGPIO");
     ASSERT_SUCCESS(Py_AtExit(fast_motor2_atexit), "Failed to register PIGPIO exit handler");
     ASSERT_SUCCESS(gpioSetMode(STEP_PIN, PI_OUTPUT), "Failed to set GPIO mode");
@@ -607,6 +1466,7 @@ fast_motor2_module_exec(PyObject *m)
     ASSERT_SUCCESS(gpioWrite(M1_PIN, 1), "Failed to write to GPIO");
     ASSERT_SUCCESS(gpioWrite(M2_PIN, 1), "Failed to write to GPIO");
     ASSERT_SUCCESS(gpioWrite(M3_PIN, 0), "Failed to write to GPIO");
+    calibrate_overheads();
     clock_gettime(CLOCK_MONOTONIC, &signal_min_start);
     return 0;
 }
@@ -633,15 +1493,17 @@ static PyMethodDef fast_motor2_funcs[] = {
     },
     {    
         "rotation_server",
-        rotation_server,
-        METH_NOARGS,
-        "Starts the rotation server in a separate thread."
+        (PyCFunction)(void(*)(void))rotation_server,
+        METH_VARARGS | METH_KEYWORDS,
+        "Starts the rotation server in a separate thread. "
+        "Options: priority (SCHED_FIFO), cpu (affinity), lock_memory (mlockall), prefault_stack (bytes)."
     },
     {
         "rotation_server_simple",
-        rotation_server_simple,
-        METH_NOARGS,
-        "Starts the simple rotation server in a separate thread."
+        (PyCFunction)(void(*)(void))rotation_server_simple,
+        METH_VARARGS | METH_KEYWORDS,
+        "Starts the simple rotation server in a separate thread. "
+        "Options: priority (SCHED_FIFO), cpu (affinity), lock_memory (mlockall), prefault_stack (bytes)."
     },
     {    
         "rotation_client",
@@ -655,12 +1517,92 @@ static PyMethodDef fast_motor2_funcs[] = {
         METH_VARARGS,
         "Sends target rotation (as quaternion) to the server."
     },
+    {
+        "relative_yaw",
+        (PyCFunction)(void(*)(void))relative_yaw,
+        METH_VARARGS | METH_KEYWORDS,
+        "Returns the Y axis rotation between consecutive quaternions of a contiguous float64 buffer of (x, y, z, w) rows "
+        "as a bytearray of N-1 float64 radians, or int64 steps of ROTATION_PER_STEP with steps=True."
+    },
+    {
+        "rotation_client_batch",
+        rotation_client_batch,
+        METH_VARARGS,
+        "Sends target rotations given as a contiguous float64 buffer of (t, x, y, z, w) rows. "
+        "Only the newest row (largest t) is sent, the server rotates from its last position straight to it "
+        "and the older rows are dropped. Returns (accepted, coalesced) row counts."
+    },
     {    
         "stop_rotation",
         stop_rotation,
         METH_NOARGS,
         "Stops the rotation server."
     },
+    {
+        "get_replan_latency",
+        get_replan_latency,
+        METH_NOARGS,
+        "Returns count, last, mean and max latency (ns) from a setpoint arrival to the first pulse of the simple server reflecting it."
+    },
+    {
+        "get_params",
+        get_params,
+        METH_NOARGS,
+        "Returns the active controller parameters, with the ones waiting for the end of a maneuver under 'pending'."
+    },
+    {
+        "set_params",
+        (PyCFunction)(void(*)(void))set_params,
+        METH_VARARGS | METH_KEYWORDS,
+        "Sets controller parameters given as keywords (inertia_ratio, min_frequency, max_frequency, max_acceleration, reach_time, wait_time, backward_factor). "
+        "min_frequency must be lower than max_frequency, wait_time lower than 1 s. "
+        "They are applied together between maneuvers, immediately when the server is not running."
+    },
+    {
+        "get_rt_status",
+        get_rt_status,
+        METH_NOARGS,
+        "Returns real-time settings applied to the rotation server thread (None before the first start)."
+    },
+    {
+        "telemetry_buffer",
+        telemetry_buffer,
+        METH_NOARGS,
+        "Returns the telemetry ring as a read-only memoryview (no copy) of TELEMETRY_SIZE 40 byte records."
+    },
+    {
+        "telemetry_cursor",
+        telemetry_cursor,
+        METH_NOARGS,
+        "Returns the number of recorded telemetry events, the cursor of the next event."
+    },
+    {
+        "telemetry_read",
+        telemetry_read,
+        METH_VARARGS,
+        "Returns (cursor, lost, views) with memoryviews of the events recorded since the given cursor. "
+        "The views are live, records being overwritten are told apart by their sequence field."
+    },
+    {
+        "get_timing",
+        get_timing,
+        METH_NOARGS,
+        "Returns measured gpioWrite and wakeup overheads (ns) and timing of the last maneuver."
+    },
+#ifdef SIMULATE_GPIO
+    {
+        "sim_edges",
+        sim_edges,
+        METH_VARARGS,
+        "Returns recorded GPIO edges as (CLOCK_MONOTONIC ns, gpio, level), clear=True empties the record."
+    },
+    {
+        "sim_edges_lost",
+        sim_edges_lost,
+        METH_NOARGS,
+        "Returns the number of edges not recorded because the record was full."
+    },
+#endif
     {    
         "print_globals",
         print_globals,
@@ -1,17 +1,33 @@
 import RPi.GPIO as GPIO
 from time import sleep, perf_counter
-from threading import Thread
+from threading import Thread, Event
 import math
 import logging
 from functools import cache
+from collections import OrderedDict, deque
+from itertools import islice, chain
+from array import array
 import pigpio
 import re
+import numpy as np
+from motor_backends import GPIOBackend, PigpioWaveBackend, pins_levels
+from typing import Iterable
 
 FULL_ROTATION = 200
 ROTATION_PER_STEP = 2*math.pi / FULL_ROTATION
 INERTIA_PLATFORM2WHEEL_RATIO = 7.1
 MIN_FREQUENCY = 100
 MAX_IMPULSE_DURATION = 1/MIN_FREQUENCY
+MAX_STEP_FREQUENCY = 10_000  # Hz, step rate the executor can hold
+MAX_STEP_ACCELERATION = 20_000  # Hz/s, step frequency change rate of MotorRotator ramps
+MICROSTEP_SWITCH_FREQUENCY = 200  # Hz, M1-M3 switch to a coarser resolution above it (and back below half of it)
+MAX_WAIT_TIME_NS = 1_000_000_000 // MIN_FREQUENCY // 2
+SCHEDULE_CACHE_SIZE = 4 * 1024 * 1024  # bytes
+STREAM_CHUNK = 256  # steps planned at once
+STREAM_LOOKAHEAD = 64  # wait times planned ahead of the executor
+RAMP_CHUNK = 65536  # most steps planned at once by accelerated_impulse_schedule
+RAMP_EXACT = 1e-3  # ramp steps are planned one by one while k/f^2 is above it, in batches below
+SMALL_RAMP = 500  # steps below which a ramp is planned one by one, NumPy batches cost more
 
 PINS = {
     "M1": 17,
@@ -32,26 +48,34 @@ MPINS_SETTINGS = {
     1/2: (GPIO.HIGH, GPIO.LOW, GPIO.LOW),
     1: (GPIO.LOW, GPIO.LOW, GPIO.LOW)
 }
+RESOLUTIONS = {settings: resolution for resolution, settings in MPINS_SETTINGS.items()}
+# Shadow register of driver pins, updated by every write (see output)
+PIN_STATE = {pin: GPIO.LOW for pin in PINS.values()}
+VERIFY_PINS = False  # compare PIN_STATE with GPIO.input on every lookup
 LOG = logging.getLogger(__name__)
 
 
 PI = None
 SCRIPT_ID = None
+BACKEND = None  # PulseBackend executing step schedules (GPIOBackend after setup)
 # about 250 commands per loop
 # with current clock set to 10MHz it is 16 us per loop
+# (motor_script.py emulates the script offline: commands per loop, loop time, pulse timing error)
 # TODO: can b be negative? YES but then b accuraccy is only 19 bits before comma
 # TODO: is b really lower that 2^20? YES (needs to be shown in paper why)
-PIGPIO_SCRIPT = f"""
-// p0 = a (x.0)
-// p1 = b (x.12)
-// p2 = duration (x.20)
-// p3 = t0 (x.20)
+PIGPIO_SEGMENT = """
+// One segment of accelerated signal (called with CALL 500)
+// v40 = a (x.0)
+// v41 = b (x.12)
+// v42 = duration (x.20)
+// v43 = t0 (x.20)
 // p4 = pin
 
+TAG 500
 W p4 1
 
-LD v0 p3 // v0 -> sum (x.20)
-LD v1 p3 // v1 -> tx (x.20)
+LD v0 v43 // v0 -> sum (x.20)
+LD v1 v43 // v1 -> tx (x.20)
 
 LD v10 500000 
 LD v12 v1
@@ -76,10 +100,17 @@ MICS v3
 W p4 0
 MICS v4
 
-LD v10 p1
+LD v10 v41
 LD v12 v0
-CALL 200 // v10,v11 = b*Sx-1
-LDA p0
+CALL 200 // v10,v11 = b*Sx-1 (b taken as unsigned)
+LDA v41
+CMP 0
+JP 120
+LDA v10
+SUB v0
+STA v10 // negative b: (2^32+b)*Sx-1 - 2^32*Sx-1
+TAG 120
+LDA v40
 ADD v10 // A,v11 = a+b*Sx-1 (32.32) (no overflow for my data)
 RLA 12
 STA v5
@@ -102,9 +133,9 @@ STA v1 // v1 = tx (seconds) (x.20)
 ADD v0
 STA v0 // v0 = sum (x.20)
 
-CMP p2
+CMP v42
 JM 100
-JMP 999 // End of script
+RET // End of segment
 
 
 TAG 200 // 2 register mul (args: v10, v12)
@@ -203,19 +234,53 @@ RR v21 1 // v21 = carry
 
 RET
 
-
-TAG 999
 """
-PIGPIO_SCRIPT = re.sub(r"//.*","", PIGPIO_SCRIPT)
-PIGPIO_SCRIPT = re.sub(r"\s+"," ", PIGPIO_SCRIPT)
-PIGPIO_SCRIPT = PIGPIO_SCRIPT.strip().encode()
+
+def motion_script(segments):
+    """Script running `segments` (script text loading v40-v43 and calling 500) followed by PIGPIO_SEGMENT."""
+    script = segments + " JMP 999 " + PIGPIO_SEGMENT + " TAG 999"
+    script = re.sub(r"//.*","", script)
+    script = re.sub(r"\s+"," ", script)
+    return script.strip().encode()
+
+# p0-p3 are a, b, duration and t0 of one segment, p4 is the pin
+PIGPIO_SCRIPT = motion_script("LD v40 p0 LD v41 p1 LD v42 p2 LD v43 p3 CALL 500")
 
 def setup():
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(list(PINS.values()), GPIO.OUT, initial=GPIO.LOW)
+    PIN_STATE.update((pin, GPIO.LOW) for pin in PINS.values())
+    if BACKEND is None:
+        set_backend(GPIOBackend(PINS["STEP"], MPINS, PIN_STATE))
+
+def set_backend(backend):
+    """Select the backend used by STEP_signal and MotorRotator."""
+    global BACKEND
+    BACKEND = backend
+
+def output(pins, levels):
+    """GPIO.output which keeps PIN_STATE up to date."""
+    GPIO.output(pins, levels)
+    PIN_STATE.update(zip(*pins_levels(pins, levels)))
+
+def verify_pins():
+    """Check PIN_STATE against the hardware."""
+    mismatched = {name: (PIN_STATE[pin], GPIO.input(pin)) for name, pin in PINS.items() if GPIO.input(pin) != PIN_STATE[pin]}
+    if mismatched:
+        raise Exception(f"Pin states differ from shadow register (shadow, hardware): {mismatched}")
+
+def get_direction():
+    if VERIFY_PINS:
+        verify_pins()
+    return PIN_STATE[PINS["DIR"]]
+
+def is_enabled():
+    if VERIFY_PINS:
+        verify_pins()
+    return PIN_STATE[PINS["EN"]] == GPIO.LOW  # negated on the driver
 
 def reset():
-    GPIO.output(list(PINS.values()), GPIO.LOW)
+    output(list(PINS.values()), GPIO.LOW)
     # These 2 are reversed in the motor driver:
     # GPIO.output(PINS["SLP"], GPIO.HIGH)
     # GPIO.output(PINS["RST"], GPIO.HIGH)
@@ -230,52 +295,88 @@ def generate_sine_wave(frequency=1, duration=1):
         yield GPIO.LOW
         sleep(wait_time)
 
-def STEP_signal(wait_times: list[float]):
-    """Trigger steps based on the provided wait times."""
-    for wt in wait_times:
-        GPIO.output(PINS["STEP"], GPIO.HIGH)
-        sleep(wt)
-        GPIO.output(PINS["STEP"], GPIO.LOW)
-        sleep(wt)
+def STEP_signal(wait_times: Iterable[int | tuple]):
+    """Trigger steps based on the provided wait times (nanoseconds) or M1-M3 settings."""
+    BACKEND.run(lookahead(wait_times))
 
 class MotorRotator:
+    """
+    Rotation with constant step frequency, at most MAX_STEP_FREQUENCY. Frequency changes are ramps
+    of MAX_STEP_ACCELERATION and stopping ramps down to MIN_FREQUENCY first.
+    With PigpioWaveBackend the steps are repeated by DMA and the thread only supervises the ramps,
+    otherwise the thread produces the steps itself.
+    """
     def __init__(self, frequency=100):
-        self.frequency = frequency
+        self.backend = BACKEND
+        self.hardware = isinstance(self.backend, PigpioWaveBackend)
+        self.frequency = min(frequency, MIN_FREQUENCY)  # frequency at the end of the planned ramp
+        self.target = min(frequency, MAX_STEP_FREQUENCY)
         self.active = True
-        self.wait_time = 1 / (2 * self.frequency)
-        def rotate(self):
-            print("Rotating...")
-            while self.active:
-                GPIO.output(PINS["STEP"], GPIO.HIGH)
-                sleep(self.wait_time)
-                GPIO.output(PINS["STEP"], GPIO.LOW)
-                sleep(self.wait_time)
-        self.rotate_job = Thread(target=rotate, args=(self,))
+        self.retarget = Event()
+        self.retarget.set()
+        self.rotate_job = Thread(target=self.supervise if self.hardware else self.rotate)
         self.rotate_job.start()
 
     def set_frequency(self, frequency):
         if frequency <= 0:
             self.stop()
             return
-        self.frequency = frequency
-        self.wait_time = 1 / (2 * self.frequency)
-        print(f"Frequency set to {self.frequency} Hz")
+        # a ramp to MAX_STEP_FREQUENCY fits in one pigpio wave, faster ones wouldn't
+        self.target = min(frequency, MAX_STEP_FREQUENCY)
+        self.retarget.set()
+        print(f"Frequency set to {self.target} Hz")
+
+    def next_ramp(self):
+        """Wait times (ns) from the current to the target frequency."""
+        target = self.target if self.active else min(self.frequency, MIN_FREQUENCY)
+        ramp = list(frequency_ramp(self.frequency, target))
+        self.frequency = target
+        return ramp
+
+    def rotate(self):
+        print("Rotating...")
+        self.backend.run(self.wait_times())
+
+    def wait_times(self):
+        while True:
+            if self.retarget.is_set():
+                self.retarget.clear()
+                yield from self.next_ramp()
+            if not self.active:
+                return
+            yield 1_000_000_000 // (2 * self.frequency)
+
+    def supervise(self):
+        print("Rotating (hardware timed)...")
+        while True:
+            self.retarget.wait()
+            self.retarget.clear()
+            ramp = self.next_ramp()
+            if not self.active:
+                self.backend.repeat(ramp, None)
+                return
+            self.backend.repeat(ramp, 1_000_000_000 // (2 * self.frequency))
 
     def stop(self):
         print("Stopping motor...")
         self.active = False
+        self.retarget.set()
         self.rotate_job.join()
+        if not self.hardware:
+            LOG.debug(f"Rotation timing: {self.backend.stats}")
 
 def get_step_resolution():
-    """Get the current step resolution."""
-    for resolution, settings in MPINS_SETTINGS.items():
-        if all(x == y for x, y in zip((GPIO.input(pin) for pin in MPINS), settings)):
-            LOG.debug(f"Step resolution: {resolution}")
-            return resolution
-    raise Exception("Current step resolution not found in MPINS_SETTINGS.")
+    """Get the current step resolution (from PIN_STATE)."""
+    if VERIFY_PINS:
+        verify_pins()
+    resolution = RESOLUTIONS.get((PIN_STATE[PINS["M1"]], PIN_STATE[PINS["M2"]], PIN_STATE[PINS["M3"]]))
+    if resolution is None:
+        raise Exception("Current step resolution not found in MPINS_SETTINGS.")
+    return resolution
 
 
 def accelerated_impulse_durations_with_cond(acceleration, t0=1/100, condition = lambda durations: sum(durations) < 1):
+    """Reference (list based) version of `accelerated_impulse_schedule` for arbitrary stop conditions."""
     acceleration_constant = acceleration / ROTATION_PER_STEP / get_step_resolution()
     impulse_durations = [t0]
     while condition(impulse_durations):
@@ -286,7 +387,256 @@ def accelerated_impulse_durations_with_cond(acceleration, t0=1/100, condition =
 
 def accelerated_impulse_durations(acceleration, duration=1, t0=1/100):
     """Generate an accelerated sine wave for the given frequency and duration."""
-    return accelerated_impulse_durations_with_cond(acceleration, t0, lambda durations: sum(durations) < duration)
+    return accelerated_impulse_schedule(acceleration, t0, duration=duration)
+
+def _ramp_constants(acceleration, t0, resolution):
+    acceleration_constant = acceleration / ROTATION_PER_STEP / (resolution or get_step_resolution())
+    return acceleration_constant, 1 / t0
+
+def _ramp_steps(acceleration_constant, start_frequency, duration, final_impulse):
+    """Estimated number of impulses of the ramp."""
+    if duration is not None:
+        if acceleration_constant < 0:
+            # flywheel stops after f0/|k| seconds
+            duration = min(duration, start_frequency / -acceleration_constant)
+        # steps made in `duration`: f0*T + k*T^2/2
+        steps = start_frequency * duration + acceleration_constant * duration * duration / 2
+    elif acceleration_constant != 0:
+        # f_n = 1/final_impulse for n = (1/final_impulse^2 - f0^2) / 2k
+        steps = ((1 / final_impulse)**2 - start_frequency**2) / (2 * acceleration_constant) + 2
+        if acceleration_constant < 0:
+            steps = min(steps, start_frequency**2 / -(2 * acceleration_constant))
+    else:
+        steps = 1
+    return max(1, math.ceil(steps))
+
+def _ramp_impulses(acceleration_constant, start_frequency, first, last):
+    """Impulse durations (s) of steps `first`..`last`-1: after n steps the frequency is sqrt(f0^2 + 2*k*n)."""
+    squared_frequencies = start_frequency**2 + 2 * acceleration_constant * np.arange(first, last + 1, dtype=np.float64)
+    np.maximum(squared_frequencies, 0, out=squared_frequencies)
+    frequencies = np.sqrt(squared_frequencies)
+    return 2 / (frequencies[:-1] + frequencies[1:])
+
+def _ramp_frequencies(acceleration_constant, start_frequency, chunk):
+    """
+    Step frequencies of the ramp of `accelerated_impulse_durations_with_cond` (f_n+1 = f_n + k/f_n),
+    in arrays of at most `chunk` steps, until the flywheel stops.
+    While one step changes the frequency a lot (k/f^2 above RAMP_EXACT: the start of an acceleration,
+    the end of a deceleration) the recurrence is followed step by step. Elsewhere its solution
+    f_n^2 = u + k/2*ln(u/f_0^2) + (k^2/f_0^2 - k^2/u)/2, u = f_0^2 + 2*k*n is computed in batches from the last step.
+    """
+    k = acceleration_constant
+    frequency = start_frequency
+    size = 16  # batches grow up to `chunk`, short ramps don't plan steps they won't use
+    while True:
+        size = min(2 * size, chunk)
+        if abs(k) > RAMP_EXACT * frequency * frequency:
+            frequencies = []
+            while len(frequencies) < size and abs(k) > RAMP_EXACT * frequency * frequency:
+                frequencies.append(frequency)
+                frequency += k / frequency
+                if frequency <= 0:
+                    yield np.array(frequencies)
+                    return
+            yield np.array(frequencies)
+            continue
+        steps = size
+        if k < 0:
+            # up to the end of the deceleration, which is planned step by step
+            steps = max(1, min(size, int((frequency * frequency + k / RAMP_EXACT) / (2 * -k))))
+        squared_frequency = frequency * frequency
+        u = squared_frequency + 2 * k * np.arange(steps + 1, dtype=np.float64)
+        frequencies = np.sqrt(u + k / 2 * np.log(u / squared_frequency) + (k * k / squared_frequency - k * k / u) / 2)
+        frequency = float(frequencies[-1])
+        yield frequencies[:-1]
+
+def _final_impulse_index(impulse_durations, acceleration_constant, final_impulse):
+    """Index of the first impulse which reaches `final_impulse` or None."""
+    reached = impulse_durations <= final_impulse if acceleration_constant > 0 else impulse_durations >= final_impulse
+    return int(reached.argmax()) if reached.any() else None
+
+def _short_ramp(acceleration_constant, start_frequency, duration, final_impulse):
+    """The list version with a running sum, faster than NumPy batches for a few steps."""
+    if duration is not None:
+        planned = lambda impulse, elapsed: elapsed >= duration
+    elif acceleration_constant > 0:
+        planned = lambda impulse, elapsed: impulse <= final_impulse
+    else:
+        planned = lambda impulse, elapsed: impulse >= final_impulse
+    impulse = elapsed = 1 / start_frequency
+    impulse_durations = [impulse]
+    while not planned(impulse, elapsed):
+        impulse = impulse / (1 + acceleration_constant * impulse * impulse)
+        if impulse <= 0:  # the flywheel stops
+            break
+        impulse_durations.append(impulse)
+        elapsed += impulse
+    return np.array(impulse_durations)
+
+def _ramp(acceleration_constant, start_frequency, duration, final_impulse, chunk):
+    """
+    Impulse durations (s) of the ramp in arrays of at most `chunk` (short ramps at once). Like the list version
+    it ends with the impulse which makes the sum reach `duration` or with the first impulse which reaches `final_impulse`.
+    """
+    if _ramp_steps(acceleration_constant, start_frequency, duration, final_impulse) < SMALL_RAMP:
+        yield _short_ramp(acceleration_constant, start_frequency, duration, final_impulse)
+        return
+    elapsed = 0.0
+    for frequencies in _ramp_frequencies(acceleration_constant, start_frequency, chunk):
+        impulse_durations = 1 / frequencies
+        if duration is not None:
+            elapsed_after = elapsed + np.cumsum(impulse_durations)
+            last = int(np.searchsorted(elapsed_after, duration))
+            if last < len(impulse_durations):
+                yield impulse_durations[:last + 1]
+                return
+            elapsed = float(elapsed_after[-1])
+        else:
+            last = _final_impulse_index(impulse_durations, acceleration_constant, final_impulse)
+            if last is not None:
+                yield impulse_durations[:last + 1]
+                return
+        yield impulse_durations
+
+def accelerated_impulse_schedule(acceleration, t0=1/100, duration=None, final_impulse=None, resolution=None):
+    """
+    Impulse durations (seconds, float64 array) of a constant acceleration ramp, planned in NumPy batches.
+
+    The same ramp as `accelerated_impulse_durations_with_cond`: it starts with `t0` and ends with the impulse
+    which makes the sum reach `duration` or with the first impulse which reaches `final_impulse`
+    (the impulses differ by ~1e-8 relative, see `_ramp_frequencies`), only a deceleration ends once the flywheel
+    stops instead of continuing with negative impulses.
+    """
+    acceleration_constant, start_frequency = _ramp_constants(acceleration, t0, resolution)
+    parts = list(_ramp(acceleration_constant, start_frequency, duration, final_impulse, RAMP_CHUNK))
+    impulse_durations = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    LOG.debug(f"Last impuls time: {impulse_durations[-1]:.6f} s or {1/impulse_durations[-1]:.2f} Hz")
+    return impulse_durations
+
+def last_impulse_duration(acceleration, t0=1/100, duration=1, resolution=None):
+    """Duration (s) of the last impulse of `accelerated_impulse_schedule` without keeping the whole ramp."""
+    acceleration_constant, start_frequency = _ramp_constants(acceleration, t0, resolution)
+    for impulse_durations in _ramp(acceleration_constant, start_frequency, duration, None, RAMP_CHUNK):
+        pass
+    return float(impulse_durations[-1])
+
+def to_nanoseconds(durations):
+    """Convert durations in seconds to an int64 array of nanoseconds."""
+    return np.rint(np.asarray(durations, dtype=np.float64) * 1_000_000_000).astype(np.int64)
+
+# Streaming pipeline: planners yield impulse durations (ns) lazily, stages are generators
+# and STEP_signal consumes them with bounded lookahead, so memory does not grow with the maneuver.
+# Tuples in a stream are M1-M3 settings to apply before the following pulses.
+
+def impulse_stream(acceleration, t0=1/100, duration=None, final_impulse=None, resolution=None):
+    """Lazy version of `accelerated_impulse_schedule`, yields impulse durations (ns) planned STREAM_CHUNK at a time."""
+    acceleration_constant, start_frequency = _ramp_constants(acceleration, t0, resolution)
+    for impulse_durations in _ramp(acceleration_constant, start_frequency, duration, final_impulse, STREAM_CHUNK):
+        yield from to_nanoseconds(impulse_durations).tolist()
+
+def frequency_ramp(start_frequency, frequency, acceleration=MAX_STEP_ACCELERATION):
+    """Wait times (ns) changing the step frequency from `start_frequency` to `frequency` at `acceleration` (Hz/s)."""
+    acceleration_constant = math.copysign(acceleration, frequency - start_frequency)
+    steps = int(abs(frequency**2 - start_frequency**2) / (2 * acceleration))
+    for first in range(0, steps, STREAM_CHUNK):
+        impulse_durations = _ramp_impulses(acceleration_constant, start_frequency, first, min(first + STREAM_CHUNK, steps))
+        yield from (to_nanoseconds(impulse_durations) // 2).tolist()
+
+def halved(stream):
+    """Impulse durations to wait times (half of the impulse each)."""
+    for impulse in stream:
+        yield impulse // 2
+
+def clamped(stream, shortest=0, longest=MAX_WAIT_TIME_NS):
+    """Limit every wait time to [shortest, longest] ns."""
+    for wait_time in stream:
+        yield min(max(wait_time, shortest), longest)
+
+def with_resolution(stream, resolution):
+    """Switch M1-M3 pins to `resolution` before pulses of `stream`."""
+    yield MPINS_SETTINGS[resolution]
+    yield from stream
+
+def lookahead(stream, size=STREAM_LOOKAHEAD):
+    """Keep `size` items of `stream` planned ahead of the consumer."""
+    planned = deque(islice(stream, size))
+    for item in stream:
+        planned.append(item)
+        yield planned.popleft()
+    yield from planned
+
+class ScheduleCache:
+    """
+    LRU cache of finished step schedules stored as array('I') of half impulse durations (ns).
+    Keys are quantized motion parameters, tables are evicted once they take more than `max_bytes`.
+    """
+    def __init__(self, max_bytes=SCHEDULE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.tables = OrderedDict()
+
+    @staticmethod
+    def key(acceleration, t0, duration, resolution):
+        # mrad/s^2, ns, us
+        return round(acceleration * 1000), round(t0 * 1_000_000_000), round(duration * 1_000_000), resolution
+
+    def get(self, key):
+        table = self.tables.get(key)
+        if table is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tables.move_to_end(key)
+        return table
+
+    def put(self, key, table: array):
+        if key in self.tables:
+            self.size -= len(self.tables.pop(key)) * table.itemsize
+        table_size = len(table) * table.itemsize
+        if table_size > self.max_bytes:
+            return
+        self.tables[key] = table
+        self.size += table_size
+        while self.size > self.max_bytes:
+            _, evicted = self.tables.popitem(last=False)
+            self.size -= len(evicted) * evicted.itemsize
+
+    def recorded(self, key, stream):
+        """Pass `stream` through and store it under `key` once finished, unless it outgrows the cache."""
+        table = array("I")
+        for wait_time in stream:
+            if table is not None:
+                table.append(wait_time)
+                if len(table) * table.itemsize > self.max_bytes:
+                    table = None
+            yield wait_time
+        if table is not None:
+            self.put(key, table)
+
+    def clear(self):
+        self.tables.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "tables": len(self.tables), "bytes": self.size}
+
+SCHEDULE_CACHE = ScheduleCache()
+
+def planned_wait_times(acceleration, duration=1, t0=1/100, resolution=None):
+    """
+    Half impulse durations (ns) of an accelerated ramp: the cached table or a stream
+    which is planned lazily and cached once it is fully consumed.
+    Wait times are clamped to MAX_WAIT_TIME_NS, a decelerating ramp doesn't step slower than MIN_FREQUENCY.
+    """
+    resolution = resolution or get_step_resolution()
+    key = ScheduleCache.key(acceleration, t0, duration, resolution)
+    wait_times = SCHEDULE_CACHE.get(key)
+    if wait_times is None:
+        acceleration, t0, duration = key[0] / 1000, key[1] / 1_000_000_000, key[2] / 1_000_000
+        wait_times = SCHEDULE_CACHE.recorded(key, clamped(halved(impulse_stream(acceleration, t0, duration, resolution=resolution))))
+    return wait_times
 
 def pigpio_init():
     global PI, SCRIPT_ID
@@ -296,6 +646,10 @@ def pigpio_init():
 
     return PI
 
+def pigpio_wave_backend():
+    """Backend generating step schedules with pigpio DMA waves (needs pigpio_init)."""
+    return PigpioWaveBackend(PI, PINS["STEP"], MPINS, PIN_STATE)
+
 def pigpio_cleanup():
     global PI, SCRIPT_ID
     if PI is not None:
@@ -306,96 +660,197 @@ def pigpio_cleanup():
         PI.stop()
         PI = None
 
-def pigpio_accelerated_signal(acceleration: float, start_frequency: int, duration: float):
-    acceleration_constant = acceleration / ROTATION_PER_STEP / get_step_resolution()
+def pigpio_script_params(acceleration: float, start_frequency: int, duration: float, resolution=None):
+    """Fixed point parameters of PIGPIO_SCRIPT."""
+    acceleration_constant = acceleration / ROTATION_PER_STEP / (resolution or get_step_resolution())
 
     a = start_frequency # x.0
     b = round(acceleration_constant * 4096)  # x.12
     duration = round(duration * 1048576)  # x.20
     t0 = round(1/start_frequency * 1048576)  # x.20
+    return [a, b, duration, t0, PINS["STEP"]]
 
-    PI.run_script(SCRIPT_ID, [a, b, duration, t0, PINS["STEP"]])
+def pigpio_accelerated_signal(acceleration: float, start_frequency: int, duration: float):
+    PI.run_script(SCRIPT_ID, pigpio_script_params(acceleration, start_frequency, duration))
     # run_script is non-blocking operation.
 
+def motion_program_script(segments, resolution=None):
+    """Script and its parameters running (acceleration, start_frequency, duration) segments back to back."""
+    calls = []
+    for acceleration, start_frequency, duration in segments:
+        a, b, duration, t0, pin = pigpio_script_params(acceleration, start_frequency, duration, resolution)
+        calls.append(f"LD v40 {a} LD v41 {b} LD v42 {duration} LD v43 {t0} CALL 500")
+    return motion_script(" ".join(calls)), [0, 0, 0, 0, PINS["STEP"]]
+
+class MotionProgram:
+    """Handle of a script started by run_motion_program. The script is deleted once it ends."""
+    def __init__(self, script_id, duration):
+        self.script_id = script_id
+        self.duration = duration  # planned (s)
+        self.start = perf_counter()
+        self.end = None
+        self.result = None
+
+    def status(self):
+        """pigpio.PI_SCRIPT_* status of the script."""
+        if self.result is None:
+            status, _ = PI.script_status(self.script_id)
+            if status not in (pigpio.PI_SCRIPT_HALTED, pigpio.PI_SCRIPT_FAILED):
+                return status
+            self.end = perf_counter()
+            self.result = status
+            PI.delete_script(self.script_id)
+        return self.result
+
+    def done(self):
+        return self.status() in (pigpio.PI_SCRIPT_HALTED, pigpio.PI_SCRIPT_FAILED)
+
+    def elapsed(self):
+        """Seconds since the start, until the end was noticed by status."""
+        self.status()
+        return (self.end or perf_counter()) - self.start
+
+    def wait(self, poll=0.001):
+        while not self.done():
+            sleep(poll)
+        if self.result == pigpio.PI_SCRIPT_FAILED:
+            raise Exception("Motion program failed")
+        return self.elapsed()
+
+    def stop(self):
+        if self.result is None:
+            PI.stop_script(self.script_id)
+            self.status()
+
+def run_motion_program(segments):
+    """
+    Run (acceleration, start_frequency, duration) segments of pigpio_accelerated_signal
+    back to back in one script run, without round trips to the daemon between them.
+    Returns a MotionProgram handle.
+    """
+    script, params = motion_program_script(segments)
+    script_id = PI.store_script(script)
+    if script_id < 0:
+        raise Exception(f"Failed to store motion program ({script_id})")
+    while PI.script_status(script_id)[0] == pigpio.PI_SCRIPT_INITING:
+        sleep(0.001)
+    PI.run_script(script_id, params)
+    return MotionProgram(script_id, sum(duration for _, _, duration in segments))
+
 def rotate_platform(radians, duration=1, start_frequency=100):
     acceleration = 2 * INERTIA_PLATFORM2WHEEL_RATIO * radians / duration / duration
-    wait_times = [impulse/2 for impulse in accelerated_impulse_durations(acceleration, duration, 1/start_frequency)]
-    STEP_signal(wait_times)
-    return 1/wait_times[-1]/2  # Return the final frequency
+    STEP_signal(planned_wait_times(acceleration, duration, 1/start_frequency))
+    return 1/last_impulse_duration(acceleration, 1/start_frequency, duration)  # Return the final frequency
 
 def accelerate(start_frequency=100, final_frequency=200, duration=1):
     """Accelerate the motor to a given frequency over a specified duration."""
     acceleration = ROTATION_PER_STEP * (final_frequency - start_frequency) / duration / duration
-    wait_times = [impulse/2 for impulse in accelerated_impulse_durations(acceleration, duration, 1/start_frequency)]
-    STEP_signal(wait_times)
-    return 1/wait_times[-1]/2  # Return the final frequency
+    STEP_signal(planned_wait_times(acceleration, duration, 1/start_frequency))
+    return 1/last_impulse_duration(acceleration, 1/start_frequency, duration)  # Return the final frequency
 
 def rotate_platform_deceleration(radians, duration=1, start_frequency=50):
     acceleration = 2 * INERTIA_PLATFORM2WHEEL_RATIO * radians / duration / duration
-    wait_times = [impulse/2 for impulse in accelerated_impulse_durations(-acceleration, duration, 1/start_frequency)]
-    STEP_signal(wait_times)
-    return 1/wait_times[-1]/2  # Return the final frequency
+    STEP_signal(planned_wait_times(-acceleration, duration, 1/start_frequency))
+    return 1/last_impulse_duration(-acceleration, 1/start_frequency, duration)  # Return the final frequency
 
 def rotate_platform2(radians, duration=1, start_frequency=50):
     """Rotate the platform by a specified angle in radians."""
     dur= duration/2
     acceleration = INERTIA_PLATFORM2WHEEL_RATIO*radians/dur/dur
-    wait_times = [impulse/2 for impulse in accelerated_impulse_durations(acceleration, dur, 1/start_frequency)]
-    negated_wait_times = [impulse/2 for impulse in accelerated_impulse_durations(-acceleration, dur, wait_times[-1]*2)]
+    wait_times = planned_wait_times(acceleration, dur, 1/start_frequency)
+    negated_wait_times = planned_wait_times(-acceleration, dur, last_impulse_duration(acceleration, 1/start_frequency, dur))
+
+    STEP_signal(chain(wait_times, negated_wait_times))  # Accelerate, then decelerate
+
+def step_angle(resolution):
+    return ROTATION_PER_STEP * resolution
 
-    STEP_signal(wait_times)           # Accelerate
-    STEP_signal(negated_wait_times)   # Decelerate
+def reachable_top_speed(angle, duration, start_speed=0.0, max_step_frequency=MAX_STEP_FREQUENCY):
+    """
+    Top angular speed (rad/s) of the flywheel rotated by `angle` (rad) in `duration` (s), accelerating
+    from and decelerating to `start_speed`, when M1-M3 may switch up to full steps.
+    """
+    # symmetric profile: angle = (w0 + v)*T/2
+    top_speed = max(start_speed, 2 * angle / duration - start_speed)
+    max_speed = max_step_frequency * step_angle(1)
+    if top_speed > max_speed:
+        if max_speed * duration <= angle:
+            raise Exception(f"Rotation by {angle:.2f} rad is not reachable in {duration} s (top speed {max_speed:.2f} rad/s)")
+        return max_speed  # reached earlier and kept
+    return top_speed
+
+class MicrostepPlan:
+    """
+    Trajectory rotating the flywheel by `angle` (rad) in `duration` (s): accelerate, cruise if the top speed
+    is limited by `max_step_frequency`, then decelerate back to `start_frequency`.
+    M1-M3 resolution changes to a coarser one whenever the step frequency crosses `switch_frequency`, only at positions
+    aligned to the coarser step, so the angular velocity stays continuous. The deceleration mirrors it: the resolution
+    changes back at the same distance from the end.
+    """
+    def __init__(self, angle, duration, start_frequency=MIN_FREQUENCY, switch_frequency=MICROSTEP_SWITCH_FREQUENCY,
+                 max_step_frequency=MAX_STEP_FREQUENCY):
+        self.resolutions = sorted(MPINS_SETTINGS)  # 1/16 ... 1
+        self.angle = abs(angle)
+        self.duration = duration
+        self.switch_frequency = switch_frequency
+        self.start_speed = start_frequency * step_angle(self.resolutions[0])
+        self.top_speed = reachable_top_speed(self.angle, duration, self.start_speed, max_step_frequency)
+        # angle = v*T - (v - w0)^2/a, without cruising a = (v - w0)/(T/2)
+        cruise_angle = self.top_speed * duration - self.angle
+        self.acceleration = (self.top_speed - self.start_speed)**2 / cruise_angle if cruise_angle > 0 else 0.0
+        self.acceleration_angle = (self.top_speed**2 - self.start_speed**2) / (2 * self.acceleration) if self.acceleration else 0.0
+
+    def speed(self, angle):
+        """Angular speed (rad/s) when the flywheel is rotated by `angle`."""
+        if angle < self.acceleration_angle:
+            return math.sqrt(self.start_speed**2 + 2 * self.acceleration * angle)
+        if angle > self.angle - self.acceleration_angle:
+            return math.sqrt(self.start_speed**2 + 2 * self.acceleration * max(self.angle - angle, 0.0))
+        return self.top_speed
+
+    def events(self):
+        """Merged timeline for STEP_signal: M1-M3 settings and wait times (ns)."""
+        finest = step_angle(self.resolutions[0])
+        total = round(self.angle / finest)  # in finest steps
+        position = 0
+        level = 0
+        switches = [0]  # positions where the levels were switched to going up
+        yield MPINS_SETTINGS[self.resolutions[level]]
+        while position < total:
+            size = round(self.resolutions[level] / self.resolutions[0])
+            frequency = self.speed(position * finest) / step_angle(self.resolutions[level])
+            if level + 1 < len(self.resolutions) and frequency >= self.switch_frequency:
+                coarser = size * round(self.resolutions[level + 1] / self.resolutions[level])
+                # the mirrored switch back has to lie ahead
+                if position % coarser == 0 and 2 * position + coarser <= total:
+                    level += 1
+                    switches.append(position)
+                    yield MPINS_SETTINGS[self.resolutions[level]]
+                    continue
+            if level > 0 and total - position - size < switches[level]:
+                level -= 1
+                switches.pop()
+                yield MPINS_SETTINGS[self.resolutions[level]]
+                continue
+            start_speed = self.speed(position * finest)
+            end_speed = self.speed((position + size) * finest)
+            impulse = 2 * size * finest / (start_speed + end_speed)
+            yield round(impulse * 500_000_000)
+            position += size
 
 def rotate_platform3(radians, duration=1):
     """
     Rotate the platform by a specified angle (radians) with acceleration and deceleration.
-    Uses M1-M3 pins to halve the step count for smoother transitions at the start and end.
+    Uses M1-M3 pins to switch to coarser steps at higher speeds, so higher top speed is reachable.
+    Returns the top speed (rad/s) of the flywheel.
     """
-    # Preparations
-
-    dur = duration / 2
-    acceleration = INERTIA_PLATFORM2WHEEL_RATIO * radians / dur / dur
-
-    # formula is: t= (wk - wp)/acc, for current L (ROTATION_PER_STEP):
-    # part_duration = math.pi / acceleration
-
-    part_wait_times = []
-    first_impulse_time = MAX_IMPULSE_DURATION
-    for _ in range(len(MPINS_SETTINGS)-1):
-        part_wait_times += [[impulse/2 for impulse in accelerated_impulse_durations_with_cond(acceleration, first_impulse_time, lambda durations: durations[-1] > 1/200)]]
-        first_impulse_time = part_wait_times[-1][-1]*2*2  # Next part
-    
-    dur -= sum(sum(pwts) for pwts in part_wait_times)*2  # Subtract the time used by M1-M3 halving
-    wait_times = [impulse/2 for impulse in accelerated_impulse_durations(acceleration, dur, first_impulse_time)]
-    negated_wait_times = [impulse/2 for impulse in accelerated_impulse_durations_with_cond(-acceleration, wait_times[-1]*2, lambda durations: durations[-1] < 1/100)]
-
-    negated_part_wait_times = []
-    first_impulse_time = negated_wait_times[-1]
-    for _ in range(len(MPINS_SETTINGS)-1):
-        negated_part_wait_times += [[impulse/2 for impulse in accelerated_impulse_durations_with_cond(-acceleration, first_impulse_time, lambda durations: durations[-1] < 1/100)]]
-        first_impulse_time = negated_part_wait_times[-1][-1]  # Next part
-
-    part_wait_times_zip = zip(MPINS_SETTINGS[:-1], part_wait_times)
-    negated_part_wait_times_zip = zip(reversed(MPINS_SETTINGS[:-1]), negated_part_wait_times)
-
-    # Halve steps at start using M1-M3
-    for settings, pwts in part_wait_times_zip:
-        GPIO.output(MPINS, settings)
-        STEP_signal(pwts)
-
-    # Full steps in middle
-    GPIO.output(MPINS, GPIO.LOW)
-    STEP_signal(wait_times)
-    STEP_signal(negated_wait_times)
-
-    # Halve steps at end using M1-M3
-    for settings, pwts in negated_part_wait_times_zip:
-        GPIO.output(MPINS, settings)
-        STEP_signal(pwts)
-
-    # Reset M1-M3 pins
-    GPIO.output(MPINS, GPIO.LOW)
+    plan = MicrostepPlan(INERTIA_PLATFORM2WHEEL_RATIO * radians, duration)
+    LOG.debug(f"Top speed: {plan.top_speed:.2f} rad/s, acceleration: {plan.acceleration:.2f} rad/s^2")
+
+    # Reset M1-M3 pins at the end
+    STEP_signal(chain(plan.events(), with_resolution((), 1)))
+    return plan.top_speed
 
 if __name__ == "__main__":
     setup()
-    GPIO.output(PINS["EN"], GPIO.HIGH)  # DISABLE motor
+    output(PINS["EN"], GPIO.HIGH)  # DISABLE motor
@@ -0,0 +1,376 @@
+import RPi.GPIO as GPIO
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+WAVE_CHUNK = 1000  # pulses per wave
+LIVE_WAVES = 3  # waves of a run existing at once: transmitted, queued behind it and the one being built
+WAVE_POLL = 0.0002  # seconds between wave_tx_busy checks
+SPIN_NS = 50_000  # last part of every wait which is busy-waited instead of slept
+RESYNC_FRACTION = 0.1  # lateness above this fraction of the wait time shifts the schedule (a resync)
+WRITE_WEIGHT = 0.05  # weight of the newest measurement in the GPIO.output duration average
+REPEAT_WAVE_NS = 10_000_000  # length of the wave repeated by PigpioWaveBackend.repeat
+LATENESS_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Same fields as pigpio.pulse, so it can be sent to the daemon as is
+Pulse = namedtuple("Pulse", ["gpio_on", "gpio_off", "delay"])
+
+
+def pins_levels(pin, level):
+    """Arguments of GPIO.output as (pins, levels) tuples."""
+    pins = tuple(pin) if isinstance(pin, (list, tuple)) else (pin,)
+    levels = tuple(level) if isinstance(level, (list, tuple)) else (level,) * len(pins)
+    return pins, levels
+
+
+def wait_until(deadline):
+    """Sleep until SPIN_NS before `deadline` (perf_counter_ns), then busy-wait. Returns lateness in ns."""
+    remaining = deadline - time.perf_counter_ns()
+    if remaining > SPIN_NS:
+        time.sleep((remaining - SPIN_NS) / 1_000_000_000)
+    now = time.perf_counter_ns()
+    while now < deadline:
+        now = time.perf_counter_ns()
+    return now - deadline
+
+
+class PulseStats:
+    """Timing of one run: planned vs achieved duration and lateness of every edge."""
+    def __init__(self):
+        self.edges = 0
+        self.resyncs = 0
+        self.planned_ns = 0
+        self.achieved_ns = 0
+        self.max_lateness_ns = 0
+        # edges late by less than LATENESS_BUCKETS_US[i], the last bucket is for the rest
+        self.histogram = [0] * (len(LATENESS_BUCKETS_US) + 1)
+
+    def add(self, lateness_ns):
+        self.edges += 1
+        self.max_lateness_ns = max(self.max_lateness_ns, lateness_ns)
+        self.histogram[bisect_left(LATENESS_BUCKETS_US, lateness_ns / 1000)] += 1
+
+    def __str__(self):
+        buckets = [f"<{b}us" for b in LATENESS_BUCKETS_US] + [f">={LATENESS_BUCKETS_US[-1]}us"]
+        histogram = ", ".join(f"{b}: {n}" for b, n in zip(buckets, self.histogram) if n)
+        return (f"planned: {self.planned_ns/1e6:.3f} ms, achieved: {self.achieved_ns/1e6:.3f} ms, "
+                f"edges: {self.edges}, max lateness: {self.max_lateness_ns/1000:.1f} us, resyncs: {self.resyncs}, "
+                f"lateness: {histogram}")
+
+
+class PulseBackend:
+    """
+    Executes step schedules: STEP wait times in nanoseconds (one per half of the impulse)
+    mixed with tuples of M1-M3 settings which apply to the following pulses.
+    Timing of the last run is kept in `stats`, written pin levels in `pin_state`.
+    """
+    def __init__(self, step_pin, mpins, pin_state=None):
+        self.step_pin = step_pin
+        self.mpins = mpins
+        self.pin_state = pin_state if pin_state is not None else {}
+        self.stats = None
+
+    def write(self, pin, level):
+        raise NotImplementedError
+
+    def read(self, pin):
+        raise NotImplementedError
+
+    def run(self, wait_times):
+        raise NotImplementedError
+
+    def repeat(self, ramp, wait_time):
+        raise NotImplementedError
+
+    def stop(self):
+        """Stop the rotation started by repeat."""
+        pass
+
+
+class GPIOBackend(PulseBackend):
+    """
+    Toggles STEP from Python with RPi.GPIO. Every edge is scheduled against an absolute
+    perf_counter_ns deadline, so time spent in GPIO.output and wake-up latency do not add up.
+    """
+
+    def write(self, pin, level):
+        GPIO.output(pin, level)
+        self.pin_state.update(zip(*pins_levels(pin, level)))
+
+    def read(self, pin):
+        return GPIO.input(pin)
+
+    def run(self, wait_times):
+        self.stats = stats = PulseStats()
+        start = deadline = time.perf_counter_ns()
+        write_ns = 0.0
+        for wt in wait_times:
+            if isinstance(wt, tuple):
+                GPIO.output(self.mpins, wt)
+                self.pin_state.update(zip(self.mpins, wt))
+                continue
+            for level in (GPIO.HIGH, GPIO.LOW):
+                lateness = wait_until(deadline)
+                before = time.perf_counter_ns()
+                GPIO.output(self.step_pin, level)
+                written = time.perf_counter_ns()
+                stats.add(lateness)
+                # measured after the write, the thread may also be preempted just before it
+                late = written - deadline - int(write_ns)
+                if written - before < SPIN_NS:  # a preempted write is not its usual duration
+                    write_ns += WRITE_WEIGHT * (written - before - write_ns)
+                # A late edge keeps the absolute schedule, so lateness doesn't add up. After a stall
+                # longer than RESYNC_FRACTION of the wait the schedule is shifted: catching up
+                # would fire the next edges faster than planned, a burst of steps the motor cannot follow
+                if late > RESYNC_FRACTION * wt:
+                    deadline += late
+                    stats.resyncs += 1
+                deadline += wt
+                stats.planned_ns += wt
+        self.pin_state[self.step_pin] = GPIO.LOW
+        wait_until(deadline)
+        stats.achieved_ns = time.perf_counter_ns() - start
+
+
+class PigpioWaveBackend(PulseBackend):
+    """
+    Turns schedules into pigpio waves of at most `chunk` pulses, which are timed by DMA.
+    Every wave is queued behind the transmitted one (WAVE_MODE_ONE_SHOT_SYNC), so they follow without a gap,
+    and the next wave is built meanwhile. The chunk is limited so that LIVE_WAVES waves fit in the daemon.
+    Microsecond rounding is carried over between pulses, so it does not accumulate.
+    """
+    def __init__(self, pi, step_pin, mpins, pin_state=None, chunk=WAVE_CHUNK):
+        super().__init__(step_pin, mpins, pin_state)
+        self.pi = pi
+        self.chunk = min(chunk, pi.wave_get_max_pulses() // LIVE_WAVES)
+        self.repeated = []  # waves used by repeat
+        for pin in (step_pin, *mpins):
+            self.pi.set_mode(pin, 1)  # pigpio.OUTPUT
+        self.pi.wave_clear()
+
+    def write(self, pin, level):
+        for p, l in zip(*pins_levels(pin, level)):
+            self.pi.write(p, l)
+            self.pin_state[p] = l
+
+    def read(self, pin):
+        return self.pi.read(pin)
+
+    def run(self, wait_times):
+        self.stats = stats = PulseStats()
+        start = time.perf_counter_ns()
+        step_mask = 1 << self.step_pin
+        planned_ns = 0  # time of the next edge in the schedule
+        sent_us = 0  # time of the next edge in the waves
+        pulses = []
+        sent = []
+        for wt in wait_times:
+            if len(pulses) + 2 > self.chunk:
+                sent = self.send(self.create_wave(pulses), sent)
+                pulses = []
+            if isinstance(wt, tuple):
+                pulses.append(self.settings_pulse(wt))
+                self.pin_state.update(zip(self.mpins, wt))
+                continue
+            for on, off in ((step_mask, 0), (0, step_mask)):
+                planned_ns += wt
+                delay = planned_ns // 1000 - sent_us
+                sent_us += delay
+                pulses.append(Pulse(on, off, delay))
+        if pulses:
+            sent = self.send(self.create_wave(pulses), sent)
+        self.wait(sent)
+        self.pin_state[self.step_pin] = 0
+        # Edges are timed by DMA, only the whole run is measured
+        stats.planned_ns = planned_ns
+        stats.achieved_ns = time.perf_counter_ns() - start
+
+    def repeat(self, ramp, wait_time):
+        """
+        Hardware timed rotation: once the current wave ends, transmit `ramp` (wait times, ns) and then
+        repeat `wait_time` until the next call. With `wait_time` None the transmission ends with the ramp.
+        Returns as soon as the ramp is being transmitted (or after it when stopping).
+        """
+        # Only one wave can wait for the current one to end
+        while self.repeated and self.pi.wave_tx_busy() and self.pi.wave_tx_at() != self.repeated[-1]:
+            time.sleep(WAVE_POLL)
+        if ramp:
+            ramp_id = self.create_wave(self.step_pulses(ramp))
+            self.pi.wave_send_using_mode(ramp_id, 2)  # pigpio.WAVE_MODE_ONE_SHOT_SYNC
+            while self.pi.wave_tx_busy() and self.pi.wave_tx_at() != ramp_id:
+                time.sleep(WAVE_POLL)
+            self.delete_repeated()
+            self.repeated.append(ramp_id)
+        if wait_time is None:
+            while self.pi.wave_tx_busy():
+                time.sleep(WAVE_POLL)
+            self.stop()
+            return
+        # Several periods per wave, so microsecond rounding is carried over instead of repeated
+        periods = max(1, REPEAT_WAVE_NS // (2 * wait_time))
+        wave_id = self.create_wave(self.step_pulses([wait_time] * periods))
+        self.pi.wave_send_using_mode(wave_id, 3)  # pigpio.WAVE_MODE_REPEAT_SYNC
+        if not ramp:
+            while self.pi.wave_tx_busy() and self.pi.wave_tx_at() != wave_id:
+                time.sleep(WAVE_POLL)
+            self.delete_repeated()
+        self.repeated.append(wave_id)
+
+    def stop(self):
+        """Stop the waves sent by repeat."""
+        self.pi.wave_tx_stop()
+        self.delete_repeated()
+        self.pin_state[self.step_pin] = 0
+
+    def delete_repeated(self):
+        for wave_id in self.repeated:
+            self.pi.wave_delete(wave_id)
+        self.repeated = []
+
+    def step_pulses(self, wait_times):
+        """STEP pulses of `wait_times` (ns) with microsecond rounding carried over."""
+        step_mask = 1 << self.step_pin
+        planned_ns = 0
+        sent_us = 0
+        pulses = []
+        for wt in wait_times:
+            for on, off in ((step_mask, 0), (0, step_mask)):
+                planned_ns += wt
+                delay = planned_ns // 1000 - sent_us
+                sent_us += delay
+                pulses.append(Pulse(on, off, delay))
+        return pulses
+
+    def settings_pulse(self, settings):
+        on = sum(1 << pin for pin, level in zip(self.mpins, settings) if level)
+        off = sum(1 << pin for pin, level in zip(self.mpins, settings) if not level)
+        return Pulse(on, off, 0)
+
+    def create_wave(self, pulses):
+        self.pi.wave_add_generic(pulses)
+        wave_id = self.pi.wave_create()
+        if wave_id < 0:
+            raise Exception(f"Failed to create wave ({wave_id})")
+        return wave_id
+
+    def send(self, wave_id, sent):
+        """
+        Queue `wave_id` behind the transmitted wave. Only one wave can wait for the current one to end,
+        so first the last of `sent` has to start, the waves before it are done and deleted.
+        Returns the waves still in use.
+        """
+        while sent and self.pi.wave_tx_busy() and self.pi.wave_tx_at() != sent[-1]:
+            time.sleep(WAVE_POLL)
+        for done in sent[:-1]:
+            self.pi.wave_delete(done)
+        self.pi.wave_send_using_mode(wave_id, 2)  # pigpio.WAVE_MODE_ONE_SHOT_SYNC
+        return sent[-1:] + [wave_id]
+
+    def wait(self, transmitted):
+        while self.pi.wave_tx_busy():
+            time.sleep(WAVE_POLL)
+        for wave_id in transmitted:
+            self.pi.wave_delete(wave_id)
+
+
+class RecordingPi:
+    """
+    In-memory stand-in for the pigpio daemon (pigpio.pi) with the calls used by PigpioWaveBackend.
+    Waves are transmitted instantly in virtual time and every edge is recorded
+    in `edges` as (tick in us, gpio, level). Like the daemon it fails to create waves above `max_pulses`
+    pulses in total, the most of them existing at once is kept in `max_live_pulses`.
+    """
+    def __init__(self, max_pulses=12000):
+        self.max_pulses = max_pulses
+        self.max_live_pulses = 0
+        self.tick = 0
+        self.levels = {}
+        self.edges = []
+        self.waves = {}
+        self.pending = []
+        self.next_wave_id = 0
+        self.current = 9999  # pigpio.WAVE_NOT_FOUND
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def write(self, gpio, level):
+        if self.levels.get(gpio, 0) != level:
+            self.edges.append((self.tick, gpio, level))
+        self.levels[gpio] = level
+
+    def read(self, gpio):
+        return self.levels.get(gpio, 0)
+
+    def get_current_tick(self):
+        return self.tick
+
+    def wave_clear(self):
+        self.waves.clear()
+        self.pending = []
+
+    def wave_add_new(self):
+        self.pending = []
+
+    def wave_add_generic(self, pulses):
+        self.pending += pulses
+        return len(self.pending)
+
+    def wave_get_max_pulses(self):
+        return self.max_pulses
+
+    def wave_create(self):
+        live_pulses = sum(len(pulses) for pulses in self.waves.values()) + len(self.pending)
+        if live_pulses > self.max_pulses:
+            self.pending = []
+            return -36  # pigpio.PI_TOO_MANY_PULSES
+        self.max_live_pulses = max(self.max_live_pulses, live_pulses)
+        wave_id = self.next_wave_id
+        self.next_wave_id += 1
+        self.waves[wave_id] = self.pending
+        self.pending = []
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        del self.waves[wave_id]
+
+    def wave_send_using_mode(self, wave_id, mode):
+        # A repeated wave is played once and stays current until the next one
+        self.play(self.waves[wave_id])
+        self.current = wave_id if mode in (1, 3) else 9999  # pigpio.WAVE_NOT_FOUND
+        return len(self.waves[wave_id])
+
+    def wave_tx_at(self):
+        return self.current
+
+    def wave_tx_busy(self):
+        return 0
+
+    def wave_tx_stop(self):
+        self.current = 9999
+
+    def stop(self):
+        pass
+
+    def play(self, pulses):
+        for pulse in pulses:
+            for gpio in range(32):
+                if pulse.gpio_on >> gpio & 1:
+                    self.write(gpio, 1)
+                if pulse.gpio_off >> gpio & 1:
+                    self.write(gpio, 0)
+            self.tick += pulse.delay
+
+
+class RecordingBackend(PigpioWaveBackend):
+    """PigpioWaveBackend running against RecordingPi, for tests and benchmarks without a Pi."""
+    def __init__(self, step_pin, mpins, pin_state=None, chunk=WAVE_CHUNK):
+        super().__init__(RecordingPi(), step_pin, mpins, pin_state, chunk)
+
+    @property
+    def edges(self):
+        return self.pi.edges
+
+    def step_times(self):
+        """Times (us) of STEP rising edges."""
+        return [tick for tick, gpio, level in self.pi.edges if gpio == self.step_pin and level]
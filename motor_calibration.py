@@ -9,8 +9,8 @@ import threading
 import kosmiczna_magisterka.fast_motor as cmotor
 
 def rotate_platform(angle, dur=0.5):
-    GPIO.output(motor.MPINS, GPIO.HIGH)
-    GPIO.output(motor.PINS["M3"],GPIO.LOW)
+    motor.output(motor.MPINS, GPIO.HIGH)
+    motor.output(motor.PINS["M3"],GPIO.LOW)
     duration = dur
     acceleration = (angle / motor.ROTATION_PER_STEP / motor.get_step_resolution()) * motor.INERTIA_PLATFORM2WHEEL_RATIO / duration / duration
     #acceleration = 2*(angle / motor.ROTATION_PER_STEP / motor.get_step_resolution()) * motor.INERTIA_PLATFORM2WHEEL_RATIO / duration / duration
@@ -52,6 +52,7 @@ def calibrate_inertia_ratio():
     print(f"Final inertia ratio: {unit + tenths + hundredths}")
 
     motor.INERTIA_PLATFORM2WHEEL_RATIO = unit + tenths + hundredths
+    cmotor.set_params(inertia_ratio=motor.INERTIA_PLATFORM2WHEEL_RATIO)  # used by the C rotation server from its next maneuver
     time.sleep(3)
     rotate_platform(math.pi/4)
     time.sleep(1)
@@ -93,9 +94,9 @@ def calibrate_decay_time():
         wait_time = 1 / (2 * freq)
         start = time.perf_counter()
         while active:
-            GPIO.output(motor.PINS["STEP"], GPIO.HIGH)
+            motor.output(motor.PINS["STEP"], GPIO.HIGH)
             time.sleep(wait_time)
-            GPIO.output(motor.PINS["STEP"], GPIO.LOW)
+            motor.output(motor.PINS["STEP"], GPIO.LOW)
             time.sleep(wait_time)
 
     thread = threading.Thread(target=accelerate_then_stay)
@@ -136,4 +137,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt: ...
     finally:
         motor.reset()
-        GPIO.output(motor.PINS["EN"], GPIO.HIGH)
+        motor.output(motor.PINS["EN"], GPIO.HIGH)
@@ -17,8 +17,8 @@ if __name__ == "__main__":
     try:
         motor.setup()
         motor.reset()
-        GPIO.output(motor.MPINS, GPIO.HIGH)  # Set 1/16 step
-        GPIO.output(motor.PINS["M3"], GPIO.LOW)
+        motor.output(motor.MPINS, GPIO.HIGH)  # Set 1/16 step
+        motor.output(motor.PINS["M3"], GPIO.LOW)
         #motor.pigpio_init()
         next_cmd = None
         commands = []
@@ -33,10 +33,10 @@ if __name__ == "__main__":
                 next_cmd = None
             else:
                 if rotator is None:
-                    GPIO.output(motor.PINS["EN"], GPIO.HIGH)  # Disable motor driver
+                    motor.output(motor.PINS["EN"], GPIO.HIGH)  # Disable motor driver
                 cmd = input("Enter command: ").strip().split(" ")
                 if rotator is None:
-                    GPIO.output(motor.PINS["EN"], GPIO.LOW)  # Enable motor driver
+                    motor.output(motor.PINS["EN"], GPIO.LOW)  # Enable motor driver
             if "+" in cmd:
                 plus_idx = cmd.index("+")
                 next_cmd = cmd[plus_idx + 1:] if plus_idx + 1 < len(cmd) else None
@@ -59,7 +59,7 @@ if __name__ == "__main__":
                     continue
                 def rot(*args):
                     for state in motor.generate_sine_wave(args[1], args[0]):
-                        GPIO.output(motor.PINS["STEP"], state)
+                        motor.output(motor.PINS["STEP"], state)
                 if freq:
                     commands.append(functools.partial(rot, seconds, freq))
                 else:
@@ -248,7 +248,7 @@ if __name__ == "__main__":
                 state = int(cmd[1])
                 print(f"{cmd[0]} set to {'HIGH' if state else 'LOW'}")
 
-                commands.append(with_arg(functools.partial(GPIO.output, motor.PINS[cmd[0]], state)))
+                commands.append(with_arg(functools.partial(motor.output, motor.PINS[cmd[0]], state)))
             elif cmd[0] == "reset":
                 print("Resetting all pins...")
                 commands.append(motor.reset)
@@ -256,13 +256,37 @@ if __name__ == "__main__":
                 def show_pins(*args):
                     print("Current pin states:")
                     for name, pin in motor.PINS.items():
-                        print(f"{name}: {GPIO.input(pin)}")
+                        print(f"{name}: {motor.PIN_STATE[pin]} (hardware: {GPIO.input(pin)})")
                 commands.append(show_pins)
+            elif cmd[0] == "backend":
+                if rotator is not None:
+                    print("Motor is already rotating. Use 'freq 0' to stop it first.")
+                    continue
+                if len(cmd) < 2 or cmd[1] not in ("gpio", "wave"):
+                    print("Usage: backend gpio|wave")
+                    continue
+                def set_backend(*args):
+                    if args[0] == "wave":
+                        if motor.PI is None:
+                            motor.pigpio_init()
+                        motor.set_backend(motor.pigpio_wave_backend())
+                    else:
+                        motor.set_backend(motor.GPIOBackend(motor.PINS["STEP"], motor.MPINS, motor.PIN_STATE))
+                    print(f"Backend set to {type(motor.BACKEND).__name__}")
+                commands.append(with_arg(functools.partial(set_backend, cmd[1])))
+            elif cmd[0] == "stats":
+                def show_stats(*args):
+                    print(f"Last run: {motor.BACKEND.stats}")
+                commands.append(show_stats)
+            elif cmd[0] == "cache":
+                def show_cache(*args):
+                    print(f"Schedule cache: {motor.SCHEDULE_CACHE.stats()}")
+                commands.append(show_cache)
     except KeyboardInterrupt: print()
     finally:
         motor.reset()
         if rotator:
             rotator.stop()
             rotator = None
-        GPIO.output(motor.PINS["EN"], GPIO.HIGH)
+        motor.output(motor.PINS["EN"], GPIO.HIGH)
         #motor.pigpio_cleanup()
@@ -0,0 +1,114 @@
+#!/bin/python
+"""
+Motor commands off the asyncio loop. MotorDispatcher calls the (blocking) C extension client on its own thread,
+the web handlers only `submit` poses to a small coalescing queue: every dispatch takes the newest pose
+and discards the older ones, which the motor doesn't need anymore.
+Used by webcam.py (fast_motor.rotation_client) and restapi.py (fast_motor2.rotation_client_position).
+"""
+
+import collections
+import threading
+import time
+
+QUEUE_SIZE = 8
+
+
+class MotorDispatcher:
+    """
+    Calls `send(*pose)` on a dispatch thread, at most once per `tick` seconds (0: as soon as a pose comes).
+    `submit` never blocks on the motor, the queue holds at most `queue_size` poses.
+    """
+    def __init__(self, send, tick=0.0, queue_size=QUEUE_SIZE):
+        self.send = send
+        self.tick = tick
+        self.queue = collections.deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.submitted = 0
+        self.dispatched = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.latency_last_ns = 0
+        self.latency_sum_ns = 0
+        self.latency_max_ns = 0
+        self.call_sum_ns = 0
+        self.call_max_ns = 0
+
+    def start(self):
+        if self.running:
+            raise Exception("Dispatcher is already running")
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="motor-dispatch", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, *pose):
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.coalesced += 1  # the oldest pose falls out
+            self.queue.append((time.monotonic_ns(), pose))
+            self.submitted += 1
+            depth = len(self.queue)
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+            self.condition.notify()
+
+    def _run(self):
+        next_dispatch = time.monotonic()
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            # poses coming until the tick are coalesced too
+            delay = next_dispatch - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.condition:
+                submitted_ns, pose = self.queue.pop()
+                self.coalesced += len(self.queue)
+                self.queue.clear()
+            start_ns = time.monotonic_ns()
+            try:
+                self.send(*pose)
+            except Exception as e:
+                self.errors += 1
+                print(f"Motor dispatch failed: {e}")
+            end_ns = time.monotonic_ns()
+            next_dispatch = end_ns / 1e9 + self.tick
+            self.dispatched += 1
+            latency = end_ns - submitted_ns
+            self.latency_last_ns = latency
+            self.latency_sum_ns += latency
+            self.latency_max_ns = max(self.latency_max_ns, latency)
+            self.call_sum_ns += end_ns - start_ns
+            self.call_max_ns = max(self.call_max_ns, end_ns - start_ns)
+
+    def stats(self):
+        """Counters of the dispatcher, latencies are from `submit` to the end of the motor call."""
+        dispatched = max(1, self.dispatched)
+        return {
+            "submitted": self.submitted,
+            "dispatched": self.dispatched,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "queue depth": len(self.queue),
+            "mean queue depth": self.depth_sum / max(1, self.submitted),
+            "max queue depth": self.max_depth,
+            "last latency us": self.latency_last_ns / 1000,
+            "mean latency us": self.latency_sum_ns / dispatched / 1000,
+            "max latency us": self.latency_max_ns / 1000,
+            "mean call us": self.call_sum_ns / dispatched / 1000,
+            "max call us": self.call_max_ns / 1000,
+        }
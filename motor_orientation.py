@@ -0,0 +1,60 @@
+#!/bin/python
+"""
+Relative Y axis rotation (yaw) of recorded orientations in bulk, e.g. of webcam*.log JSON lines.
+Uses the relative_yaw kernel of the C extension when it can be imported, otherwise NumPy with the same results up to the last bit.
+"""
+
+import json
+import math
+import numpy as np
+import sys
+
+try:
+    import kosmiczna_magisterka.fast_motor2 as cmotor
+except ImportError:
+    cmotor = None
+
+ROTATION_PER_STEP = math.pi / 800  # as in fast_motor*.c, not motor.ROTATION_PER_STEP
+
+
+def load_orientations(path):
+    """Monotonic times (N) and orientations (N x 4, x y z w) of a JSON lines log."""
+    with open(path, "r") as f:
+        data = [json.loads(line) for line in f if line.strip()]
+    times = np.array([d["monotonic"] for d in data], dtype=np.float64)
+    quaternions = np.array([[d["orientation"][k] for k in "xyzw"] for d in data], dtype=np.float64)
+    return times, quaternions
+
+
+def relative_yaw_numpy(quaternions, steps=False):
+    """NumPy version of the C kernel: the same operations in the same order as get_angle, atan2 may differ in the last bit."""
+    q = np.ascontiguousarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    # conjugate of q_from, multiplied by q_to
+    fx, fy, fz, fw = -q[:-1, 0], -q[:-1, 1], -q[:-1, 2], q[:-1, 3]
+    tx, ty, tz, tw = q[1:, 0], q[1:, 1], q[1:, 2], q[1:, 3]
+    x = tw*fx + tx*fw + ty*fz - tz*fy
+    y = tw*fy - tx*fz + ty*fw + tz*fx
+    z = tw*fz + tx*fy - ty*fx + tz*fw
+    w = tw*fw - tx*fx - ty*fy - tz*fz
+    angles = np.arctan2(2*(w*y + x*z), 1 - 2*(y*y + z*z))
+    if steps:
+        return np.floor(angles / ROTATION_PER_STEP).astype(np.int64)
+    return angles
+
+
+def relative_yaw(quaternions, steps=False):
+    """N-1 yaw angles (radians) between consecutive quaternions (N x 4, x y z w), or int64 steps with `steps`."""
+    if cmotor is None:
+        return relative_yaw_numpy(quaternions, steps)
+    q = np.ascontiguousarray(quaternions, dtype=np.float64)
+    return np.frombuffer(cmotor.relative_yaw(q, steps=steps), dtype=np.int64 if steps else np.float64)
+
+
+if __name__ == "__main__":
+    # motor_orientation.py [log]
+    times, quaternions = load_orientations(sys.argv[1] if len(sys.argv) > 1 else "webcam.log")
+    angles = relative_yaw(quaternions)
+    speeds = angles / np.maximum(np.diff(times), 1e-6)
+    print(f"samples: {len(times)}")
+    print(f"total yaw: {angles.sum():.4f} rad, largest step: {np.abs(angles).max(initial=0):.4f} rad")
+    print(f"yaw speed: mean {np.abs(speeds).mean() if len(speeds) else 0:.4f} rad/s, max {np.abs(speeds).max(initial=0):.4f} rad/s")
@@ -0,0 +1,224 @@
+#!/bin/python
+"""
+Offline emulator of the pigpio script VM, for checking PIGPIO_SCRIPT without a Pi:
+instruction counts per loop, estimated loop time and pulse timing against the float reference.
+"""
+
+import motor
+import sys
+from collections import Counter
+
+COMMAND_NS = 64  # estimated time of one script command (about 250 commands in 16 us)
+MAX_COMMANDS = 50_000_000
+
+# number of arguments of the supported commands
+ARGUMENTS = {
+    "TAG": 1, "JMP": 1, "JM": 1, "JP": 1, "JZ": 1, "JNZ": 1, "CALL": 1, "RET": 0, "HALT": 0,
+    "LD": 2, "LDA": 1, "STA": 1, "X": 2, "XA": 1, "INR": 1, "DCR": 1, "INRA": 0, "DCRA": 0,
+    "ADD": 1, "SUB": 1, "MLT": 1, "DIV": 1, "MOD": 1, "AND": 1, "OR": 1, "XOR": 1, "CMP": 1,
+    "RLA": 1, "RRA": 1, "RL": 2, "RR": 2, "W": 2, "R": 1, "MICS": 1, "MILS": 1,
+}
+
+
+def int32(x):
+    return (x + 2**31) % 2**32 - 2**31
+
+
+def parse(script):
+    """Script text (str or bytes) to a list of (command, arguments) and a dict of tag positions."""
+    if isinstance(script, bytes):
+        script = script.decode()
+    tokens = script.split()
+    program = []
+    tags = {}
+    while tokens:
+        command = tokens.pop(0).upper()
+        if command not in ARGUMENTS:
+            raise Exception(f"Unsupported script command: {command}")
+        arguments = tuple(tokens[:ARGUMENTS[command]])
+        del tokens[:ARGUMENTS[command]]
+        if command == "TAG":
+            tags[arguments[0]] = len(program)
+        program.append((command, arguments))
+    return program, tags
+
+
+class ScriptVM:
+    """
+    pigpio script interpreter with a virtual clock: every command takes `command_ns`
+    and MICS/MILS add their delay. GPIO writes are recorded in `edges` as (time in ns, gpio, level).
+
+    pigpio documents RLA/RRA/RL/RR as rotations but defines them as shifts (A<<=x),
+    `rotate` selects the rotation.
+    """
+    def __init__(self, script, params, command_ns=COMMAND_NS, rotate=False):
+        self.program, self.tags = parse(script)
+        self.p = list(params) + [0] * (10 - len(params))
+        self.v = [0] * 150
+        self.A = 0
+        self.F = 0
+        self.command_ns = command_ns
+        self.rotate = rotate
+        self.time_ns = 0
+        self.commands = 0
+        self.counts = Counter()
+        self.edges = []
+        self.edge_commands = []  # commands executed before every edge
+        self.levels = {}
+        self.delays = []  # MICS/MILS delays in us
+
+    def value(self, argument):
+        if argument[0] == "v":
+            return self.v[int(argument[1:])]
+        if argument[0] == "p":
+            return self.p[int(argument[1:])]
+        return int(argument)
+
+    def store(self, argument, value):
+        if argument[0] == "v":
+            self.v[int(argument[1:])] = int32(value)
+        elif argument[0] == "p":
+            self.p[int(argument[1:])] = int32(value)
+        else:
+            raise Exception(f"Cannot store to {argument}")
+
+    def shift(self, value, bits, left):
+        if self.rotate:
+            value %= 2**32
+            bits %= 32
+            value = value << bits | value >> (32 - bits) if left else value >> bits | value << (32 - bits)
+        else:
+            value = value << bits if left else value >> bits
+        return int32(value)
+
+    def run(self, max_commands=MAX_COMMANDS):
+        ip = 0
+        stack = []
+        while ip < len(self.program):
+            if self.commands >= max_commands:
+                raise Exception(f"Script did not end in {max_commands} commands")
+            command, arguments = self.program[ip]
+            self.commands += 1
+            self.counts[command] += 1
+            self.time_ns += self.command_ns
+            ip += 1
+            x = self.value(arguments[-1]) if arguments and command not in ("TAG", "JMP", "JM", "JP", "JZ", "JNZ", "CALL") else None
+            if command in ("JMP", "JM", "JP", "JZ", "JNZ", "CALL"):
+                jump = {"JMP": True, "CALL": True, "JM": self.F < 0, "JP": self.F >= 0,
+                        "JZ": self.F == 0, "JNZ": self.F != 0}[command]
+                if command == "CALL":
+                    stack.append(ip)
+                if jump:
+                    ip = self.tags[arguments[0]]
+            elif command == "RET":
+                ip = stack.pop()
+            elif command == "HALT":
+                break
+            elif command == "LD":
+                self.store(arguments[0], x)
+            elif command == "LDA":
+                self.A = x
+            elif command == "STA":
+                self.store(arguments[0], self.A)
+            elif command == "X":
+                a, b = self.value(arguments[0]), self.value(arguments[1])
+                self.store(arguments[0], b)
+                self.store(arguments[1], a)
+            elif command == "XA":
+                self.A, a = self.value(arguments[0]), self.A
+                self.store(arguments[0], a)
+            elif command in ("INR", "DCR"):
+                self.F = int32(self.value(arguments[0]) + (1 if command == "INR" else -1))
+                self.store(arguments[0], self.F)
+            elif command in ("INRA", "DCRA"):
+                self.A = self.F = int32(self.A + (1 if command == "INRA" else -1))
+            elif command == "CMP":
+                self.F = int32(self.A - x)
+            elif command in ("RL", "RR"):
+                self.F = self.shift(self.value(arguments[0]), x, command == "RL")
+                self.store(arguments[0], self.F)
+            elif command in ("ADD", "SUB", "MLT", "DIV", "MOD", "AND", "OR", "XOR", "RLA", "RRA"):
+                if command in ("DIV", "MOD") and x == 0:
+                    raise Exception(f"Division by zero at command {ip - 1}")
+                A = self.A
+                # DIV and MOD truncate towards zero as in C
+                self.A = self.F = int32({
+                    "ADD": lambda: A + x, "SUB": lambda: A - x, "MLT": lambda: A * x,
+                    "DIV": lambda: abs(A) // abs(x) * (1 if (A < 0) == (x < 0) else -1),
+                    "MOD": lambda: abs(A) % abs(x) * (1 if A >= 0 else -1),
+                    "AND": lambda: A & x, "OR": lambda: A | x, "XOR": lambda: A ^ x,
+                    "RLA": lambda: self.shift(A, x, True), "RRA": lambda: self.shift(A, x, False),
+                }[command]())
+            elif command == "W":
+                gpio = self.value(arguments[0])
+                if self.levels.get(gpio) != x:
+                    self.edges.append((self.time_ns, gpio, x))
+                    self.edge_commands.append(self.commands)
+                self.levels[gpio] = x
+            elif command == "R":
+                self.A = self.levels.get(x, 0)
+            elif command in ("MICS", "MILS"):
+                if x < 0:
+                    raise Exception(f"Negative delay {x} at command {ip - 1}")
+                delay = x if command == "MICS" else x * 1000
+                self.delays.append(delay)
+                self.time_ns += delay * 1000
+        return self
+
+    def rising_edges(self, gpio):
+        return [t for t, g, level in self.edges if g == gpio and level]
+
+    def loop_commands(self, gpio):
+        """Commands executed between consecutive rising edges of `gpio`."""
+        marks = [c for (t, g, level), c in zip(self.edges, self.edge_commands) if g == gpio and level]
+        return [b - a for a, b in zip(marks, marks[1:])]
+
+
+def reference_edges(acceleration, start_frequency, duration, resolution=None):
+    """Rising edge times (ns) of PIGPIO_SCRIPT computed with floats: every impulse lasts 1/(f0 + k*t)."""
+    acceleration_constant = acceleration / motor.ROTATION_PER_STEP / (resolution or motor.get_step_resolution())
+    times = [0.0]
+    t = 1 / start_frequency
+    while True:
+        impulse = 1 / (start_frequency + acceleration_constant * t)
+        if t + impulse >= duration:
+            break
+        times.append(t)
+        t += impulse
+    return [round(t * 1e9) for t in times]
+
+
+def profile(acceleration, start_frequency, duration, resolution=1/16, command_ns=COMMAND_NS, rotate=False):
+    """Run PIGPIO_SCRIPT with the parameters of pigpio_accelerated_signal and compare it with the float reference."""
+    params = motor.pigpio_script_params(acceleration, start_frequency, duration, resolution)
+    vm = ScriptVM(motor.PIGPIO_SCRIPT, params, command_ns, rotate).run()
+    edges = vm.rising_edges(params[4])
+    reference = reference_edges(acceleration, start_frequency, duration, resolution)
+    periods = [b - a for a, b in zip(edges, edges[1:])]
+    reference_periods = [b - a for a, b in zip(reference, reference[1:])]
+    period_errors = [p - r for p, r in zip(periods, reference_periods)]
+    # high time of every loop pulse is the computed half impulse (us), so it shows the fixed point error alone
+    fixed_point_errors = [2000 * high - r for high, r in zip(vm.delays[2::2], reference_periods[1:])]
+    loop_commands = vm.loop_commands(params[4])
+    return {
+        "pulses": len(edges),
+        "reference pulses": len(reference),
+        "commands": vm.commands,
+        "commands per loop": (min(loop_commands, default=0), sum(loop_commands) / max(1, len(loop_commands)), max(loop_commands, default=0)),
+        "loop time us": sum(loop_commands) / max(1, len(loop_commands)) * command_ns / 1000,
+        "max fixed point error us": max(map(abs, fixed_point_errors), default=0) / 1000,
+        "mean period error us": sum(period_errors) / max(1, len(period_errors)) / 1000,
+        "max period error us": max(map(abs, period_errors), default=0) / 1000,
+        "final drift us": ((edges[-1] - reference[min(len(edges), len(reference)) - 1]) / 1000) if edges else 0,
+        "command counts": dict(vm.counts.most_common()),
+    }
+
+
+if __name__ == "__main__":
+    # motor_script.py [radians] [seconds] [frequency]
+    radians = float(sys.argv[1]) if len(sys.argv) > 1 else 3.141592653589793
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    frequency = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+    acceleration = 2 * motor.INERTIA_PLATFORM2WHEEL_RATIO * radians / duration / duration
+    for key, value in profile(acceleration, frequency, duration).items():
+        print(f"{key}: {value}")
@@ -15,6 +15,16 @@ if __name__ == "__main__":
             cmd = input("Angle: ").strip().lower()
             if cmd == "globals":
                 cmotor2.print_globals()
+            elif cmd == "rt":
+                print(cmotor2.get_rt_status())
+            elif cmd == "latency":
+                print(cmotor2.get_replan_latency())
+            elif cmd == "params":
+                print(cmotor2.get_params())
+            elif cmd.startswith("set "):
+                # set <parameter> <value>
+                _, name, value = cmd.split()
+                cmotor2.set_params(**{name: float(value)})
             elif cmd.startswith("stream"):
                 cmd = cmd.removeprefix("stream")
                 angle = int(cmd)
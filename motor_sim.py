@@ -0,0 +1,87 @@
+#!/bin/python
+"""
+Pulse rate, timing error and planning latency of the C extensions built with the simulated GPIO backend,
+so the C hot path can be benchmarked on an ordinary Linux machine. Build the simulated modules with:
+
+    mkdir -p kosmiczna_magisterka
+    for m in fast_motor fast_motor2; do
+        gcc -O -shared -fPIC -DSIMULATE_GPIO $(python3-config --includes) $m.c \\
+            -o kosmiczna_magisterka/$m$(python3-config --extension-suffix) -lpthread -lrt -lm
+    done
+"""
+
+import kosmiczna_magisterka.fast_motor as cmotor
+import kosmiczna_magisterka.fast_motor2 as cmotor2
+import statistics
+import sys
+import time
+
+STEP_PIN = 24
+
+
+def rising_edges(edges, gpio=STEP_PIN):
+    return [t for t, g, level in edges if g == gpio and level]
+
+
+def pulse_stats(edges, timing):
+    """Statistics of the recorded STEP pulses and of the pulse engine timing of the same maneuver."""
+    rising = rising_edges(edges)
+    periods = [b - a for a, b in zip(rising, rising[1:])]
+    return {
+        "pulses": len(rising),
+        "pulse rate hz": (len(rising) - 1) / (rising[-1] - rising[0]) * 1e9 if len(rising) > 1 else 0,
+        "min period us": min(periods, default=0) / 1000,
+        "median period us": statistics.median(periods) / 1000 if periods else 0,
+        "mean edge error us": timing["error_sum_ns"] / max(1, timing["edges"]) / 1000,
+        "max lateness us": timing["max_lateness_ns"] / 1000,
+        "resyncs": timing["resyncs"],
+    }
+
+
+def profile_signal(acceleration, frequency, duration):
+    """Run fast_motor.generate_signal_prep and return its pulse statistics."""
+    if not cmotor.SIMULATED:
+        raise Exception("fast_motor is not built with -DSIMULATE_GPIO")
+    cmotor.sim_edges(True)
+    cmotor.generate_signal_prep(acceleration, frequency, duration)
+    return pulse_stats(cmotor.sim_edges(True), cmotor.get_timing())
+
+
+def profile_server(angle, repeats=5):
+    """Send `angle` to the simple fast_motor2 server and measure the time from the setpoint to the first STEP edge."""
+    if not cmotor2.SIMULATED:
+        raise Exception("fast_motor2 is not built with -DSIMULATE_GPIO")
+    cmotor2.setup()
+    cmotor2.rotation_server_simple()
+    latencies = []
+    try:
+        for _ in range(repeats):
+            cmotor2.sim_edges(True)
+            sent = time.monotonic_ns()
+            cmotor2.rotation_client(angle)
+            while not rising_edges(cmotor2.sim_edges()):
+                time.sleep(0.001)
+            latencies.append(rising_edges(cmotor2.sim_edges())[0] - sent)
+            time.sleep(1)  # let the maneuver end
+        stats = pulse_stats(cmotor2.sim_edges(True), cmotor2.get_timing())
+    finally:
+        cmotor2.stop_rotation()
+        cmotor2.cleanup()
+    stats["first pulse latency us"] = (min(latencies) / 1000, statistics.median(latencies) / 1000, max(latencies) / 1000)
+    replan = cmotor2.get_replan_latency()
+    stats["replan latency us"] = (replan["mean_ns"] / 1000, replan["max_ns"] / 1000)
+    return stats
+
+
+if __name__ == "__main__":
+    # motor_sim.py [acceleration] [frequency] [seconds] [server angle]
+    acceleration = float(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    frequency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    angle = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+    print("generate_signal_prep:")
+    for key, value in profile_signal(acceleration, frequency, duration).items():
+        print(f"  {key}: {value}")
+    print("rotation_server_simple:")
+    for key, value in profile_server(angle).items():
+        print(f"  {key}: {value}")
@@ -0,0 +1,85 @@
+#!/bin/python
+"""
+Per-pulse and per-command telemetry of the C extensions (fast_motor, fast_motor2).
+The extensions record events in a ring exported through the buffer protocol,
+`view` maps it to a structured NumPy array without copying and `TelemetryReader` reads it incrementally.
+"""
+
+import numpy as np
+
+TELEMETRY_DTYPE = np.dtype([
+    ("sequence", "i8"),  # event index + 1, 0 while the record is written
+    ("planned_ns", "i8"),  # CLOCK_MONOTONIC deadline of an edge, receive time of a command
+    ("actual_ns", "i8"),  # write time of an edge, time the server took the command
+    ("segment", "i4"),  # pulse sequence (maneuver) id
+    ("value", "i4"),  # command steps, remaining steps of a stop
+    ("kind", "u1"),
+    ("direction", "u1"),
+    ("level", "u1"),
+    ("padding", "V5"),
+])
+PULSE = 1
+COMMAND = 2
+STOP = 3
+
+
+def view(module):
+    """Whole telemetry ring of `module` as a live structured array (no copy)."""
+    return np.frombuffer(module.telemetry_buffer(), dtype=TELEMETRY_DTYPE)
+
+
+class TelemetryReader:
+    """
+    Incremental reader of the telemetry ring. Every `read` returns a copy of the events recorded since the last one,
+    events overwritten before they were copied are counted in `lost`.
+    """
+    def __init__(self, module, cursor=None):
+        self.module = module
+        self.cursor = module.telemetry_cursor() if cursor is None else cursor
+        self.lost = 0
+
+    def read(self):
+        head, lost, views = self.module.telemetry_read(self.cursor)
+        if not views:
+            self.cursor = head
+            self.lost += lost
+            return np.empty(0, dtype=TELEMETRY_DTYPE)
+        events = np.concatenate([np.frombuffer(v, dtype=TELEMETRY_DTYPE) for v in views])
+        indices = np.arange(head - len(events), head)
+        # the ring may have moved on while copying
+        overwritten = indices < self.module.telemetry_cursor() - self.module.TELEMETRY_SIZE
+        written = events["sequence"] == indices + 1
+        pending = np.flatnonzero(~written & ~overwritten)
+        end = pending[0] if len(pending) else len(events)  # records still being written are read next time
+        self.cursor = int(indices[0]) + int(end)
+        self.lost += lost + int(overwritten[:end].sum())
+        return events[:end][~overwritten[:end]]
+
+
+def pulse_errors(events):
+    """Actual - planned time (ns) of every STEP edge."""
+    pulses = events[events["kind"] == PULSE]
+    return pulses["actual_ns"] - pulses["planned_ns"]
+
+
+def command_latencies(events):
+    """Time (ns) from the command to the first STEP edge after it, for commands followed by an edge."""
+    commands = events[events["kind"] == COMMAND]
+    pulses = events[events["kind"] == PULSE]
+    after = np.searchsorted(pulses["actual_ns"], commands["actual_ns"])
+    followed = after < len(pulses)
+    return pulses["actual_ns"][after[followed]] - commands["planned_ns"][followed]
+
+
+def summary(events):
+    errors = pulse_errors(events)
+    latencies = command_latencies(events)
+    return {
+        "pulses": int(np.count_nonzero(events["kind"] == PULSE) // 2),
+        "commands": int(np.count_nonzero(events["kind"] == COMMAND)),
+        "segments": len(np.unique(events["segment"][events["kind"] == PULSE])),
+        "mean edge error us": float(np.abs(errors).mean() / 1000) if len(errors) else 0.0,
+        "max edge lateness us": float(errors.max() / 1000) if len(errors) else 0.0,
+        "edge error std us": float(errors.std() / 1000) if len(errors) else 0.0,
+        "median command latency us": float(np.median(latencies) / 1000) if len(latencies) else 0.0,
+    }
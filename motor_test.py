@@ -9,6 +9,7 @@ rpi_stub = types.ModuleType("RPi")
 sys.modules["RPi"] = rpi_stub
 rpi_gpio_stub.HIGH = 1
 rpi_gpio_stub.LOW = 0
+rpi_gpio_stub.output = lambda pins, levels: None
 pigpio_stub = types.ModuleType("pigpio")
 sys.modules["pigpio"] = pigpio_stub
 kosmiczna_magisterka_stub = types.ModuleType("kosmiczna_magisterka")
@@ -74,6 +75,100 @@ def test_acceleration_of_accelerated_impulse():
     print(f"Computed final frequency: {1.0/impulses[-1]} Hz, Theoretical: {theoretical_final_speed / ROTATION_PER_STEP/get_step_resolution()} Hz")
     print(f"Number of impulses: {len(impulses)}")
 
+def test_impulse_schedule_benchmark():
+    """Compare list based and NumPy based impulse generators across ramp lengths."""
+    acceleration = 2 * INERTIA_PLATFORM2WHEEL_RATIO * math.pi
+    start_impulse = 1/100
+    for duration in (0.05, 0.1, 0.25, 0.5, 1):
+        start = time.perf_counter()
+        list_impulses = accelerated_impulse_durations_with_cond(acceleration, start_impulse, lambda durations: sum(durations) < duration)
+        list_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        impulses = accelerated_impulse_schedule(acceleration, start_impulse, duration=duration)
+        numpy_time = time.perf_counter() - start
+
+        final_frequency_error = abs(1/impulses[-1] - 1/list_impulses[-1]) * list_impulses[-1]
+        print(f"{duration=}s impulses: {len(list_impulses)} vs {len(impulses)}, "
+              f"list: {list_time*1000:.3f} ms, numpy: {numpy_time*1000:.3f} ms ({list_time/numpy_time:.0f}x), "
+              f"total time: {sum(list_impulses):.6f} vs {impulses.sum():.6f} s, final frequency error: {final_frequency_error:.4%}")
+
+
+def test_recording_backend():
+    """Run rotate_platform through the pigpio wave backend against the in-memory daemon."""
+    from motor_backends import RecordingBackend
+    backend = RecordingBackend(PINS["STEP"], MPINS)
+    set_backend(backend)
+    duration = 0.5
+    start = time.perf_counter()
+    final_frequency = rotate_platform(math.pi, duration, 300)
+    end = time.perf_counter()
+
+    planned = [wt for wt in planned_wait_times(2 * INERTIA_PLATFORM2WHEEL_RATIO * math.pi / duration / duration, duration, 1/300)]
+    step_times = backend.step_times()
+    planned_time = sum(planned) * 2 / 1000
+    recorded_time = step_times[-1] + planned[-1] * 2 / 1000
+    print(f"Schedule of {len(step_times)} steps sent in {(end - start)*1000:.3f} ms, final frequency {final_frequency:.2f} Hz")
+    print(f"Planned: {planned_time:.0f} us, recorded: {recorded_time:.0f} us, waves created: {backend.pi.next_wave_id}, "
+          f"max live pulses: {backend.pi.max_live_pulses}/{backend.pi.max_pulses}")
+
+def test_pin_shadow_register():
+    """Resolution switches of rotate_platform3 are tracked in PIN_STATE without reading the pins."""
+    from motor_backends import RecordingBackend
+    backend = RecordingBackend(PINS["STEP"], MPINS, PIN_STATE)
+    set_backend(backend)
+    output(MPINS, (1, 1, 0))
+    print(f"Before: resolution {RESOLUTIONS[tuple(PIN_STATE[pin] for pin in MPINS)]}, direction {get_direction()}, enabled {is_enabled()}")
+    rotate_platform3(math.pi / 4, 1)
+    hardware = {pin: backend.read(pin) for pin in (PINS["STEP"], *MPINS)}
+    shadow = {pin: PIN_STATE[pin] for pin in hardware}
+    print(f"After: resolution {RESOLUTIONS[tuple(PIN_STATE[pin] for pin in MPINS)]}, shadow {shadow}, recorded {hardware}, match: {shadow == hardware}")
+
+def test_hardware_rotator():
+    """
+    MotorRotator with the wave backend: ramps between frequencies are played once, then one period of repetition.
+    50 kHz is limited to MAX_STEP_FREQUENCY.
+    """
+    from motor_backends import RecordingBackend
+    backend = RecordingBackend(PINS["STEP"], MPINS, PIN_STATE)
+    set_backend(backend)
+    rotator = MotorRotator(2000)
+    for frequency in (5000, 50000, 1000):
+        time.sleep(0.1)
+        rotator.set_frequency(frequency)
+    time.sleep(0.1)
+    rotator.stop()
+    step_times = backend.step_times()
+    frequencies = [1e6 / (b - a) for a, b in zip(step_times, step_times[1:])]
+    jumps = max(abs(b - a) for a, b in zip(frequencies, frequencies[1:]))
+    print(f"{len(step_times)} steps recorded, frequency {min(frequencies):.0f}..{max(frequencies):.0f} Hz, "
+          f"largest change between steps: {jumps:.1f} Hz, waves left: {len(backend.pi.waves)}")
+
+def test_pigpio_script_profile():
+    """Emulate PIGPIO_SCRIPT offline and compare its pulses with the float reference."""
+    import motor_script
+    duration = 1
+    acceleration = 2 * INERTIA_PLATFORM2WHEEL_RATIO * math.pi / duration / duration
+    for frequency in (100, 300):
+        start = time.perf_counter()
+        result = motor_script.profile(acceleration, frequency, duration)
+        end = time.perf_counter()
+        print(f"{frequency=} Hz emulated in {end - start:.2f} s:")
+        pprint.pprint(result)
+
+def test_motion_program_script():
+    """Emulate an accelerate-then-decelerate motion program: both segments run in one script without a gap."""
+    import motor_script
+    duration = 0.5
+    top_frequency = 3000
+    acceleration = (top_frequency - 300) / duration * ROTATION_PER_STEP / 16
+    segments = [(acceleration, 300, duration), (-acceleration, top_frequency, duration)]
+    script, params = motion_program_script(segments, 1/16)
+    vm = motor_script.ScriptVM(script, params).run()
+    edges = vm.rising_edges(params[4])
+    periods = [b - a for a, b in zip(edges, edges[1:])]
+    print(f"{len(edges)} pulses in {vm.time_ns/1e9:.4f} s (planned {sum(d for _, _, d in segments)} s), "
+          f"shortest period {min(periods)/1000:.1f} us, last period {periods[-1]/1000:.1f} us, {vm.commands} commands")
 
 def test_frequency_grow_over_time():
     duration = 1
@@ -136,6 +231,28 @@ def test_rotate_platform3_calculations():
     print(f"{dur=} {duration/2=}")
     print(f"All summed: {(sum(wait_times) + sum(negated_wait_times) + sum(sum(pwts) for pwts in part_wait_times) + sum(sum(pwts) for pwts in negated_part_wait_times))*2:.6f} s")
 
+def test_microstep_plan():
+    """Check timing, angle and M1-M3 switches of the rotate_platform3 planner, switching back mirrors switching up."""
+    for duration in (1, 0.5, 0.25):
+        angle = INERTIA_PLATFORM2WHEEL_RATIO * math.pi
+        plan = MicrostepPlan(angle, duration)
+        resolution = None
+        total_time, total_angle, switches, switch_angles = 0, 0, [], []
+        for event in plan.events():
+            if isinstance(event, tuple):
+                resolution = RESOLUTIONS[event]
+                switches.append(resolution)
+                switch_angles.append(total_angle)
+            else:
+                total_time += 2 * event / 1e9
+                total_angle += step_angle(resolution)
+        print(f"{duration=}s top speed: {plan.top_speed:.2f} rad/s (reachable: {reachable_top_speed(angle, duration, plan.start_speed):.2f}), "
+              f"time: {total_time:.6f} s, angle: {total_angle:.4f}/{angle:.4f} rad, switches: {switches}")
+        assert switches == switches[::-1], f"switches are not symmetric: {switches}"
+        mirrored = [total_angle - a for a in switch_angles[::-1]]
+        assert all(abs(a - b) <= step_angle(1) for a, b in zip(switch_angles[1:], mirrored[:-1])), \
+            f"switch angles are not mirrored: {switch_angles}"
+
 def test_new_impulse_duration_formula():
     duration = 1
     radians = math.pi
@@ -181,7 +298,13 @@ def test_new_impulse_duration_formula():
             print(f"Discrepancy found ({i}): {a_n=} {a_n_2=}")
             break
 
-    for i in range(len(impulses2)):
+    # the batched schedule keeps the ramp of the list version
+    reference = accelerated_impulse_durations_with_cond(acceleration, t0, lambda durations: sum(durations) < duration)
+    assert impulses2[0] == t0, f"first impulse {impulses2[0]} != {t0}"
+    assert len(impulses2) == len(reference), f"{len(impulses2)} impulses != {len(reference)}"
+    assert math.isclose(1/impulses2[-1], 1/reference[-1], rel_tol=1e-6), f"final frequency {1/impulses2[-1]} != {1/reference[-1]}"
+
+    for i in range(min(len(impulses2), len(impulses3))):
         im1 = round(impulses2[i], 6)
         im2 = round(impulses3[i], 6)
         if im1 != im2:
@@ -351,6 +474,114 @@ def test_input_on_pi():
             webcam.handle_rotate(data[i])
 
 
+def test_input_batch_on_pi(interval=0.02):
+    """Replays webcam.log as in test_input_on_pi, but every `interval` seconds of records are sent in one rotation_client_batch call."""
+    import numpy as np
+    sys.modules.pop("kosmiczna_magisterka", None)
+    sys.modules.pop("kosmiczna_magisterka.fast_motor", None)
+    import kosmiczna_magisterka.fast_motor as cmotor
+    cmotor.setup()
+    cmotor.rotation_server()
+    print("Test started")
+    with open("webcam.log", "r") as f:
+        data = list(map(json.loads, f.readlines()))
+    rows = np.array([[d["monotonic"], d["orientation"]["x"], d["orientation"]["y"], d["orientation"]["z"], d["orientation"]["w"]] for d in data])
+    accepted = coalesced = batches = 0
+    started = time.monotonic()
+    start = 0
+    while start < len(rows):
+        end = np.searchsorted(rows[:, 0], rows[start, 0] + interval)
+        # send when the last record of the batch was received
+        time.sleep(max(0, rows[end - 1, 0] - rows[0, 0] - (time.monotonic() - started)))
+        a, c = cmotor.rotation_client_batch(rows[start:end])
+        accepted += a
+        coalesced += c
+        batches += 1
+        start = end
+    print(f"{len(rows)} records in {batches} batches: {accepted} accepted, {coalesced} coalesced")
+    cmotor.stop_rotation()
+
+def test_batch_newest_row(yaws=(0.3, -0.5, 0.9, 0.6)):
+    """rotation_client_batch sends only the newest row, the server takes the rotation straight to it."""
+    import numpy as np
+    from motor_telemetry import TelemetryReader, COMMAND
+    sys.modules.pop("kosmiczna_magisterka", None)
+    sys.modules.pop("kosmiczna_magisterka.fast_motor2", None)
+    import kosmiczna_magisterka.fast_motor2 as cmotor2
+    cmotor2.setup()
+    cmotor2.rotation_server_simple()
+    start = np.array([[0.0, 0, 0, 0, 1]])
+    cmotor2.rotation_client_batch(start)
+    reader = TelemetryReader(cmotor2)
+    rows = np.array([[t, 0, math.sin(yaw / 2), 0, math.cos(yaw / 2)] for t, yaw in enumerate(yaws)])
+    accepted, coalesced = cmotor2.rotation_client_batch(rows)
+    time.sleep(0.1)
+    cmotor2.stop_rotation()
+    events = reader.read()
+    commands = events[events["kind"] == COMMAND]["value"]
+    expected = np.frombuffer(cmotor2.relative_yaw(np.vstack([start[:, 1:], rows[-1:, 1:]]), steps=True), dtype=np.int64)
+    print(f"{accepted} accepted, {coalesced} coalesced, drained steps {commands.tolist()}, last row steps {expected.tolist()}")
+    assert (accepted, coalesced) == (1, len(yaws) - 1)
+    assert commands.tolist() == expected.tolist()
+
+def test_relative_yaw_kernels(samples=100000):
+    """NumPy relative_yaw matches the C kernel to about 1 ulp, steps to at most one step at the boundaries."""
+    import numpy as np
+    import motor_orientation
+    sys.modules.pop("kosmiczna_magisterka", None)
+    sys.modules.pop("kosmiczna_magisterka.fast_motor2", None)
+    import kosmiczna_magisterka.fast_motor2 as cmotor2
+    quaternions = np.random.default_rng(0).normal(size=(samples, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    angles = np.frombuffer(cmotor2.relative_yaw(quaternions), dtype=np.float64)
+    steps = np.frombuffer(cmotor2.relative_yaw(quaternions, steps=True), dtype=np.int64)
+    numpy_angles = motor_orientation.relative_yaw_numpy(quaternions)
+    numpy_steps = motor_orientation.relative_yaw_numpy(quaternions, steps=True)
+    eps = np.finfo(np.float64).eps
+    print(f"max difference: {np.abs(angles - numpy_angles).max():.3g} rad, "
+          f"different angles: {np.count_nonzero(angles != numpy_angles)}, different steps: {np.count_nonzero(steps != numpy_steps)}")
+    assert np.allclose(numpy_angles, angles, rtol=eps, atol=eps)
+    assert np.abs(steps - numpy_steps).max() <= 1
+
+
+def test_motor_dispatch(calls=200, call_time=0.005):
+    """Poses submitted faster than a slow motor client takes them are coalesced, submit never waits for the client."""
+    from motor_dispatch import MotorDispatcher
+    sent = []
+    def slow_client(*pose):
+        time.sleep(call_time)
+        sent.append(pose)
+    dispatcher = MotorDispatcher(slow_client)
+    dispatcher.start()
+    longest_submit = 0
+    for i in range(calls):
+        start = time.monotonic()
+        dispatcher.submit(i, 0, 0, 1)
+        longest_submit = max(longest_submit, time.monotonic() - start)
+        time.sleep(0.001)
+    time.sleep(2 * call_time)
+    dispatcher.stop()
+    print(dispatcher.stats())
+    print(f"longest submit: {longest_submit * 1e6:.0f} us, last pose sent: {sent[-1][0] == calls - 1}")
+
+def test_handle_rotate_dispatch(poses=50):
+    """webcam.handle_rotate passes poses to the motor through the dispatcher it starts on first use."""
+    sent = []
+    webcam.cmotor.rotation_client = lambda *pose: sent.append(pose)
+    webcam.disable_motor = False
+    webcam.dispatcher = None
+    webcam.last_number = -1
+    for i in range(poses):
+        webcam.handle_rotate({"number": i, "orientation": {"x": i, "y": 0, "z": 0, "w": 1}})
+    webcam.handle_rotate({"number": 0, "orientation": {"x": -1, "y": 0, "z": 0, "w": 1}})  # out of order, ignored
+    time.sleep(0.1)
+    webcam.dispatcher.stop()
+    print(webcam.dispatcher.stats())
+    print(f"{len(sent)} poses sent, last pose sent: {sent[-1] == (poses - 1, 0, 0, 1)}")
+    webcam.dispatcher = None
+    webcam.disable_motor = True
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("matplotlib").setLevel(logging.WARNING)
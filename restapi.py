@@ -2,10 +2,12 @@ from fastapi import FastAPI, Request
 import uvicorn
 import kosmiczna_magisterka.fast_motor2 as cmotor2
 import logging
+from motor_dispatch import MotorDispatcher
 
 app = FastAPI()
 
 last_number = -1
+dispatcher = MotorDispatcher(cmotor2.rotation_client_position)
 
 @app.post('/rotate')
 async def rotate(request: Request):
@@ -19,7 +21,11 @@ async def rotate(request: Request):
         return
     last_number = number
 
-    cmotor2.rotation_client_position(x, y, z, w)
+    dispatcher.submit(x, y, z, w)
+
+@app.get('/dispatch_stats')
+async def dispatch_stats():
+    return dispatcher.stats()
 
 @app.post('/print_globals')
 async def print_globals():
@@ -29,4 +35,5 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
     cmotor2.setup()
     cmotor2.rotation_server_simple()
+    dispatcher.start()
     uvicorn.run(app, host="127.0.0.1", port=9090, log_level="warning")
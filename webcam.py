@@ -5,6 +5,7 @@ import logging
 import os
 import platform
 import ssl
+import struct
 from typing import Optional
 import math
 import time
@@ -17,8 +18,11 @@ from aiortc import (
     RTCRtpSender,
     RTCSessionDescription,
 )
-from aiortc.contrib.media import MediaPlayer, MediaRelay
+from aiortc.contrib.media import MediaPlayer
 import kosmiczna_magisterka.fast_motor as cmotor
+from motor_dispatch import MotorDispatcher
+from webcam_capture import CaptureProcess
+from webcam_relay import EncodedRelay, EncodedTrack
 
 ROOT = os.path.dirname(__file__)
 cert_path = os.path.join("/etc/ssl/mycerts", "server_rsa.crt")
@@ -28,13 +32,15 @@ pcs = set()
 relay = None
 webcam = None
 disable_motor = True
+dispatcher = None
 
 def LOG2FILE(json):
     with open("webcam.log", "a") as f:
         f.write(json + "\n")
 
 def create_local_tracks(
-    play_from: str, decode: bool
+    play_from: str, decode: bool, bitrate: Optional[int] = None, latest: bool = False,
+    capture_process: bool = False
 ) -> tuple[Optional[MediaStreamTrack], Optional[MediaStreamTrack]]:
     global relay, webcam
 
@@ -46,7 +52,10 @@ def create_local_tracks(
         # Otherwise, play from the system's default webcam.
         #
         # In order to serve the same webcam to multiple users we make use of
-        # a `MediaRelay`. The webcam will stay open, so it is our responsability
+        # an `EncodedRelay`, which also encodes every frame only once per codec.
+        # With `latest` it drops stale frames instead of queueing them.
+        # With `capture_process` the webcam is decoded in another process.
+        # The webcam will stay open, so it is our responsability
         # to stop the webcam when the application shuts down in `on_shutdown`.
         #options = {
             #"framerate": "10",
@@ -63,17 +72,18 @@ def create_local_tracks(
         }
         if relay is None:
             if platform.system() == "Darwin":
-                webcam = MediaPlayer(
-                    "default:none", format="avfoundation", options=options
-                )
+                file, format = "default:none", "avfoundation"
             elif platform.system() == "Windows":
-                webcam = MediaPlayer(
-                    "video=Integrated Camera", format="dshow", options=options
-                )
+                file, format = "video=Integrated Camera", "dshow"
             else:
-                webcam = MediaPlayer("/dev/video0", format="v4l2", options=options)
-            relay = MediaRelay()
-        return None, relay.subscribe(webcam.video)
+                file, format = "/dev/video0", "v4l2"
+            if capture_process:
+                width, height = map(int, options["video_size"].split("x"))
+                webcam = CaptureProcess(file, format, options, width, height)
+            else:
+                webcam = MediaPlayer(file, format=format, options=options)
+            relay = EncodedRelay(latest=latest)
+        return None, relay.subscribe(webcam.video, bitrate)
 
 
 def force_codec(pc: RTCPeerConnection, sender: RTCRtpSender, forced_codec: str) -> None:
@@ -174,15 +184,74 @@ def get_cmotor_parameters(current_orientation, time_diff) -> list[tuple[float, f
 
     return [(acceleration, start_frequency, time_diff)]
 
-def handle_rotate(json_params):
-    current_number = json_params["number"]
+# Binary pose message (little endian): version, kind, reserved, sequence number,
+# client time (ms since the epoch), orientation quaternion x y z w.
+POSE_MESSAGE = struct.Struct("<BBHIdffff")
+POSE_VERSION = 1
+POSE_KIND = 1
+# SCTP stream of the negotiated pose channel (unordered, no retransmits), the same in www/index.html
+POSE_CHANNEL_ID = 100
+stale_poses = 0
+# Receive time - client time (ms) of the binary poses, includes the offset between the two clocks,
+# so the spread (max - min) is the part that changes with the network
+pose_age_count = 0
+pose_age_last = 0.0
+pose_age_sum = 0.0
+pose_age_min = math.inf
+pose_age_max = -math.inf
+
+def record_pose_age(client_time: float) -> None:
+    global pose_age_count, pose_age_last, pose_age_sum, pose_age_min, pose_age_max
+    pose_age_last = time.time() * 1000 - client_time
+    pose_age_count += 1
+    pose_age_sum += pose_age_last
+    pose_age_min = min(pose_age_min, pose_age_last)
+    pose_age_max = max(pose_age_max, pose_age_last)
+
+def pose_stats() -> dict:
+    return {
+        "stale poses": stale_poses,
+        "poses with client time": pose_age_count,
+        "last pose age ms": pose_age_last,
+        "mean pose age ms": pose_age_sum / max(1, pose_age_count),
+        "min pose age ms": pose_age_min if pose_age_count else 0.0,
+        "max pose age ms": pose_age_max if pose_age_count else 0.0,
+    }
+
+def motor_dispatcher() -> MotorDispatcher:
+    """Dispatcher of cmotor.rotation_client, started on first use."""
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = MotorDispatcher(cmotor.rotation_client)
+        dispatcher.start()
+    return dispatcher
+
+def handle_pose(number, x, y, z, w) -> bool:
+    """
+    Pass the orientation to the motor dispatch thread, unless a newer one was already handled.
+    """
     global last_number
-    if current_number <= last_number:
-        print(f"Out of order packet: {current_number=} {last_number=}")
+    if number <= last_number:
+        return False
+    last_number = number
+    if not disable_motor:
+        motor_dispatcher().submit(x,y,z,w)
+    return True
+
+def handle_pose_message(message: bytes) -> None:
+    global stale_poses
+    data = memoryview(message)
+    if len(data) < POSE_MESSAGE.size or data[0] != POSE_VERSION or data[1] != POSE_KIND:
+        print(f"Unknown pose message: {bytes(data[:2])} ({len(data)} bytes)")
         return
-    last_number = current_number
-
+    _, _, _, number, client_time, x, y, z, w = POSE_MESSAGE.unpack_from(data)
+    record_pose_age(client_time)
+    if not handle_pose(number, x, y, z, w):
+        # expected now and then on the unordered channel
+        stale_poses += 1
 
+def handle_rotate(json_params):
+    current_number = json_params["number"]
     current_orientation = json_params["orientation"]
     #now = time.clock_gettime(time.CLOCK_MONOTONIC)
     #json_params["monotonic"] = now
@@ -190,8 +259,15 @@ def handle_rotate(json_params):
     #LOG2FILE(json.dumps(json_params))
 
     x,y,z,w = current_orientation["x"], current_orientation["y"], current_orientation["z"], current_orientation["w"]
-    if not disable_motor:
-        cmotor.rotation_client(x,y,z,w)
+    if not handle_pose(current_number, x, y, z, w):
+        print(f"Out of order packet: {current_number=} {last_number=}")
+
+def handle_rotation_message(message) -> None:
+    # binary pose messages, JSON text of older clients
+    if isinstance(message, str):
+        handle_rotate(json.loads(message))
+    else:
+        handle_pose_message(message)
 
 async def rotate(request: web.Request) -> web.Response:
     # Get parameters
@@ -204,6 +280,17 @@ async def print_queue_size(request: web.Request):
     cmotor.print_globals()
     return web.Response(status=200)
 
+async def motor_stats(request: web.Request) -> web.Response:
+    stats = dispatcher.stats() if dispatcher is not None else {}
+    stats.update(pose_stats())
+    return web.json_response(stats)
+
+async def video_stats(request: web.Request) -> web.Response:
+    stats = relay.stats() if relay is not None else {}
+    if isinstance(webcam, CaptureProcess):
+        stats["capture"] = webcam.video.stats()
+    return web.json_response(stats)
+
 async def javascript(request: web.Request) -> web.Response:
     content = open(os.path.join(ROOT, "client.js"), "r").read()
     return web.Response(content_type="application/javascript", text=content)
@@ -227,14 +314,21 @@ async def offer(request: web.Request) -> web.Response:
     def on_datachannel(channel) -> None:
         print(f"Data channel created: {channel.label}")
         
-        @channel.on("message")
-        def on_message(message) -> None:
-            handle_rotate(json.loads(message))
-
-    # open media source
-    audio, video = create_local_tracks(
-        args.play_from, decode=not args.play_without_decoding
-    )
+        channel.on("message", handle_rotation_message)
+
+    if "m=application" in offer.sdp:
+        pose_channel = pc.createDataChannel(
+            "pose", negotiated=True, id=POSE_CHANNEL_ID, ordered=False, maxRetransmits=0
+        )
+        pose_channel.on("message", handle_rotation_message)
+
+    # open media source, unless the client only sends poses
+    audio, video = None, None
+    if "m=video" in offer.sdp or "m=audio" in offer.sdp:
+        audio, video = create_local_tracks(
+            args.play_from, decode=not args.play_without_decoding, bitrate=args.video_bitrate,
+            latest=args.low_latency, capture_process=args.capture_process
+        )
 
     if audio:
         audio_sender = pc.addTrack(audio)
@@ -245,6 +339,8 @@ async def offer(request: web.Request) -> web.Response:
 
     if video:
         video_sender = pc.addTrack(video)
+        if isinstance(video, EncodedTrack):
+            video.attach(video_sender)
         if args.video_codec:
             force_codec(pc, video_sender, args.video_codec)
         elif args.play_without_decoding:
@@ -269,8 +365,13 @@ async def on_shutdown(app: web.Application) -> None:
     await asyncio.gather(*coros)
     pcs.clear()
 
+    if dispatcher is not None:
+        dispatcher.stop()
+
     # If a shared webcam was opened, stop it.
-    if webcam is not None:
+    if isinstance(webcam, CaptureProcess):
+        webcam.stop()
+    elif webcam is not None:
         webcam.video.stop()
 
 
@@ -300,9 +401,29 @@ if __name__ == "__main__":
     parser.add_argument(
         "--video-codec", help="Force a specific video codec (e.g. video/H264)"
     )
+    parser.add_argument(
+        "--video-bitrate", type=int, help="Target bitrate of the shared webcam encoder in bps (default: aiortc's)"
+    )
+    parser.add_argument(
+        "--low-latency", action="store_true",
+        help="Keep only the newest webcam frame per encoder and peer, drop the stale ones (see /video_stats)"
+    )
+    parser.add_argument(
+        "--capture-process", action="store_true",
+        help="Capture and decode the webcam in a separate process, frames are shared through shared memory"
+    )
     parser.add_argument(
         "--disable-motor", action="store_true", help="Disable motor control"
     )
+    parser.add_argument(
+        "--rt-priority", type=int, default=0, help="SCHED_FIFO priority of the motor thread (default: 0, not real-time)"
+    )
+    parser.add_argument(
+        "--rt-cpu", type=int, default=-1, help="CPU the motor thread is pinned to (default: any)"
+    )
+    parser.add_argument(
+        "--lock-memory", action="store_true", help="Lock process memory and prefault the motor thread stack"
+    )
 
     args = parser.parse_args()
 
@@ -325,12 +446,17 @@ if __name__ == "__main__":
     app.router.add_get("/", index)
     #app.router.add_get("/client.js", javascript)
     app.router.add_post("/print_queue_size", print_queue_size)
+    app.router.add_get("/video_stats", video_stats)
+    app.router.add_get("/motor_stats", motor_stats)
     app.router.add_post("/offer", offer)
     app.router.add_post("/rotate", rotate)
 
     if not args.disable_motor:
         disable_motor = args.disable_motor
         cmotor.setup()
-        cmotor.rotation_server()
+        cmotor.rotation_server(priority=args.rt_priority, cpu=args.rt_cpu, lock_memory=args.lock_memory,
+                               prefault_stack=256 * 1024 if args.lock_memory else 0)
+        logging.info(f"Motor thread real-time status: {cmotor.get_rt_status()}")
+        motor_dispatcher()
 
     web.run_app(app, host=args.host, port=args.port, ssl_context=ssl_context)
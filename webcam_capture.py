@@ -0,0 +1,211 @@
+#!/bin/python
+"""
+Webcam capture and decoding in a separate process.
+The worker process decodes the camera into a multiprocessing.shared_memory ring of yuv420p frames,
+the aiortc process copies the newest frame of the ring into an av.VideoFrame (SharedMemoryTrack).
+So decoding runs on another core and a heavy frame doesn't hold up the asyncio loop of webcam.py.
+"""
+
+import asyncio
+import fractions
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import av
+import numpy as np
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+FRAME_FORMAT = "yuv420p"
+SLOTS = 8  # the newest frame can be read for SLOTS - 1 frame periods
+HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64  # sequence, pts, time base numerator and denominator, capture time (ns)
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+class FrameRing:
+    """
+    Ring of yuv420p frames in shared memory. Frame number `sequence` (from 1) is written to slot sequence % slots,
+    the ring header holds the sequence of the newest complete frame.
+    Every slot has a lock: plain numpy stores are not ordered between processes, the lock makes the whole slot
+    visible to the reader at once. `read` copies the frame, so the worker can't overwrite it while it is encoded.
+    """
+    def __init__(self, width, height, slots=SLOTS, name=None, locks=None):
+        self.width = width
+        self.height = height
+        self.slots = slots
+        self.frame_size = width * height * 3 // 2
+        self.slot_size = SLOT_HEADER_SIZE + (self.frame_size + 63) // 64 * 64
+        size = HEADER_SIZE + slots * self.slot_size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.locks = locks or [CONTEXT.Lock() for _ in range(slots)]
+        self.header = np.ndarray(1, np.int64, self.shm.buf)
+        self.slot_headers = [np.ndarray(5, np.int64, self.shm.buf, HEADER_SIZE + i * self.slot_size)
+                             for i in range(slots)]
+        self.frames = [np.ndarray((height * 3 // 2, width), np.uint8, self.shm.buf,
+                                  HEADER_SIZE + i * self.slot_size + SLOT_HEADER_SIZE)
+                       for i in range(slots)]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def sequence(self):
+        return int(self.header[0])
+
+    def write(self, frame, capture_ns):
+        """Copy a yuv420p av.VideoFrame of the ring size into the next slot."""
+        sequence = self.sequence() + 1
+        slot = sequence % self.slots
+        header = self.slot_headers[slot]
+        data = self.frames[slot].reshape(-1)
+        time_base = frame.time_base or fractions.Fraction(1, 1000000000)
+        with self.locks[slot]:
+            offset = 0
+            for plane, (width, height) in zip(frame.planes, [(self.width, self.height)] + 2 * [(self.width // 2, self.height // 2)]):
+                lines = np.frombuffer(plane, np.uint8).reshape(height, plane.line_size)
+                data[offset:offset + width * height].reshape(height, width)[:] = lines[:, :width]
+                offset += width * height
+            header[1] = frame.pts if frame.pts is not None else capture_ns
+            header[2] = time_base.numerator
+            header[3] = time_base.denominator
+            header[4] = capture_ns
+            header[0] = sequence
+        self.header[0] = sequence  # after the slot lock, a reader taking the lock sees the whole slot
+
+    def read(self, sequence):
+        """Copy of frame `sequence` as an av.VideoFrame with its capture time, None if it was overwritten."""
+        slot = sequence % self.slots
+        header = self.slot_headers[slot]
+        with self.locks[slot]:
+            if header[0] != sequence:
+                return None, 0
+            data = self.frames[slot].copy()
+            pts, time_base_num, time_base_den, capture_ns = (int(value) for value in header[1:])
+        frame = av.VideoFrame.from_numpy_buffer(data, format=FRAME_FORMAT)
+        frame.pts = pts
+        frame.time_base = fractions.Fraction(time_base_num, time_base_den)
+        return frame, capture_ns
+
+    def close(self, unlink=False):
+        self.header = self.slot_headers = self.frames = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def capture_worker(file, format, options, name, width, height, slots, locks, notify):
+    """Body of the capture process: decode `file` into the ring and send an empty message after every frame."""
+    ring = FrameRing(width, height, slots, name, locks)
+    os.set_blocking(notify.fileno(), False)
+    container = av.open(file, format=format, options=options)
+    try:
+        for frame in container.decode(video=0):
+            capture_ns = time.monotonic_ns()
+            if frame.format.name != FRAME_FORMAT or frame.width != width or frame.height != height:
+                frame = frame.reformat(width, height, FRAME_FORMAT)
+            ring.write(frame, capture_ns)
+            try:
+                notify.send_bytes(b"")  # 4 bytes, smaller than PIPE_BUF so written whole or not at all
+            except BlockingIOError:
+                pass  # the reader is behind, it reads the newest sequence anyway
+    finally:
+        container.close()
+        ring.close()
+
+
+class CaptureProcess:
+    """Capture worker process with its frame ring. `video` is a track of it, more can be made with `track()`."""
+    def __init__(self, file, format=None, options=None, width=2560, height=720, slots=SLOTS):
+        self.ring = FrameRing(width, height, slots)
+        self.receive, notify = CONTEXT.Pipe(duplex=False)
+        self.process = CONTEXT.Process(
+            target=capture_worker,
+            args=(file, format, options or {}, self.ring.name, width, height, slots, self.ring.locks, notify),
+            daemon=True)
+        self.process.start()
+        notify.close()
+        self.new_frame = asyncio.Event()
+        self.ended = False
+        asyncio.get_event_loop().add_reader(self.receive.fileno(), self._on_notify)
+        self.video = self.track()
+
+    def _on_notify(self):
+        try:
+            while self.receive.poll():
+                self.receive.recv_bytes()
+        except (EOFError, OSError):
+            self._end()
+        self.new_frame.set()
+
+    def _end(self):
+        if not self.ended:
+            self.ended = True
+            asyncio.get_event_loop().remove_reader(self.receive.fileno())
+
+    async def wait(self, sequence):
+        """Wait until the ring has a frame newer than `sequence`."""
+        while self.ring.sequence() <= sequence:
+            if self.ended:
+                raise MediaStreamError
+            self.new_frame.clear()
+            await self.new_frame.wait()
+
+    def track(self):
+        return SharedMemoryTrack(self)
+
+    def stop(self):
+        self._end()
+        self.new_frame.set()
+        self.process.terminate()
+        self.process.join()
+        self.receive.close()
+        self.ring.close(unlink=True)
+
+
+class SharedMemoryTrack(MediaStreamTrack):
+    """
+    Newest frame of a CaptureProcess ring on every recv, frames skipped in between count as dropped.
+    The age of a frame is the time since the worker decoded it.
+    """
+    kind = "video"
+
+    def __init__(self, capture):
+        super().__init__()
+        self.capture = capture
+        self.sequence = capture.ring.sequence()
+        self.frames = 0
+        self.dropped = 0
+        self.age_last = 0.0
+        self.age_sum = 0.0
+        self.age_max = 0.0
+
+    async def recv(self):
+        while True:
+            if self.readyState != "live":
+                raise MediaStreamError
+            await self.capture.wait(self.sequence)
+            sequence = self.capture.ring.sequence()
+            frame, capture_ns = self.capture.ring.read(sequence)
+            if frame is not None:
+                break
+        if self.frames:
+            self.dropped += sequence - self.sequence - 1
+        self.sequence = sequence
+        age = (time.monotonic_ns() - capture_ns) / 1e9
+        self.frames += 1
+        self.age_last = age
+        self.age_sum += age
+        self.age_max = max(self.age_max, age)
+        return frame
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "dropped frames": self.dropped,
+            "last age ms": self.age_last * 1000,
+            "mean age ms": self.age_sum / max(1, self.frames) * 1000,
+            "max age ms": self.age_max * 1000,
+        }
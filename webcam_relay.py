@@ -0,0 +1,331 @@
+#!/bin/python
+"""
+Encode-once fan-out of a video track to many WebRTC peers.
+aiortc encodes the track separately in the RTCRtpSender of every peer connection, here every frame is encoded once
+per codec and bitrate and the subscribed senders only wrap the shared RTP payloads in their own RTP headers.
+Keyframe requests (PLI, FIR) of all peers are merged into one forced keyframe.
+With `latest` the relay keeps at most one pending frame per subscriber, stale frames are dropped and counted.
+"""
+
+import asyncio
+import time
+
+import aiortc
+from aiortc import MediaStreamTrack
+from aiortc.codecs import get_encoder
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
+from aiortc.rtcrtpsender import RTCEncodedFrame
+from aiortc.rtp import RTCP_PSFB_APP, RTCP_PSFB_PLI, RtcpPsfbPacket, unpack_remb_fci
+
+RTCP_PSFB_FIR = 4  # RFC 5104, aiortc itself ignores it
+KEYFRAME_INTERVAL = 0.5  # minimal time (s) between forced keyframes, requests in between are merged
+AIORTC_VERSION = "1.13.0"  # EncodedTrack.attach replaces private methods of RTCRtpSender of this version
+SENDER_METHODS = ("_next_encoded_frame", "_send_keyframe", "_handle_rtcp_packet")
+
+
+class LatestFrameTrack(MediaStreamTrack):
+    """
+    Subscriber of a LatestFrameRelay. Holds at most one pending frame, a newer frame replaces it.
+    The age of a frame (time since the relay received it) is measured when it is taken, i.e. right before encoding.
+    """
+    def __init__(self, relay, source):
+        super().__init__()
+        self.kind = source.kind
+        self.relay = relay
+        self.source = source
+        self.frame = None
+        self.received = 0.0
+        self.new_frame = asyncio.Event()
+        self.frames = 0
+        self.dropped = 0
+        self.age_last = 0.0
+        self.age_sum = 0.0
+        self.age_max = 0.0
+
+    def put(self, frame, received):
+        if self.frame is not None:
+            self.dropped += 1
+        self.frame = frame
+        self.received = received
+        self.new_frame.set()
+
+    async def recv(self):
+        self.relay._start(self)
+        while self.frame is None:
+            if self.readyState != "live":
+                raise MediaStreamError
+            await self.new_frame.wait()
+            self.new_frame.clear()
+        frame, self.frame = self.frame, None
+        age = time.monotonic() - self.received
+        self.frames += 1
+        self.age_last = age
+        self.age_sum += age
+        self.age_max = max(self.age_max, age)
+        return frame
+
+    def stop(self):
+        if self.readyState == "ended":
+            return
+        super().stop()
+        self.frame = None
+        self.new_frame.set()
+        self.relay._stop(self)
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "dropped frames": self.dropped,
+            "last age ms": self.age_last * 1000,
+            "mean age ms": self.age_sum / max(1, self.frames) * 1000,
+            "max age ms": self.age_max * 1000,
+        }
+
+
+class LatestFrameRelay:
+    """
+    MediaRelay without queues: a task per source track takes every frame as soon as it is decoded
+    and hands it to the subscribers, a subscriber that did not take the previous frame yet loses it.
+    """
+    def __init__(self):
+        self.subscribers = {}
+        self.tasks = {}
+
+    def subscribe(self, track):
+        proxy = LatestFrameTrack(self, track)
+        self.subscribers.setdefault(track, set()).add(proxy)
+        return proxy
+
+    def _start(self, proxy):
+        # the source is read from the first recv on, frames before it would only count as dropped
+        if proxy.source not in self.tasks:
+            self.tasks[proxy.source] = asyncio.ensure_future(self._run(proxy.source))
+
+    def _stop(self, proxy):
+        subscribers = self.subscribers.get(proxy.source, set())
+        subscribers.discard(proxy)
+        if not subscribers:
+            self.subscribers.pop(proxy.source, None)
+            task = self.tasks.pop(proxy.source, None)
+            if task is not None:
+                task.cancel()
+
+    async def _run(self, track):
+        try:
+            while True:
+                frame = await track.recv()
+                received = time.monotonic()
+                for proxy in self.subscribers.get(track, ()):
+                    proxy.put(frame, received)
+        except MediaStreamError:
+            for proxy in list(self.subscribers.get(track, ())):
+                proxy.stop()
+
+    def stats(self):
+        return [proxy.stats() for subscribers in self.subscribers.values() for proxy in subscribers]
+
+
+class SharedEncoder:
+    """
+    One encoder of a source track, its encoded frames are queued to every subscribed EncodedTrack.
+    The track is read through an own proxy of `relay`, which is stopped with the last subscriber.
+    With `latest` a peer that has not sent the previous frame yet drops its queue and waits for a forced keyframe.
+    The target bitrate is the lowest receiver estimate (REMB) of the peers, at most `bitrate`.
+    """
+    def __init__(self, relay, track, codec, bitrate=None, latest=False):
+        self.source = relay.subscribe(track)
+        self.latest = latest
+        self.bitrate = bitrate
+        self.encoder = get_encoder(codec)
+        if bitrate is not None and hasattr(self.encoder, "target_bitrate"):
+            self.encoder.target_bitrate = bitrate
+        self.subscribers = set()
+        self.task = None
+        self.keyframe_requested = False
+        self.last_keyframe = 0.0
+        self.frames = 0
+        self.keyframes = 0
+        self.keyframe_requests = 0
+
+    def subscribe(self, track):
+        self.subscribers.add(track)
+        self.request_keyframe()  # the new peer can't decode anything before a keyframe
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def unsubscribe(self, track):
+        self.subscribers.discard(track)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.source.stop()  # only the own proxy, the relay would keep queueing frames for it
+        else:
+            self.update_bitrate()
+
+    def update_bitrate(self):
+        estimates = [track.estimated_bitrate for track in self.subscribers if track.estimated_bitrate is not None]
+        if self.bitrate is not None:
+            estimates.append(self.bitrate)
+        if estimates and hasattr(self.encoder, "target_bitrate"):
+            self.encoder.target_bitrate = min(estimates)
+
+    def request_keyframe(self):
+        self.keyframe_requests += 1
+        self.keyframe_requested = True
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                frame = await self.source.recv()
+                now = time.monotonic()
+                force_keyframe = self.keyframe_requested and now - self.last_keyframe >= KEYFRAME_INTERVAL
+                if force_keyframe:
+                    self.keyframe_requested = False
+                    self.last_keyframe = now
+                    self.keyframes += 1
+                payloads, timestamp = await loop.run_in_executor(None, self.encoder.encode, frame, force_keyframe)
+                self.frames += 1
+                if not payloads:
+                    self.keyframe_requested |= force_keyframe
+                    continue
+                encoded = RTCEncodedFrame(payloads, timestamp, None)
+                for track in self.subscribers:
+                    if self.latest:
+                        self._put_latest(track, encoded, force_keyframe)
+                    else:
+                        track.queue.put_nowait(encoded)
+        except MediaStreamError:
+            for track in list(self.subscribers):
+                track.stop()
+
+    def _put_latest(self, track, encoded, keyframe):
+        # frames after a dropped one can't be decoded, so a lagging peer resumes at the next forced keyframe
+        if not track.queue.empty():
+            track.dropped += track.queue.qsize()
+            while not track.queue.empty():
+                track.queue.get_nowait()
+            track.waiting_keyframe = True
+            self.request_keyframe()
+        if track.waiting_keyframe and not keyframe:
+            track.dropped += 1
+            return
+        track.waiting_keyframe = False
+        track.queue.put_nowait(encoded)
+
+    def stats(self):
+        stats = {
+            "subscribers": len(self.subscribers),
+            "target bitrate": getattr(self.encoder, "target_bitrate", None),
+            "encoded frames": self.frames,
+            "forced keyframes": self.keyframes,
+            "keyframe requests": self.keyframe_requests,
+            "peers": [track.stats() for track in self.subscribers],
+        }
+        if isinstance(self.source, LatestFrameTrack):
+            stats["source"] = self.source.stats()
+        return stats
+
+
+class EncodedTrack(MediaStreamTrack):
+    """
+    Video track of one peer connection. After `pc.addTrack(track)` the returned sender has to be passed to `attach`,
+    the sender then takes the payloads of the SharedEncoder of its negotiated codec instead of encoding by itself.
+    """
+    kind = "video"
+
+    def __init__(self, relay, source, bitrate=None):
+        super().__init__()
+        self.relay = relay
+        self.source = source
+        self.bitrate = bitrate
+        self.encoder = None
+        self.queue = asyncio.Queue()
+        self.sent = 0
+        self.dropped = 0
+        self.waiting_keyframe = False
+        self.estimated_bitrate = None  # REMB of the peer
+
+    async def recv(self):
+        raise MediaStreamError("EncodedTrack is read through its sender, see attach")
+
+    def attach(self, sender):
+        if aiortc.__version__ != AIORTC_VERSION or not all(hasattr(sender, name) for name in SENDER_METHODS):
+            raise Exception(f"EncodedTrack needs the RTCRtpSender of aiortc {AIORTC_VERSION}, found {aiortc.__version__}")
+
+        async def next_encoded_frame(codec):
+            if self.encoder is None:
+                self.encoder = self.relay.encoder(self.source, codec, self.bitrate)
+                self.encoder.subscribe(self)
+            encoded = await self.queue.get()
+            if encoded is None:
+                raise MediaStreamError
+            if not sender._enabled:
+                return None
+            self.sent += 1
+            return encoded
+
+        def send_keyframe():
+            if self.encoder is not None:
+                self.encoder.request_keyframe()
+
+        handle_rtcp_packet = sender._handle_rtcp_packet
+
+        async def handle_encoder_feedback(packet):
+            # aiortc applies both to the encoder of the sender, which is not used here
+            if isinstance(packet, RtcpPsfbPacket) and packet.fmt in (RTCP_PSFB_PLI, RTCP_PSFB_FIR):
+                send_keyframe()
+            elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+                try:
+                    bitrate, ssrcs = unpack_remb_fci(packet.fci)
+                except ValueError:
+                    return
+                if sender._ssrc in ssrcs:
+                    self.estimated_bitrate = bitrate
+                    if self.encoder is not None:
+                        self.encoder.update_bitrate()
+            else:
+                await handle_rtcp_packet(packet)
+
+        # RTCRtpSender._run_rtp and _run_rtcp call these through the instance
+        sender._next_encoded_frame = next_encoded_frame
+        sender._send_keyframe = send_keyframe
+        sender._handle_rtcp_packet = handle_encoder_feedback
+
+    def stop(self):
+        if self.readyState == "ended":
+            return
+        super().stop()
+        self.queue.put_nowait(None)
+        if self.encoder is not None:
+            self.encoder.unsubscribe(self)
+
+    def stats(self):
+        return {"sent frames": self.sent, "dropped frames": self.dropped, "pending frames": self.queue.qsize(),
+                "estimated bitrate": self.estimated_bitrate}
+
+
+class EncodedRelay:
+    """
+    Like aiortc's MediaRelay, but the subscribers share the encoders of the track, not only its frames.
+    With `latest` the encoders read the track through a LatestFrameRelay and lagging peers drop frames,
+    so the latency stays bounded when encoding or sending falls behind.
+    """
+    def __init__(self, latest=False):
+        self.latest = latest
+        self.relay = LatestFrameRelay() if latest else MediaRelay()
+        self.encoders = {}
+
+    def subscribe(self, track, bitrate=None):
+        return EncodedTrack(self, track, bitrate)
+
+    def encoder(self, track, codec, bitrate=None):
+        key = (id(track), codec.mimeType.lower(), bitrate)
+        if key not in self.encoders or self.encoders[key].source.readyState == "ended":
+            self.encoders[key] = SharedEncoder(self.relay, track, codec, bitrate, self.latest)
+        return self.encoders[key]
+
+    def stats(self):
+        return {f"{mime_type} {bitrate or 'default'}": encoder.stats()
+                for (_, mime_type, bitrate), encoder in self.encoders.items()}